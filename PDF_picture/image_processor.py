@@ -1,27 +1,109 @@
 import requests
+import io
 import os
+import time
+import random
 import logging
-from typing import Dict
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+from utils import create_session
 
 # 配置日志记录
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 这些状态码表示服务端暂时不可用，可以重试；其他 4xx 重试也不会成功
+RETRY_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
 class ImageProcessor:
-    def __init__(self, model_api_url: str, api_key: str = None):
+    def __init__(self, model_api_url: str, api_key: str = None, concurrency: int = 8, timeout=(10, 60),
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 10,
+                 session: requests.Session = None):
         """
         初始化图片处理器，设置模型 API 的 URL 和认证密钥。
 
+        所有请求共用一个带连接池的 Session（keep-alive），连接池大小与并发数一致。
+
         Args:
             model_api_url (str): 模型 API 的 URL。
             api_key (str, optional): API 密钥，用于认证。如果不需要认证，可为 None。
+            concurrency (int, optional): 同时发往模型 API 的最大请求数（包括多个线程共用同一处理器时）。
+            timeout (float | tuple, optional): 连接超时和读取超时（秒）。
+            max_retries (int, optional): 连接失败、超时或 408/429/5xx 时的最大重试次数。
+            backoff_base (float, optional): 第 n 次重试前等待 0 ~ backoff_base * 2^n 秒之间的随机时间。
+            backoff_max (float, optional): 单次等待的上限（秒）。
+            session (requests.Session, optional): 外部传入的会话；为 None 时创建自有会话，close() 时关闭。
         """
         self.model_api_url = model_api_url
         self.api_key = api_key
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._owns_session = session is None
+        # 重试由 _post 负责（带随机抖动），连接池层面不再重试
+        self.session = session or create_session(pool_maxsize=concurrency, retries=0)
+        self._slots = threading.BoundedSemaphore(concurrency)
+
+    def _backoff(self, attempt: int, response: requests.Response = None) -> float:
+        # 服务端给出 Retry-After（秒）时按它等待，否则使用带全抖动的指数退避
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _post(self, filename: str, open_body: Callable) -> requests.Response:
+        # open_body 每次调用返回一个新的可读对象，每次重试都从头上传
+        headers = {}
+        if self.api_key:
+            headers['Authorization'] = f'Bearer {self.api_key}'
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        attempt = 0
+        while True:
+            response = None
+            try:
+                with self._slots, open_body() as f:
+                    files = {'image': (filename, f, content_type)}
+                    response = self.session.post(self.model_api_url, files=files, headers=headers,
+                                                 timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response
+                error = requests.HTTPError(f"{response.status_code} {response.reason}", response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt >= self.max_retries:
+                raise error
+            delay = self._backoff(attempt, response)
+            attempt += 1
+            logger.info(f"图片 {filename} 上传失败（{error}），{delay:.2f}s 后第 {attempt} 次重试")
+            time.sleep(delay)
+
+    def _send(self, filename: str, open_body: Callable, label: str) -> Dict:
+        try:
+            response = self._post(filename, open_body)
+
+            # 解析响应
+            result = response.json()
+            if result.get('status') == 'error':
+                logger.error(f"API 返回错误: {result.get('message')}")
+                raise ValueError(f"API error: {result.get('message')}")
+
+            logger.info(f"图片 {label} 已由模型 API 处理")
+            return result
+        except requests.RequestException as e:
+            logger.error(f"发送图片到模型 API 失败: {e}")
+            raise
+        except ValueError as e:
+            logger.error(f"API 响应解析失败: {e}")
+            raise
 
     def send_to_model(self, image_path: str) -> Dict:
         """
-        将图片发送到模型 API 进行处理。
+        将图片发送到模型 API 进行处理，临时错误按带抖动的指数退避重试。
 
         Args:
             image_path (str): 图片文件路径。
@@ -32,36 +114,43 @@ class ImageProcessor:
         Raises:
             requests.RequestException: 如果 API 调用失败。
         """
-        try:
-            with open(image_path, 'rb') as f:
-                # 准备文件上传
-                files = {'image': (os.path.basename(image_path), f, 'image/png')}
-                
-                # 设置请求头（如果需要认证）
-                headers = {}
-                if self.api_key:
-                    headers['Authorization'] = f'Bearer {self.api_key}'
-                
-                # 发送 POST 请求
-                response = requests.post(
-                    self.model_api_url,
-                    files=files,
-                    headers=headers,
-                    timeout=30  # 设置超时，避免长时间挂起
-                )
-                response.raise_for_status()
-                
-                # 解析响应
-                result = response.json()
-                if result.get('status') == 'error':
-                    logger.error(f"API 返回错误: {result.get('message')}")
-                    raise ValueError(f"API error: {result.get('message')}")
-                
-                logger.info(f"图片 {image_path} 已由模型 API 处理")
-                return result
-        except requests.RequestException as e:
-            logger.error(f"发送图片到模型 API 失败: {e}")
-            raise
-        except ValueError as e:
-            logger.error(f"API 响应解析失败: {e}")
-            raise
\ No newline at end of file
+        return self._send(os.path.basename(image_path), lambda: open(image_path, 'rb'), image_path)
+
+    def send_image(self, data: bytes, filename: str) -> Dict:
+        """
+        将内存中已编码的图片发送到模型 API，不经过磁盘。
+
+        Args:
+            data (bytes): 图片内容（bytes 或 memoryview）。
+            filename (str): 上传时使用的文件名，同时用于推断 Content-Type（如 page_1.png）。
+
+        Returns:
+            Dict: 模型 API 的响应结果。
+
+        Raises:
+            requests.RequestException: 如果 API 调用失败。
+        """
+        return self._send(filename, lambda: io.BytesIO(data), filename)
+
+    def send_many(self, image_paths: List[str]) -> List[Dict]:
+        """
+        并发发送多张图片，最多 concurrency 个请求同时进行，结果按输入顺序（即页码顺序）返回。
+
+        Args:
+            image_paths (List[str]): 图片文件路径列表。
+
+        Returns:
+            List[Dict]: 与 image_paths 一一对应的模型 API 响应结果。
+
+        Raises:
+            requests.RequestException: 如果任一图片的 API 调用失败。
+        """
+        if not image_paths:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(image_paths))) as pool:
+            return list(pool.map(self.send_to_model, image_paths))
+
+    def close(self):
+        """关闭自有会话，释放连接池。"""
+        if self._owns_session:
+            self.session.close()
\ No newline at end of file
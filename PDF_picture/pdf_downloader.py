@@ -1,34 +1,130 @@
 import requests
 import os
+import hashlib
+import uuid
 import logging
+from typing import NamedTuple, Optional, Tuple
+from utils import SpillBuffer, create_session
 
 # 配置日志记录
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+class DownloadResult(NamedTuple):
+    path: str
+    size: int
+    digest: Optional[str]
+
 class PDFDownloader:
-    def download_pdf(self, pdf_url: str, temp_dir: str) -> str:
+    def __init__(self, session: requests.Session = None, timeout=(10, 60), chunk_size: int = 1024 * 1024,
+                 buffer_size: int = -1, pool_maxsize: int = 10):
         """
-        从指定URL下载PDF文件到临时目录。
+        初始化 PDF 下载器。同一个下载器的所有下载共用一个带连接池的 Session（keep-alive）。
+
+        Args:
+            session (requests.Session, optional): 外部传入的会话；为 None 时创建自有会话，close() 时关闭。
+            timeout (float | tuple, optional): 连接超时和读取超时（秒），读取超时指两次收到数据之间的间隔。
+            chunk_size (int, optional): 每次从网络读取并写入磁盘的块大小，内存占用与它相当而不是与文件大小相当。
+            buffer_size (int, optional): 写文件的缓冲区大小，-1 表示使用系统默认值。
+            pool_maxsize (int, optional): 自有会话每个主机保留的最大连接数。
+        """
+        self._owns_session = session is None
+        self.session = session or create_session(pool_maxsize=pool_maxsize)
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+
+    def download(self, pdf_url: str, temp_dir: str, filename: str = None,
+                 hash_algorithm: str = None) -> DownloadResult:
+        """
+        以流式方式把 PDF 逐块写入临时目录，可在写入的同时计算哈希。
+
+        先写入 .part 文件，下载完整后再改名，失败时删除残留文件。
 
         Args:
             pdf_url (str): PDF文件的URL。
             temp_dir (str): 临时目录路径，用于存储下载的PDF。
+            filename (str, optional): 保存的文件名；为 None 时生成唯一文件名，多个下载可共用同一目录。
+            hash_algorithm (str, optional): hashlib 支持的算法名（如 'sha256'），为 None 时不计算。
 
         Returns:
-            str: 下载的PDF文件路径。
+            DownloadResult: 文件路径、字节数和十六进制摘要（未计算时为 None）。
 
         Raises:
             requests.RequestException: 如果下载失败。
         """
+        pdf_path = os.path.join(temp_dir, filename or f"{uuid.uuid4().hex}.pdf")
+        part_path = pdf_path + '.part'
         try:
-            response = requests.get(pdf_url, stream=True)
-            response.raise_for_status()
-            pdf_path = os.path.join(temp_dir, "input.pdf")
-            with open(pdf_path, 'wb') as f:
-                f.write(response.content)
-            logger.info(f"PDF下载到: {pdf_path}")
-            return pdf_path
-        except requests.RequestException as e:
+            with open(part_path, 'wb', buffering=self.buffer_size) as f:
+                size, digest = self._stream_to(pdf_url, f, hash_algorithm)
+            os.replace(part_path, pdf_path)
+        except (requests.RequestException, OSError) as e:
+            logger.error(f"PDF下载失败: {e}")
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        logger.info(f"PDF下载到: {pdf_path}（{size} 字节）" + (f"，{hash_algorithm}: {digest}" if digest else ""))
+        return DownloadResult(pdf_path, size, digest)
+
+    def download_to_buffer(self, pdf_url: str, spill_threshold: int = 64 * 1024 * 1024,
+                           hash_algorithm: str = None) -> Tuple[SpillBuffer, Optional[str]]:
+        """
+        以流式方式把 PDF 下载到内存，超过 spill_threshold 字节时转存为磁盘临时文件。
+
+        Args:
+            pdf_url (str): PDF文件的URL。
+            spill_threshold (int, optional): 内存中保留的最大字节数。
+            hash_algorithm (str, optional): hashlib 支持的算法名（如 'sha256'），为 None 时不计算。
+
+        Returns:
+            Tuple[SpillBuffer, Optional[str]]: PDF 内容（调用方负责 close）和十六进制摘要（未计算时为 None）。
+
+        Raises:
+            requests.RequestException: 如果下载失败。
+        """
+        buffer = SpillBuffer(spill_threshold)
+        try:
+            size, digest = self._stream_to(pdf_url, buffer, hash_algorithm)
+        except (requests.RequestException, OSError) as e:
             logger.error(f"PDF下载失败: {e}")
-            raise
\ No newline at end of file
+            buffer.close()
+            raise
+        logger.info(f"PDF下载到{'临时文件' if buffer.spilled else '内存'}（{size} 字节）"
+                    + (f"，{hash_algorithm}: {digest}" if digest else ""))
+        return buffer, digest
+
+    def _stream_to(self, pdf_url: str, f, hash_algorithm: str = None) -> Tuple[int, Optional[str]]:
+        # 逐块写入 f，同时计算哈希，返回字节数和摘要
+        hasher = hashlib.new(hash_algorithm) if hash_algorithm else None
+        size = 0
+        with self.session.get(pdf_url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                f.write(chunk)
+                size += len(chunk)
+                if hasher:
+                    hasher.update(chunk)
+        return size, hasher.hexdigest() if hasher else None
+
+    def download_pdf(self, pdf_url: str, temp_dir: str, filename: str = None) -> str:
+        """
+        从指定URL下载PDF文件到临时目录。
+
+        Args:
+            pdf_url (str): PDF文件的URL。
+            temp_dir (str): 临时目录路径，用于存储下载的PDF。
+            filename (str, optional): 保存的文件名，为 None 时生成唯一文件名。
+
+        Returns:
+            str: 下载的PDF文件路径。
+
+        Raises:
+            requests.RequestException: 如果下载失败。
+        """
+        return self.download(pdf_url, temp_dir, filename).path
+
+    def close(self):
+        """关闭自有会话，释放连接池。"""
+        if self._owns_session:
+            self.session.close()
\ No newline at end of file
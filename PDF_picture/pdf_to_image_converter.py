@@ -1,36 +1,202 @@
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
+import io
 import os
 import logging
-from typing import List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple
 
 # 配置日志记录
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 输出格式对应的 PIL 编码器和文件扩展名
+_PIL_FORMATS = {'png': ('PNG', 'png'), 'jpeg': ('JPEG', 'jpg'), 'jpg': ('JPEG', 'jpg'),
+                'tiff': ('TIFF', 'tif'), 'tif': ('TIFF', 'tif'), 'ppm': ('PPM', 'ppm')}
+
 class PDFToImageConverter:
-    def pdf_to_images(self, pdf_path: str, temp_dir: str) -> List[str]:
+    def __init__(self, dpi: int = 200, fmt: str = 'png', thread_count: int = None, pages_per_task: int = 4,
+                 max_pages_in_memory: int = 32, timeout: int = None, poppler_path: str = None):
+        """
+        初始化 PDF 转图片的转换器。
+
+        PDF 按页码范围拆分成多个任务，每个任务由一个独立的 pdftoppm 进程渲染，最多 thread_count 个进程同时运行。
+
+        Args:
+            dpi (int, optional): 渲染分辨率。
+            fmt (str, optional): 输出格式，pdftoppm 支持的 'png'、'jpeg'、'tiff'、'ppm'。
+            thread_count (int, optional): 同时运行的渲染进程数，默认等于 CPU 核数。
+            pages_per_task (int, optional): 每个渲染进程负责的页数，越大进程启动开销越小，但负载越不均衡。
+            max_pages_in_memory (int, optional): 已渲染但调用方尚未取走的页数上限（含正在渲染的页），
+                限制 iter_images 的内存占用，也限制 iter_image_files 超前渲染的页数。
+            timeout (int, optional): 单个渲染进程的超时时间（秒）。
+            poppler_path (str, optional): poppler 可执行文件所在目录，为 None 时从 PATH 中查找。
+        """
+        self.dpi = dpi
+        self.fmt = fmt
+        self.thread_count = thread_count or os.cpu_count() or 1
+        self.pages_per_task = max(1, min(pages_per_task, max_pages_in_memory))
+        self.max_pages_in_memory = max_pages_in_memory
+        self.timeout = timeout
+        self.poppler_path = poppler_path
+
+    @property
+    def extension(self) -> str:
+        """输出图片的文件扩展名（不含点）。"""
+        return _PIL_FORMATS[self.fmt.lower()][1]
+
+    def page_count(self, pdf_path: str) -> int:
+        """返回 PDF 的总页数。"""
+        return pdfinfo_from_path(pdf_path, poppler_path=self.poppler_path)['Pages']
+
+    def _page_ranges(self, pdf_path: str, first_page: int = None, last_page: int = None) -> List[Tuple[int, int]]:
+        page_count = self.page_count(pdf_path)
+        first_page = max(first_page or 1, 1)
+        last_page = min(last_page or page_count, page_count)
+        return [(start, min(start + self.pages_per_task - 1, last_page))
+                for start in range(first_page, last_page + 1, self.pages_per_task)]
+
+    def _render(self, pdf_path: str, first_page: int, last_page: int, output_dir: str = None,
+                encode: bool = False) -> list:
+        # 每个任务单独启动一个 pdftoppm 进程；指定 output_dir 时直接写文件，只返回路径。
+        # encode 为 True 时 pdftoppm 输出未压缩的 PPM，只在这里按 fmt 编码一次
+        prefix = f"render_{first_page:05d}_"
+        images = convert_from_path(
+            pdf_path,
+            dpi=self.dpi,
+            fmt='ppm' if encode else self.fmt,
+            first_page=first_page,
+            last_page=last_page,
+            output_folder=output_dir,
+            paths_only=output_dir is not None,
+            output_file=(name for name in [prefix]),
+            thread_count=1,
+            timeout=self.timeout,
+            poppler_path=self.poppler_path,
+        )
+        if len(images) != last_page - first_page + 1:
+            raise RuntimeError(f"第 {first_page}-{last_page} 页渲染出 {len(images)} 张图片")
+        if encode:
+            return [self._encode(image) for image in images]
+        if output_dir is None:
+            return images
+        # pdftoppm 的文件名形如 render_00001_-001.png，统一改名为 page_N.<ext>
+        paths = []
+        for page, path in zip(range(first_page, last_page + 1), images):
+            page_path = os.path.join(output_dir, f"page_{page}{os.path.splitext(path)[1]}")
+            os.replace(path, page_path)
+            paths.append(page_path)
+        return paths
+
+    def _encode(self, image) -> bytes:
+        buffer = io.BytesIO()
+        image.save(buffer, _PIL_FORMATS[self.fmt.lower()][0])
+        image.close()
+        return buffer.getvalue()
+
+    def _iter_rendered(self, pdf_path: str, first_page: int, last_page: int, output_dir: str = None,
+                       encode: bool = False) -> Iterator[Tuple[int, object]]:
+        # 按页码顺序产出渲染结果；进行中和已完成未取走的任务合计不超过 max_pages_in_memory 页
+        ranges = deque(self._page_ranges(pdf_path, first_page, last_page))
+        max_tasks = max(1, self.max_pages_in_memory // self.pages_per_task)
+        pool = ThreadPoolExecutor(max_workers=min(self.thread_count, max_tasks))
+        pending = deque()
+        try:
+            while ranges or pending:
+                while ranges and len(pending) < max_tasks:
+                    start, end = ranges.popleft()
+                    pending.append((start, pool.submit(self._render, pdf_path, start, end, output_dir, encode)))
+                start, future = pending.popleft()
+                for offset, image in enumerate(future.result()):
+                    yield start + offset, image
+        finally:
+            # 调用方提前停止迭代或出错时，取消尚未开始的任务
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def iter_image_files(self, pdf_path: str, temp_dir: str, first_page: int = None,
+                         last_page: int = None) -> Iterator[Tuple[int, str]]:
         """
-        将PDF文件转换为一页页的PNG图片。
+        多进程渲染 PDF，图片由 pdftoppm 直接写入 temp_dir，按页码顺序逐页产出，不在内存中保留图片。
 
         Args:
             pdf_path (str): PDF文件路径。
             temp_dir (str): 临时目录路径，用于存储生成的图片。
+            first_page (int, optional): 起始页（从 1 开始），默认第一页。
+            last_page (int, optional): 结束页（包含），默认最后一页。
 
-        Returns:
-            List[str]: 生成的图片文件路径列表。
+        Yields:
+            Tuple[int, str]: 页码和图片文件路径（page_N.<fmt>）。
 
         Raises:
             Exception: 如果PDF转换失败。
         """
         try:
-            images = convert_from_path(pdf_path)
-            image_paths = []
-            for i, image in enumerate(images):
-                image_path = os.path.join(temp_dir, f"page_{i+1}.png")
-                image.save(image_path, 'PNG')
-                image_paths.append(image_path)
-            logger.info(f"PDF转换为 {len(image_paths)} 张图片")
-            return image_paths
+            yield from self._iter_rendered(pdf_path, first_page, last_page, output_dir=temp_dir)
         except Exception as e:
             logger.error(f"PDF转换图片失败: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    def iter_images(self, pdf_path: str, first_page: int = None, last_page: int = None) -> Iterator[Tuple[int, object]]:
+        """
+        多进程渲染 PDF，按页码顺序逐页产出 PIL 图片，内存中最多保留 max_pages_in_memory 页。
+
+        Args:
+            pdf_path (str): PDF文件路径。
+            first_page (int, optional): 起始页（从 1 开始），默认第一页。
+            last_page (int, optional): 结束页（包含），默认最后一页。
+
+        Yields:
+            Tuple[int, PIL.Image.Image]: 页码和图片。
+
+        Raises:
+            Exception: 如果PDF转换失败。
+        """
+        try:
+            yield from self._iter_rendered(pdf_path, first_page, last_page)
+        except Exception as e:
+            logger.error(f"PDF转换图片失败: {e}")
+            raise
+
+    def iter_image_buffers(self, pdf_path: str, first_page: int = None,
+                           last_page: int = None) -> Iterator[Tuple[int, bytes]]:
+        """
+        多进程渲染 PDF，按页码顺序逐页产出编码好的图片内容（fmt 格式），不写任何文件。
+
+        渲染进程输出未压缩的图像，在渲染线程中编码一次；内存中最多保留 max_pages_in_memory 页。
+
+        Args:
+            pdf_path (str): PDF文件路径（可以是 SpillBuffer.path 这样的内存文件路径）。
+            first_page (int, optional): 起始页（从 1 开始），默认第一页。
+            last_page (int, optional): 结束页（包含），默认最后一页。
+
+        Yields:
+            Tuple[int, bytes]: 页码和编码后的图片内容。
+
+        Raises:
+            Exception: 如果PDF转换失败。
+        """
+        try:
+            yield from self._iter_rendered(pdf_path, first_page, last_page, encode=True)
+        except Exception as e:
+            logger.error(f"PDF转换图片失败: {e}")
+            raise
+
+    def pdf_to_images(self, pdf_path: str, temp_dir: str, first_page: int = None, last_page: int = None) -> List[str]:
+        """
+        将PDF文件转换为一页页的图片（默认 PNG），由多个渲染进程直接写入临时目录。
+
+        Args:
+            pdf_path (str): PDF文件路径。
+            temp_dir (str): 临时目录路径，用于存储生成的图片。
+            first_page (int, optional): 起始页（从 1 开始），默认第一页。
+            last_page (int, optional): 结束页（包含），默认最后一页。
+
+        Returns:
+            List[str]: 生成的图片文件路径列表。
+
+        Raises:
+            Exception: 如果PDF转换失败。
+        """
+        image_paths = [path for _, path in self.iter_image_files(pdf_path, temp_dir, first_page, last_page)]
+        logger.info(f"PDF转换为 {len(image_paths)} 张图片")
+        return image_paths
\ No newline at end of file
@@ -1,5 +1,11 @@
-from typing import List, Dict
+from typing import AsyncIterator, Dict, Iterator, List, Tuple
+import asyncio
 import logging
+import os
+import queue
+import threading
+from collections import deque
+from contextlib import closing
 from utils import create_temp_dir, cleanup_temp_dir
 from pdf_downloader import PDFDownloader
 from pdf_to_image_converter import PDFToImageConverter
@@ -9,21 +15,199 @@ from image_processor import ImageProcessor
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 流水线各阶段之间的结束标记
+_DONE = object()
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    # 有界队列满时阻塞等待，流水线停止时放弃
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
 class PDFToImageToolkit:
-    def __init__(self, model_api_url: str, api_key: str = None):
+    def __init__(self, model_api_url: str, api_key: str = None, converter: PDFToImageConverter = None,
+                 processor: ImageProcessor = None, upload_workers: int = None, queue_size: int = 8,
+                 in_memory: bool = False, spill_threshold: int = 64 * 1024 * 1024):
         """
         初始化 PDF 到图片的工具包。
 
         Args:
             model_api_url (str): 模型 API 的 URL。
             api_key (str, optional): API 密钥，用于认证。如果不需要认证，可为 None。
+            converter (PDFToImageConverter, optional): 自定义 DPI、格式、渲染进程数等的转换器。
+            processor (ImageProcessor, optional): 自定义并发数、超时、重试策略的图片处理器。
+            upload_workers (int, optional): 上传线程数，默认等于 processor 的并发数。
+            queue_size (int, optional): 已渲染、等待上传的页数上限，超过时渲染暂停。
+            in_memory (bool, optional): 为 True 时不创建临时目录：PDF 下载到内存，页面编码后直接从内存上传。
+            spill_threshold (int, optional): 内存模式下 PDF 超过该字节数时转存为临时文件（关闭后自动删除）。
         """
         self.model_api_url = model_api_url
         self.api_key = api_key
-        self.temp_dir = None
+        self.queue_size = queue_size
+        self.in_memory = in_memory
+        self.spill_threshold = spill_threshold
+        self.temp_dirs = set()
         self.downloader = PDFDownloader()
-        self.converter = PDFToImageConverter()
-        self.processor = ImageProcessor(model_api_url, api_key)
+        self.converter = converter or PDFToImageConverter()
+        self.processor = processor or ImageProcessor(model_api_url, api_key)
+        self.upload_workers = upload_workers or self.processor.concurrency
+
+    def _render_stage(self, rendered: Iterator, pages: queue.Queue, order: deque, results: queue.Queue,
+                      stop: threading.Event) -> None:
+        # 渲染线程：按页码顺序把图片（文件路径或内存中的内容）放入 pages，最后给每个上传线程放一个结束标记
+        try:
+            with closing(rendered):
+                for page, image in rendered:
+                    order.append(page)
+                    if not _put(pages, (page, image), stop):
+                        return
+        except Exception as e:
+            results.put((None, None, e))
+            return
+        for _ in range(self.upload_workers):
+            if not _put(pages, _DONE, stop):
+                return
+
+    def _upload_stage(self, pages: queue.Queue, results: queue.Queue, stop: threading.Event) -> None:
+        # 上传线程：上传完成后立即删除图片文件，磁盘上只保留等待上传的页
+        while True:
+            item = _get(pages, stop)
+            if item is _DONE:
+                results.put(_DONE)
+                return
+            page, image = item
+            try:
+                if isinstance(image, str):
+                    result = self.processor.send_to_model(image)
+                else:
+                    result = self.processor.send_image(image, f"page_{page}.{self.converter.extension}")
+            except Exception as e:
+                results.put((page, None, e))
+                return
+            finally:
+                if isinstance(image, str):
+                    os.remove(image)
+            results.put((page, result, None))
+
+    def iter_process_pdf(self, pdf_url: str, first_page: int = None, last_page: int = None,
+                         ordered: bool = True) -> Iterator[Tuple[int, Dict]]:
+        """
+        流水线处理 PDF：下载完成后，渲染与上传在不同线程中同时进行，每页结果一完成即产出。
+
+        渲染线程和上传线程之间是容量为 queue_size 的有界队列，上传跟不上时渲染自动暂停。
+        调用方提前停止迭代或任一步骤失败时，停止所有阶段并清理临时目录（内存模式下释放缓冲区）。
+
+        Args:
+            pdf_url (str): PDF 文件的 URL。
+            first_page (int, optional): 起始页（从 1 开始），默认第一页。
+            last_page (int, optional): 结束页（包含），默认最后一页。
+            ordered (bool, optional): 为 True 时按页码顺序产出，否则按完成顺序产出。
+
+        Yields:
+            Tuple[int, Dict]: 页码和该页的模型 API 处理结果。
+
+        Raises:
+            Exception: 如果处理过程中的任何步骤失败。
+        """
+        return self._pipeline(pdf_url, first_page, last_page, ordered, threading.Event())
+
+    def _pipeline(self, pdf_url: str, first_page: int, last_page: int, ordered: bool,
+                  stop: threading.Event) -> Iterator[Tuple[int, Dict]]:
+        # 其他线程设置 stop 后，正在等待结果的 next() 会尽快返回，生成器随即结束并清理
+        temp_dir = None
+        source = None
+        threads = []
+        try:
+            if self.in_memory:
+                # 渲染进程通过 source.path 直接读取内存中的 PDF，页面编码后留在内存中
+                source, _ = self.downloader.download_to_buffer(pdf_url, self.spill_threshold)
+                rendered = self.converter.iter_image_buffers(source.path, first_page, last_page)
+            else:
+                temp_dir = create_temp_dir()
+                self.temp_dirs.add(temp_dir)
+                pdf_path = self.downloader.download_pdf(pdf_url, temp_dir)
+                rendered = self.converter.iter_image_files(pdf_path, temp_dir, first_page, last_page)
+
+            pages = queue.Queue(maxsize=self.queue_size)
+            results = queue.Queue()
+            order = deque()
+            threads.append(threading.Thread(
+                target=self._render_stage,
+                args=(rendered, pages, order, results, stop),
+                daemon=True,
+            ))
+            for _ in range(self.upload_workers):
+                threads.append(threading.Thread(target=self._upload_stage, args=(pages, results, stop), daemon=True))
+            for thread in threads:
+                thread.start()
+
+            finished = {}
+            running = self.upload_workers
+            while running:
+                item = _get(results, stop)
+                if stop.is_set():
+                    return
+                if item is _DONE:
+                    running -= 1
+                    continue
+                page, result, error = item
+                if error is not None:
+                    raise error
+                if not ordered:
+                    yield page, result
+                    continue
+                # 等待中的较小页码完成后，按顺序产出已完成的页
+                finished[page] = result
+                while order and order[0] in finished:
+                    next_page = order.popleft()
+                    yield next_page, finished.pop(next_page)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            if source is not None:
+                source.close()
+            if temp_dir is not None:
+                cleanup_temp_dir(temp_dir)
+                self.temp_dirs.discard(temp_dir)
+
+    async def aiter_process_pdf(self, pdf_url: str, first_page: int = None, last_page: int = None,
+                                ordered: bool = True) -> AsyncIterator[Tuple[int, Dict]]:
+        """
+        iter_process_pdf 的异步版本，流水线在线程中运行，不阻塞事件循环。
+
+        任务被取消时先停止流水线、等待各线程退出并清理临时目录，再抛出 CancelledError。
+        提前停止迭代时请用 contextlib.aclosing 包装，以便立即清理。
+        """
+        stop = threading.Event()
+        results = self._pipeline(pdf_url, first_page, last_page, ordered, stop)
+        pending = None
+        try:
+            while True:
+                # 线程中的 next() 无法被取消：用 shield 保证任务被取消时它仍在运行，留到 finally 中等待
+                pending = asyncio.ensure_future(asyncio.to_thread(next, results, _DONE))
+                item = await asyncio.shield(pending)
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            # 生成器仍在线程中执行时不能 close()：先通知流水线停止，等这次 next() 返回后再关闭
+            stop.set()
+            if pending is not None and not pending.done():
+                await asyncio.wait({pending})
+            await asyncio.to_thread(results.close)
 
     def process_pdf(self, pdf_url: str) -> List[Dict]:
         """
@@ -38,35 +222,15 @@ class PDFToImageToolkit:
         Raises:
             Exception: 如果处理过程中的任何步骤失败。
         """
-        try:
-            # 创建临时目录
-            self.temp_dir = create_temp_dir()
-            
-            # 下载 PDF
-            pdf_path = self.downloader.download_pdf(pdf_url, self.temp_dir)
-            
-            # 转换为图片
-            image_paths = self.converter.pdf_to_images(pdf_path, self.temp_dir)
-            
-            # 处理每张图片
-            results = []
-            for image_path in image_paths:
-                result = self.processor.send_to_model(image_path)
-                results.append(result)
-            
-            return results
-        
-        finally:
-            # 清理临时目录
-            cleanup_temp_dir(self.temp_dir)
-            self.temp_dir = None
+        return [result for _, result in self.iter_process_pdf(pdf_url)]
 
     def __del__(self):
         """
         析构函数，确保临时目录在对象销毁时被清理。
         """
-        cleanup_temp_dir(self.temp_dir)
-        self.temp_dir = None
+        for temp_dir in list(self.temp_dirs):
+            cleanup_temp_dir(temp_dir)
+        self.temp_dirs.clear()
 
 def main():
     """
@@ -78,9 +242,9 @@ def main():
     
     toolkit = PDFToImageToolkit(model_api_url, api_key)
     try:
-        results = toolkit.process_pdf(pdf_url)
-        for i, result in enumerate(results):
-            logger.info(f"第 {i+1} 页的处理结果: {result}")
+        # 每页处理完成即输出，不必等整份 PDF 处理完
+        for page, result in toolkit.iter_process_pdf(pdf_url):
+            logger.info(f"第 {page} 页的处理结果: {result}")
     except Exception as e:
         logger.error(f"处理失败: {e}")
 
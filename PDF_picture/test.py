@@ -1,9 +1,23 @@
+import asyncio
+import hashlib
+import http.server
+import io
+import json
 import logging
 import os
-from utils import create_temp_dir, cleanup_temp_dir
+import random
+import re
+import sys
+import threading
+import time
+import requests
+from PIL import Image
+from utils import SpillBuffer, create_temp_dir, cleanup_temp_dir
 from pdf_downloader import PDFDownloader
+import pdf_to_image_converter
 from pdf_to_image_converter import PDFToImageConverter
 from image_processor import ImageProcessor
+from pdf_to_image_toolkit import PDFToImageToolkit
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -50,9 +64,416 @@ def test_image_processor():
     except Exception as e:
         logger.error(f"图片处理失败: {e}")
 
+class LocalServer:
+    """
+    在后台线程中运行的本地 HTTP 服务，供不联网的测试使用：GET 返回 files 中对应路径的内容，
+    POST 模拟模型 API，按上传的文件名返回 {"status": "ok", "filename": ...}，delays 指定各文件的处理耗时；
+    failures 中的 (状态码, 响应头) 依次用于之后的 POST，max_active 记录同时处理的最大请求数。
+
+    使用 HTTP/1.1 keep-alive，connections 记录建立过的连接数，用来确认会话复用了连接。
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.delays = {}
+        self.failures = []
+        self.uploads = []
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        owner = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with owner._lock:
+                    owner.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                body = owner.files.get(self.path)
+                if body is None:
+                    self.respond(404, b'not found')
+                else:
+                    self.respond(200, body, 'application/pdf')
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                filename = re.search(rb'filename="([^"]+)"', body).group(1).decode()
+                with owner._lock:
+                    owner.uploads.append(filename)
+                    failure = owner.failures.pop(0) if owner.failures else None
+                    owner.active += 1
+                    owner.max_active = max(owner.max_active, owner.active)
+                try:
+                    if failure is not None:
+                        status, headers = failure
+                        self.respond(status, b'{}', 'application/json', headers)
+                        return
+                    time.sleep(owner.delays.get(filename, 0))
+                    self.respond(200, json.dumps({'status': 'ok', 'filename': filename}).encode(), 'application/json')
+                finally:
+                    with owner._lock:
+                        owner.active -= 1
+
+            def respond(self, status, body, content_type='text/plain', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+def make_pdf_bytes(size: int) -> bytes:
+    # 只需要以 PDF 文件头开头，内容本身不会被解析
+    return b'%PDF-1.4\n' + random.Random(size).randbytes(size - 9)
+
+def test_download_local():
+    """本地服务上的流式下载：内容和哈希正确、多次下载复用连接、失败时不留下 .part 文件"""
+    data = make_pdf_bytes(3 * 1024 * 1024 + 17)
+    temp_dir = create_temp_dir()
+    with LocalServer() as server:
+        server.files['/doc.pdf'] = data
+        downloader = PDFDownloader(chunk_size=64 * 1024)
+        try:
+            first = downloader.download(server.url + '/doc.pdf', temp_dir, hash_algorithm='sha256')
+            assert first.size == len(data), f"大小错误: {first.size}"
+            assert first.digest == hashlib.sha256(data).hexdigest(), "sha256 与内容不一致"
+            with open(first.path, 'rb') as f:
+                assert f.read() == data, "下载的内容与服务端不一致"
+            second = downloader.download_pdf(server.url + '/doc.pdf', temp_dir)
+            assert second != first.path, "不指定文件名时每次下载应生成不同的文件名"
+            assert server.connections == 1, f"两次下载应复用同一个连接，实际建立了 {server.connections} 个"
+            try:
+                downloader.download(server.url + '/missing.pdf', temp_dir, filename='missing.pdf')
+            except requests.HTTPError:
+                pass
+            else:
+                raise AssertionError("404 时应抛出 HTTPError")
+            assert sorted(os.listdir(temp_dir)) == sorted(os.path.basename(p) for p in (first.path, second)), \
+                f"失败的下载不应留下文件: {os.listdir(temp_dir)}"
+        finally:
+            downloader.close()
+            cleanup_temp_dir(temp_dir)
+
+class FakePoppler:
+    """
+    替换 pdf_to_image_converter 使用的 convert_from_path / pdfinfo_from_path，不需要安装 poppler。
+
+    PDF 固定有 pages 页，第 N 页渲染为 4x4、红色分量为 N 的图片；指定输出目录时像 pdftoppm 一样按
+    前缀写文件并返回路径。delay(first_page) 为每个渲染任务的耗时，fail_page 所在的任务抛出异常。
+    """
+
+    def __init__(self, pages: int, delay=None, fail_page: int = None):
+        self.pages = pages
+        self.delay = delay or (lambda first_page: 0)
+        self.fail_page = fail_page
+        self.calls = []
+        self.sources = []
+        self.headers = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._saved = (pdf_to_image_converter.convert_from_path, pdf_to_image_converter.pdfinfo_from_path)
+        pdf_to_image_converter.convert_from_path = self.convert_from_path
+        pdf_to_image_converter.pdfinfo_from_path = self.pdfinfo_from_path
+        return self
+
+    def __exit__(self, *exc_info):
+        pdf_to_image_converter.convert_from_path, pdf_to_image_converter.pdfinfo_from_path = self._saved
+
+    def pdfinfo_from_path(self, pdf_path, poppler_path=None):
+        return {'Pages': self.pages}
+
+    def convert_from_path(self, pdf_path, first_page, last_page, fmt, output_folder=None, output_file=None,
+                          **options):
+        # 和渲染进程一样通过路径读取 PDF（内存模式下是 /proc/<pid>/fd/<fd>）
+        with open(pdf_path, 'rb') as f:
+            header = f.read(5)
+        with self._lock:
+            self.calls.append((first_page, last_page))
+            self.sources.append(pdf_path)
+            self.headers.append(header)
+        time.sleep(self.delay(first_page))
+        if self.fail_page is not None and first_page <= self.fail_page <= last_page:
+            raise RuntimeError(f"第 {self.fail_page} 页渲染失败")
+        pages = range(first_page, last_page + 1)
+        images = [Image.new('RGB', (4, 4), (page, 0, 0)) for page in pages]
+        if output_folder is None:
+            return images
+        prefix = next(output_file)
+        paths = []
+        for page, image in zip(pages, images):
+            path = os.path.join(output_folder, f"{prefix}-{page:03d}.{fmt}")
+            image.save(path, 'PNG' if fmt == 'png' else 'PPM')
+            paths.append(path)
+        return paths
+
+def page_of(image) -> int:
+    # FakePoppler 渲染的页面：红色分量即页码
+    with Image.open(image) as opened:
+        return opened.getpixel((0, 0))[0]
+
+def test_converter_local():
+    """并行渲染：结果按页码顺序产出并改名为 page_N、页码范围正确、超前渲染有上限、提前停止时取消剩余任务"""
+    temp_dir = create_temp_dir()
+    pdf_path = os.path.join(temp_dir, 'doc.pdf')
+    with open(pdf_path, 'wb') as f:
+        f.write(make_pdf_bytes(1024))
+    try:
+        # 越靠前的任务越慢，完成顺序与页码顺序相反
+        with FakePoppler(10, delay=lambda first_page: 0.02 * (10 - first_page)) as poppler:
+            converter = PDFToImageConverter(thread_count=4, pages_per_task=3)
+            paths = converter.pdf_to_images(pdf_path, temp_dir)
+            assert paths == [os.path.join(temp_dir, f"page_{page}.png") for page in range(1, 11)], paths
+            assert [page_of(path) for path in paths] == list(range(1, 11)), "图片内容与页码不对应"
+            assert sorted(poppler.calls) == [(1, 3), (4, 6), (7, 9), (10, 10)], poppler.calls
+
+        with FakePoppler(10) as poppler:
+            pages = [page for page, _ in converter.iter_image_files(pdf_path, temp_dir, first_page=3, last_page=7)]
+            assert pages == [3, 4, 5, 6, 7] and sorted(poppler.calls) == [(3, 5), (6, 7)], poppler.calls
+            buffers = list(converter.iter_image_buffers(pdf_path, first_page=9))
+            assert [(page, page_of(io.BytesIO(data))) for page, data in buffers] == [(9, 9), (10, 10)], \
+                "内存模式应按 fmt 编码每一页"
+
+        # 每个任务 2 页、最多 4 页未取走：取到第 N 页时最多已开始 (N - 1) // 2 + 2 个任务
+        with FakePoppler(20) as poppler:
+            converter = PDFToImageConverter(thread_count=4, pages_per_task=2, max_pages_in_memory=4)
+            images = converter.iter_images(pdf_path)
+            for page, image in images:
+                assert len(poppler.calls) <= (page - 1) // 2 + 2, f"取到第 {page} 页时已开始 {len(poppler.calls)} 个任务"
+                if page == 5:
+                    break
+            images.close()
+            assert len(poppler.calls) <= 4, f"提前停止后不应继续渲染，已开始 {len(poppler.calls)} 个任务"
+
+        with FakePoppler(10, fail_page=5):
+            try:
+                converter.pdf_to_images(pdf_path, temp_dir)
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError("渲染失败时应抛出异常")
+    finally:
+        cleanup_temp_dir(temp_dir)
+
+def expect_request_error(call, status=None):
+    try:
+        call()
+    except requests.HTTPError as e:
+        assert status is None or e.response.status_code == status, f"状态码应为 {status}: {e}"
+    except requests.ConnectionError:
+        assert status is None, "应抛出 HTTPError"
+    else:
+        raise AssertionError("请求应失败")
+
+def test_upload_retry_local():
+    """上传重试：503 后按 Retry-After 等待并重试成功、重试次数用完或 4xx 时抛出、并发数不超过 concurrency"""
+    with LocalServer() as server:
+        model_url = server.url + '/model'
+        # 退避基数很小，只有按 Retry-After 等待才会超过 1 秒
+        processor = ImageProcessor(model_url, max_retries=2, backoff_base=0.001)
+        try:
+            server.failures.append((503, {'Retry-After': '1'}))
+            start = time.monotonic()
+            result = processor.send_image(b'image', 'page_1.png')
+            assert result == {'status': 'ok', 'filename': 'page_1.png'}, result
+            assert server.uploads == ['page_1.png', 'page_1.png'], server.uploads
+            assert time.monotonic() - start >= 0.9, "应按 Retry-After 等待后再重试"
+
+            server.uploads.clear()
+            server.failures.extend([(503, {})] * 3)
+            expect_request_error(lambda: processor.send_image(b'image', 'page_2.png'), 503)
+            assert len(server.uploads) == 3, f"max_retries=2 时应共尝试 3 次，实际 {len(server.uploads)} 次"
+
+            server.uploads.clear()
+            server.failures.append((404, {}))
+            expect_request_error(lambda: processor.send_image(b'image', 'page_3.png'), 404)
+            assert len(server.uploads) == 1, "404 不应重试"
+        finally:
+            processor.close()
+
+        # 多个线程共用一个处理器：同时发出的请求不超过 concurrency，结果按输入顺序返回
+        temp_dir = create_temp_dir()
+        processor = ImageProcessor(model_url, concurrency=2)
+        try:
+            paths = []
+            for page in range(1, 7):
+                paths.append(os.path.join(temp_dir, f"page_{page}.png"))
+                with open(paths[-1], 'wb') as f:
+                    f.write(b'image')
+                server.delays[f"page_{page}.png"] = 0.05 * (7 - page)
+            server.max_active = 0
+            threads = [threading.Thread(target=processor.send_many, args=(paths[index::2],)) for index in range(2)]
+            for thread in threads:
+                thread.start()
+            results = processor.send_many(paths)
+            for thread in threads:
+                thread.join()
+            assert [result['filename'] for result in results] == [f"page_{page}.png" for page in range(1, 7)], results
+            assert server.max_active <= 2, f"同时处理的请求数应不超过 2，实际 {server.max_active}"
+        finally:
+            processor.close()
+            cleanup_temp_dir(temp_dir)
+
+    # 连接失败同样重试，用完后抛出 ConnectionError
+    processor = ImageProcessor(server.url + '/model', max_retries=1, backoff_base=0.001)
+    try:
+        expect_request_error(lambda: processor.send_image(b'image', 'page_1.png'))
+    finally:
+        processor.close()
+
+def pipeline_threads() -> list:
+    # 流水线的渲染和上传线程（线程名中带有 target 函数名）
+    return [thread for thread in threading.enumerate() if '_stage' in thread.name]
+
+def test_pipeline_local():
+    """流水线：按页码或按完成顺序产出、提前 close() 后清理临时目录、异步版本被取消时停止并清理、渲染失败时抛出"""
+    with LocalServer() as server, FakePoppler(8):
+        server.files['/doc.pdf'] = make_pdf_bytes(4096)
+        pdf_url = server.url + '/doc.pdf'
+        processor = ImageProcessor(server.url + '/model', concurrency=4)
+        toolkit = PDFToImageToolkit(server.url + '/model', processor=processor, queue_size=4,
+                                    converter=PDFToImageConverter(thread_count=2, pages_per_task=2))
+        try:
+            # 第 1 页上传最慢：按页码顺序时仍第一个产出，按完成顺序时不会第一个产出
+            server.delays['page_1.png'] = 0.3
+            results = list(toolkit.iter_process_pdf(pdf_url))
+            assert [page for page, _ in results] == list(range(1, 9)), results
+            assert all(result['filename'] == f"page_{page}.png" for page, result in results), "结果与页码不对应"
+            unordered = [page for page, _ in toolkit.iter_process_pdf(pdf_url, ordered=False)]
+            assert sorted(unordered) == list(range(1, 9)) and unordered[0] != 1, unordered
+            assert not toolkit.temp_dirs and not pipeline_threads(), "处理完成后应清理临时目录并结束所有线程"
+
+            # 提前 close()：其余页不再上传，临时目录立即删除
+            server.delays.update({f"page_{page}.png": 0.2 for page in range(2, 9)})
+            results = toolkit.iter_process_pdf(pdf_url)
+            assert next(results)[0] == 1
+            temp_dir = next(iter(toolkit.temp_dirs))
+            results.close()
+            assert not os.path.exists(temp_dir) and not toolkit.temp_dirs, "提前 close() 后应删除临时目录"
+            assert not pipeline_threads(), "提前 close() 后不应留下流水线线程"
+
+            async def consume(received):
+                async for page, _ in toolkit.aiter_process_pdf(pdf_url):
+                    received.append(page)
+
+            async def cancel_after_first_page():
+                received = []
+                task = asyncio.create_task(consume(received))
+                while not received:
+                    await asyncio.sleep(0.01)
+                temp_dir = next(iter(toolkit.temp_dirs))
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                else:
+                    raise AssertionError("取消后应抛出 CancelledError")
+                return received, temp_dir
+
+            received, temp_dir = asyncio.run(cancel_after_first_page())
+            assert received[:1] == [1] and len(received) < 8, received
+            assert not os.path.exists(temp_dir) and not pipeline_threads(), "任务取消后应停止流水线并删除临时目录"
+        finally:
+            processor.close()
+
+    with LocalServer() as server, FakePoppler(8, fail_page=6):
+        server.files['/doc.pdf'] = make_pdf_bytes(4096)
+        toolkit = PDFToImageToolkit(server.url + '/model', converter=PDFToImageConverter(thread_count=2))
+        try:
+            list(toolkit.iter_process_pdf(server.url + '/doc.pdf'))
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("渲染失败时应抛出异常")
+        finally:
+            toolkit.processor.close()
+        assert not toolkit.temp_dirs and not pipeline_threads(), "失败后应清理临时目录并结束所有线程"
+
+def test_in_memory_local():
+    """内存模式：SpillBuffer 超过阈值转存并在关闭后删除、Linux 上通过 /proc 路径读取、下载到内存、全程不创建临时目录"""
+    data = b'%PDF-' + b'x' * 595
+    with SpillBuffer(threshold=1000) as buffer:
+        buffer.write(data)
+        assert not buffer.spilled and buffer.size == 600
+        if sys.platform.startswith('linux'):
+            assert buffer.path.startswith('/proc/'), f"Linux 上未转存时应使用 memfd 路径: {buffer.path}"
+        with open(buffer.path, 'rb') as f:
+            assert f.read() == data, "外部程序通过 path 读到的内容不一致"
+        buffer.write(data)
+        spill_path = buffer.path
+        assert buffer.spilled and os.path.exists(spill_path), "超过阈值后应转存为磁盘临时文件"
+        assert buffer.getvalue() == data * 2, "转存后内容不一致"
+    assert not os.path.exists(spill_path), "关闭后应删除转存的临时文件"
+
+    with LocalServer() as server, FakePoppler(6) as poppler:
+        server.files['/small.pdf'] = make_pdf_bytes(4096)
+        server.files['/large.pdf'] = make_pdf_bytes(3 * 1024 * 1024)
+        downloader = PDFDownloader()
+        try:
+            for name, spilled in (('small', False), ('large', True)):
+                buffer, digest = downloader.download_to_buffer(f"{server.url}/{name}.pdf", spill_threshold=1024 * 1024,
+                                                               hash_algorithm='sha256')
+                with buffer:
+                    expected = server.files[f"/{name}.pdf"]
+                    assert buffer.spilled == spilled, f"{name}: spilled 应为 {spilled}"
+                    assert buffer.getvalue() == expected and digest == hashlib.sha256(expected).hexdigest(), name
+        finally:
+            downloader.close()
+
+        # 小文件由渲染进程直接读 memfd，大文件超过 spill_threshold 后转存，结束后删除
+        for name in ('small', 'large'):
+            poppler.sources.clear()
+            server.uploads.clear()
+            toolkit = PDFToImageToolkit(server.url + '/model', in_memory=True, spill_threshold=1024 * 1024,
+                                        converter=PDFToImageConverter(thread_count=2, pages_per_task=2))
+            try:
+                results = list(toolkit.iter_process_pdf(f"{server.url}/{name}.pdf"))
+            finally:
+                toolkit.processor.close()
+            assert [page for page, _ in results] == list(range(1, 7)), results
+            assert sorted(server.uploads) == sorted(f"page_{page}.png" for page in range(1, 7)), server.uploads
+            assert not toolkit.temp_dirs, "内存模式不应创建临时目录"
+            assert set(poppler.headers) == {b'%PDF-'}, "渲染进程应能通过路径读取内存中的 PDF"
+            if name == 'large':
+                assert not any(os.path.exists(source) for source in poppler.sources), "转存的临时文件应在结束后删除"
+
+# 不需要网络、poppler 和模型 API 的检查：PDF 由本地 http.server 提供，渲染使用 FakePoppler
+LOCAL_TESTS = [
+    test_download_local,
+    test_converter_local,
+    test_pipeline_local,
+    test_upload_retry_local,
+    test_in_memory_local,
+]
+
 if __name__ == "__main__":
     logger.info("开始测试模块")
-    test_pdf_download()
-    test_pdf_to_images()
-    test_image_processor()  # 需要服务器 API 和测试图片
+    for test in LOCAL_TESTS:
+        test()
+        logger.info(f"{test.__name__} 通过")
+    # 以下测试需要外网、poppler、模型 API 和测试图片，加 --online 时运行
+    if '--online' in sys.argv:
+        test_pdf_download()
+        test_pdf_to_images()
+        test_image_processor()  # 需要服务器 API 和测试图片
     logger.info("测试完成")
\ No newline at end of file
@@ -1,7 +1,11 @@
 import tempfile
+import io
 import os
 import shutil
 import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # 配置日志记录
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -27,4 +31,77 @@ def cleanup_temp_dir(temp_dir: str) -> None:
     """
     if temp_dir and os.path.exists(temp_dir):
         shutil.rmtree(temp_dir)
-        logger.info(f"删除临时目录: {temp_dir}")
\ No newline at end of file
+        logger.info(f"删除临时目录: {temp_dir}")
+
+def create_session(pool_maxsize: int = 10, retries: int = 3) -> requests.Session:
+    """
+    创建带连接池的 requests.Session，多次请求复用 keep-alive 连接，避免重复 TCP/TLS 握手。
+
+    Args:
+        pool_maxsize (int): 每个主机保留的最大连接数，应不小于并发请求数。
+        retries (int): 连接失败以及 GET 请求遇到 429/502/503/504 时的重试次数（指数退避）。
+
+    Returns:
+        requests.Session: 配置好的会话，使用完毕后调用 close() 释放连接。
+    """
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 502, 503, 504),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+class SpillBuffer:
+    """
+    内存中的文件缓冲区，写入超过 threshold 字节后转存为磁盘临时文件（关闭时自动删除，不留临时目录）。
+
+    Linux 上内存数据放在 memfd 中，path 返回 /proc/<pid>/fd/<fd>，pdftoppm 等外部程序可以直接读取而不落盘；
+    其他系统在第一次访问 path 时才写入临时文件。
+    """
+
+    def __init__(self, threshold: int = 64 * 1024 * 1024, suffix: str = '.pdf'):
+        self.threshold = threshold
+        self.suffix = suffix
+        self.size = 0
+        self.spilled = False
+        self._memfd = hasattr(os, 'memfd_create') and os.path.isdir(f'/proc/{os.getpid()}/fd')
+        self._file = open(os.memfd_create('spill-buffer'), 'w+b') if self._memfd else io.BytesIO()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, data) -> int:
+        if not self.spilled and self.size + len(data) > self.threshold:
+            self._spill()
+        self.size += len(data)
+        return self._file.write(data)
+
+    def _spill(self) -> None:
+        spill_file = tempfile.NamedTemporaryFile(suffix=self.suffix)
+        self._file.seek(0)
+        shutil.copyfileobj(self._file, spill_file)
+        self._file.close()
+        self._file = spill_file
+        self.spilled = True
+        logger.info(f"缓冲区超过 {self.threshold} 字节，转存到临时文件: {spill_file.name}")
+
+    @property
+    def path(self) -> str:
+        """供只接受文件路径的程序读取的路径，在 close() 之前有效。"""
+        self._file.flush()
+        if not self.spilled:
+            if self._memfd:
+                return f"/proc/{os.getpid()}/fd/{self._file.fileno()}"
+            self._spill()
+        return self._file.name
+
+    def getvalue(self) -> bytes:
+        self._file.seek(0)
+        return self._file.read()
+
+    def close(self) -> None:
+        self._file.close()
\ No newline at end of file
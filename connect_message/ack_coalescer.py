@@ -0,0 +1,103 @@
+import asyncio
+import logging
+
+# 日志由 rabbitmq_client 统一配置
+logger = logging.getLogger(__name__)
+
+class AckCoalescer:
+    """
+    合并消费端确认：成功的 delivery tag 先缓存，按数量或时间阈值用 multiple=True 一次确认。
+
+    multiple=True 会确认不大于该 tag 的全部消息，所以只能确认“连续已完成”的前缀；
+    前面仍有消息在处理时，后面的确认会等到定时刷新时逐条发送。nack 不合并，立即发送。
+    通道关闭后 delivery tag 失效，缓存直接丢弃，由 broker 重新投递。
+    绕过本类直接 message.ack() / reject() 的消息在下次刷新时从跟踪中移除。
+    """
+
+    def __init__(self, max_batch=50, flush_interval=0.2):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        # delivery_tag -> message，按投递顺序（tag 递增）排列
+        self._outstanding = {}
+        self._acked = set()
+        self._lock = asyncio.Lock()
+        self._flush_task = None
+
+    def track(self, message):
+        self._outstanding[message.delivery_tag] = message
+
+    async def ack(self, message):
+        tag = message.delivery_tag
+        if tag not in self._outstanding:
+            await message.ack()
+            return
+        self._acked.add(tag)
+        if len(self._acked) >= self.max_batch:
+            await self.flush()
+
+    async def nack(self, message, requeue=False):
+        async with self._lock:
+            self._outstanding.pop(message.delivery_tag, None)
+            self._acked.discard(message.delivery_tag)
+        await message.nack(requeue=requeue)
+
+    async def flush(self, force=False):
+        """
+        发送已缓存的确认。force=True 时，连续前缀之外的确认也逐条发送。
+        """
+        async with self._lock:
+            self._forget_settled()
+            if not self._acked:
+                return
+            try:
+                highest = None
+                for tag in self._outstanding:
+                    if tag not in self._acked:
+                        break
+                    highest = tag
+                if highest is not None:
+                    message = self._outstanding[highest]
+                    for tag in [tag for tag in self._outstanding if tag <= highest]:
+                        del self._outstanding[tag]
+                        self._acked.discard(tag)
+                    await message.ack(multiple=True)
+                if force:
+                    for tag in sorted(self._acked):
+                        self._acked.discard(tag)
+                        await self._outstanding.pop(tag).ack()
+            except Exception as e:
+                logger.info(f"批量确认失败，未确认消息将由 broker 重新投递: {e}")
+                self.reset()
+
+    def _forget_settled(self):
+        # 已由其他途径确认或拒绝的消息不会再经过 ack/nack，不移除的话会一直占用内存，
+        # 它们较小的 tag 也会挡住后面的连续前缀
+        for tag in [tag for tag, message in self._outstanding.items() if message.processed]:
+            del self._outstanding[tag]
+            self._acked.discard(tag)
+
+    def reset(self, *args):
+        # 可直接注册为 channel.close_callbacks 回调
+        if self._outstanding:
+            logger.info(f"通道关闭，丢弃 {len(self._outstanding)} 条未确认消息的缓存")
+        self._outstanding.clear()
+        self._acked.clear()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush(force=True)
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush(force=True)
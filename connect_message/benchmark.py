@@ -0,0 +1,213 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import platform
+import sys
+import time
+import uuid
+
+import aio_pika
+from rabbitmq_client import AsyncRabbitMQClient, message_age
+from fake_broker import FakeBroker
+
+# 基准测试时关闭逐条消息日志，避免日志本身成为瓶颈
+logging.getLogger('rabbitmq_client').setLevel(logging.WARNING)
+logging.getLogger('fake_broker').setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+def percentile(sorted_values, q):
+    # 最近秩法，sorted_values 需已排序
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+async def run_case(url, messages, size, publishers, in_flight, prefetch, consumers, durable, ack_batch, timeout):
+    """
+    运行一组参数：consumers 个消费者、publishers 个发布者，共发送 messages 条 size 字节的消息。
+
+    端到端延迟取自消息头中的发布时间戳与消费时刻之差（同一台机器上时钟一致）。
+    """
+    queue = f"bench-{uuid.uuid4().hex[:8]}"
+    latencies = []
+    done = asyncio.Event()
+
+    consumer_clients = [
+        AsyncRabbitMQClient(queue=queue, url=url, prefetch_count=prefetch, ack_batch_size=ack_batch)
+        for _ in range(consumers)
+    ]
+    publisher_clients = [
+        AsyncRabbitMQClient(queue=queue, url=url, max_in_flight=in_flight, persistent=durable)
+        for _ in range(publishers)
+    ]
+
+    def make_callback(client):
+        async def callback(message):
+            age = message_age(message)
+            if age is not None:
+                latencies.append(age)
+            await client.ack_message(message)
+            if len(latencies) >= messages:
+                done.set()
+        return callback
+
+    consumer_tasks = []
+    try:
+        for client in consumer_clients + publisher_clients:
+            await client.connect()
+            await client.declare_queue(durable=durable)
+        for client in consumer_clients:
+            consumer_tasks.append(asyncio.create_task(client.consume_messages(make_callback(client))))
+
+        payload = b'x' * size
+        per_publisher = [messages // publishers + (1 if i < messages % publishers else 0) for i in range(publishers)]
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            client.publish_batch([payload] * count) for client, count in zip(publisher_clients, per_publisher)
+        ))
+        publish_elapsed = time.perf_counter() - start
+        try:
+            await asyncio.wait_for(done.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{queue}: {timeout}s 内只收到 {len(latencies)}/{messages} 条消息")
+        total_elapsed = time.perf_counter() - start
+    finally:
+        for task in consumer_tasks:
+            task.cancel()
+        await asyncio.gather(*consumer_tasks, return_exceptions=True)
+        if consumer_clients and consumer_clients[0].channel:
+            try:
+                await consumer_clients[0].channel.queue_delete(queue)
+            except Exception as e:
+                logger.debug(f"删除基准队列失败: {e}")
+        for client in consumer_clients + publisher_clients:
+            await client.close()
+
+    confirmed = sum(ok for batch in results for ok, _ in batch)
+    latencies.sort()
+    return {
+        'config': {
+            'messages': messages,
+            'size': size,
+            'publishers': publishers,
+            'in_flight': in_flight,
+            'prefetch': prefetch,
+            'consumers': consumers,
+            'durable': durable,
+            'ack_batch': ack_batch,
+        },
+        'confirmed': confirmed,
+        'received': len(latencies),
+        'publish_rate': round(confirmed / publish_elapsed, 1) if publish_elapsed else None,
+        'end_to_end_rate': round(len(latencies) / total_elapsed, 1) if total_elapsed else None,
+        'latency_ms': {
+            name: round(value * 1000, 3) if value is not None else None
+            for name, value in (
+                ('p50', percentile(latencies, 0.50)),
+                ('p95', percentile(latencies, 0.95)),
+                ('p99', percentile(latencies, 0.99)),
+                ('max', latencies[-1] if latencies else None),
+            )
+        },
+    }
+
+def config_key(run):
+    return json.dumps(run['config'], sort_keys=True)
+
+def compare_with_baseline(report, baseline, tolerance):
+    """
+    与基线报告比较，返回回归描述列表：吞吐下降或 p99 上升超过 tolerance（比例）即视为回归。
+    """
+    baseline_runs = {config_key(run): run for run in baseline.get('runs', [])}
+    regressions = []
+    for run in report['runs']:
+        base = baseline_runs.get(config_key(run))
+        if base is None:
+            continue
+        if base['end_to_end_rate'] and run['end_to_end_rate'] is not None \
+                and run['end_to_end_rate'] < base['end_to_end_rate'] * (1 - tolerance):
+            regressions.append(f"{config_key(run)}: 吞吐 {base['end_to_end_rate']} -> {run['end_to_end_rate']} msg/s")
+        base_p99, p99 = base['latency_ms']['p99'], run['latency_ms']['p99']
+        if base_p99 and p99 is not None and p99 > base_p99 * (1 + tolerance):
+            regressions.append(f"{config_key(run)}: p99 {base_p99} -> {p99} ms")
+        if run['received'] < run['config']['messages']:
+            regressions.append(f"{config_key(run)}: 丢失 {run['config']['messages'] - run['received']} 条消息")
+    return regressions
+
+def int_list(value):
+    return [int(item) for item in value.split(',')]
+
+async def run_benchmarks(cmd_args):
+    broker = None
+    url = cmd_args.url
+    if cmd_args.fake_broker:
+        broker = FakeBroker(port=0)
+        await broker.start()
+        url = broker.url
+    try:
+        runs = []
+        durabilities = {'both': [True, False], 'on': [True], 'off': [False]}[cmd_args.durable]
+        for size, publishers, in_flight, prefetch, consumers, durable in itertools.product(
+                cmd_args.sizes, cmd_args.publishers, cmd_args.in_flight,
+                cmd_args.prefetch, cmd_args.consumers, durabilities):
+            run = await run_case(url, cmd_args.messages, size, publishers, in_flight, prefetch,
+                                 consumers, durable, cmd_args.ack_batch, cmd_args.timeout)
+            logger.info(f"{run['config']} -> {run['end_to_end_rate']} msg/s, p99 {run['latency_ms']['p99']} ms")
+            runs.append(run)
+    finally:
+        if broker:
+            await broker.stop()
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'aio_pika': aio_pika.__version__,
+            'platform': platform.platform(),
+            'broker': 'fake' if cmd_args.fake_broker else url,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'runs': runs,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="AsyncRabbitMQClient 吞吐/延迟基准测试")
+    parser.add_argument('--url', default=None, help="broker 地址，默认读取 RABBITMQ_URL")
+    parser.add_argument('--fake-broker', action='store_true', help="使用进程内 FakeBroker")
+    parser.add_argument('--messages', type=int, default=5000, help="每组参数发送的消息数")
+    parser.add_argument('--sizes', type=int_list, default=[128, 4096], help="消息大小（字节），逗号分隔")
+    parser.add_argument('--publishers', type=int_list, default=[1], help="发布者数量")
+    parser.add_argument('--in-flight', type=int_list, default=[100], help="每个发布者未确认消息上限")
+    parser.add_argument('--prefetch', type=int_list, default=[100], help="消费者 prefetch")
+    parser.add_argument('--consumers', type=int_list, default=[1], help="消费者数量")
+    parser.add_argument('--durable', choices=['both', 'on', 'off'], default='on', help="队列与消息是否持久化")
+    parser.add_argument('--ack-batch', type=int, default=None, help="启用合并确认的批大小")
+    parser.add_argument('--timeout', type=float, default=60, help="每组参数等待消费完成的秒数")
+    parser.add_argument('--output', default=None, help="JSON 结果输出文件，默认输出到标准输出")
+    parser.add_argument('--baseline', default=None, help="基线 JSON，用于检测性能回归")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="允许的性能波动比例")
+    cmd_args = parser.parse_args()
+
+    logger.setLevel(logging.INFO)
+    report = asyncio.run(run_benchmarks(cmd_args))
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if cmd_args.output:
+        with open(cmd_args.output, 'w') as f:
+            f.write(output)
+        logger.info(f"结果已写入 {cmd_args.output}")
+    else:
+        print(output)
+
+    if cmd_args.baseline:
+        with open(cmd_args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report, baseline, cmd_args.tolerance)
+        if regressions:
+            for regression in regressions:
+                logger.error(f"性能回归: {regression}")
+            sys.exit(1)
+        logger.info("未发现性能回归")
+
+if __name__ == "__main__":
+    main()
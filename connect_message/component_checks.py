@@ -0,0 +1,818 @@
+import argparse
+import asyncio
+import datetime
+import decimal
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+import aio_pika
+
+from ack_coalescer import AckCoalescer
+from delivery_verifier import RUN_ID_HEADER, SEQUENCE_HEADER, DeliveryVerifier, RangeSet
+from log_setup import setup_logging
+from outbox import RECORD_HEADER, Outbox
+from streaming import (
+    STREAM_CHUNK_SIZE_HEADER, STREAM_FINAL_HEADER, STREAM_ID_HEADER, STREAM_INDEX_HEADER,
+    STREAM_META_HEADER, STREAM_SIZE_HEADER, StreamAssembler,
+)
+
+# 组件自检：不依赖 broker 的纯 Python 检查，由 test.py 的“组件自检”调用，也可单独运行
+setup_logging()
+logger = logging.getLogger(__name__)
+
+def expect(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+def check_outbox():
+    """追加、崩溃留下半条记录、重新打开、补发、确认，以及全部确认后删除旧段。"""
+    with tempfile.TemporaryDirectory() as directory:
+        outbox = Outbox(directory, segment_bytes=512, fsync='always')
+        for i in range(20):
+            outbox.append(f"q{i % 3}", aio_pika.Message(body=f"message {i}".encode() * 8, message_id=str(i)))
+        segments = outbox._segments()
+        expect(len(segments) > 1, f"超过 segment_bytes 后应滚动出多个段，实际 {segments}")
+        outbox.close()
+
+        # 模拟写到一半时进程崩溃：最后一段末尾留下一条不完整的记录
+        last_segment = outbox._segment_path(segments[-1])
+        size = os.path.getsize(last_segment)
+        with open(last_segment, 'ab') as f:
+            f.write(RECORD_HEADER.pack(0, 10, 100) + b'partial')
+
+        outbox = Outbox(directory, segment_bytes=512, fsync='always')
+        expect(outbox.pending == 20, f"重新打开后应有 20 条待补发，实际 {outbox.pending}")
+        expect(os.path.getsize(last_segment) == size, "末尾不完整的记录应被截断")
+
+        batch = outbox.read_batch(7)
+        expect([r.message.message_id for r in batch] == [str(i) for i in range(7)], "应按追加顺序读取")
+        expect([r.routing_key for r in batch] == [f"q{i % 3}" for i in range(7)], "routing_key 应随记录保存")
+        expect(batch[3].message.body == b"message 3" * 8, "消息体应与写入时一致")
+        again = outbox.read_batch(7)
+        expect([r.end for r in again] == [r.end for r in batch], "commit 之前重复读取应返回相同记录")
+        outbox.commit(batch)
+        outbox.close()
+
+        # 确认位置持久化：重新打开后从第 7 条继续
+        outbox = Outbox(directory, segment_bytes=512, fsync='always')
+        expect(outbox.pending == 13, f"确认 7 条后应剩 13 条，实际 {outbox.pending}")
+        expect(outbox._segments()[0] >= batch[-1].segment, "已全部确认的段应被删除")
+        outbox.append('q-new', aio_pika.Message(body=b'after reopen', message_id='20'))
+        rest = outbox.read_batch(100)
+        expect([r.message.message_id for r in rest] == [str(i) for i in range(7, 21)],
+               f"补发顺序错误: {[r.message.message_id for r in rest]}")
+        outbox.commit(rest)
+        expect(outbox.pending == 0, f"全部确认后不应有待补发消息，实际 {outbox.pending}")
+        remaining = outbox._segments()
+        expect(len(remaining) == 1 and os.path.getsize(outbox._segment_path(remaining[0])) == 0,
+               f"全部确认后只应保留一个空段，实际 {remaining}")
+        expect(outbox.read_batch(10) == [], "全部确认后不应再读到记录")
+        outbox.close()
+
+        outbox = Outbox(directory, segment_bytes=512, fsync='always')
+        expect(outbox.pending == 0 and outbox.read_batch(10) == [], "重新打开后不应重复补发已确认的消息")
+        outbox.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # 元数据以 JSON 保存，AMQP 头中 JSON 无法表示的值按原类型还原
+        headers = {
+            'raw': b'\x00\xff', 'at': datetime.datetime(2024, 1, 2, 3, 4, 5),
+            'amount': decimal.Decimal('1.50'), 'nested': {'items': [1, b'x', None]}, 'flag': True,
+        }
+        outbox = Outbox(directory, fsync='never')
+        outbox.append('q', aio_pika.Message(body=b'body', headers=headers, expiration=5, priority=3))
+        [record] = outbox.read_batch(10)
+        expect(record.message.headers == headers, f"消息头未按原类型还原: {record.message.headers}")
+        expect((record.message.expiration, record.message.priority) == (5, 3), "消息属性应随记录保存")
+        outbox.close()
+        with open(outbox._segment_path(record.segment), 'rb') as f:
+            data = f.read()
+        _, meta_len, _ = RECORD_HEADER.unpack_from(data)
+        expect(json.loads(data[RECORD_HEADER.size:RECORD_HEADER.size + meta_len])['routing_key'] == 'q',
+               "记录元数据应为 JSON")
+
+    with tempfile.TemporaryDirectory() as directory:
+        # 客户端在工作线程中追加写入，并发追加的记录不应交错或丢失
+        outbox = Outbox(directory, segment_bytes=1024, fsync='interval')
+
+        def append_many(worker):
+            for i in range(50):
+                outbox.append('q', aio_pika.Message(body=b'%d-%d' % (worker, i) * 10))
+
+        threads = [threading.Thread(target=append_many, args=(worker,)) for worker in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        records = outbox.read_batch(1000)
+        expect(outbox.pending == 200 and len(records) == 200, f"并发追加后应有 200 条，实际 {len(records)}")
+        for worker in range(4):
+            bodies = [r.message.body for r in records if r.message.body.startswith(b'%d-' % worker)]
+            expect(bodies == [b'%d-%d' % (worker, i) * 10 for i in range(50)], f"线程 {worker} 的记录顺序错误")
+        outbox.close()
+
+
+class _FakeDelivery:
+    def __init__(self, delivery_tag, calls):
+        self.delivery_tag = delivery_tag
+        self.processed = False
+        self._calls = calls
+
+    async def ack(self, multiple=False):
+        self.processed = True
+        self._calls.append(('ack', self.delivery_tag, multiple))
+
+    async def nack(self, requeue=False):
+        self.processed = True
+        self._calls.append(('nack', self.delivery_tag, requeue))
+
+    async def reject(self, requeue=False):
+        self.processed = True
+        self._calls.append(('reject', self.delivery_tag, requeue))
+
+
+def check_ack_coalescer():
+    """只用 multiple=True 确认连续完成的前缀，其余在强制刷新时逐条确认。"""
+    async def run():
+        calls = []
+        coalescer = AckCoalescer(max_batch=10)
+        messages = {tag: _FakeDelivery(tag, calls) for tag in range(1, 7)}
+        for message in messages.values():
+            coalescer.track(message)
+
+        await coalescer.ack(messages[2])
+        await coalescer.ack(messages[3])
+        await coalescer.flush()
+        expect(calls == [], f"第 1 条未完成时不应确认后面的消息，实际 {calls}")
+
+        await coalescer.ack(messages[1])
+        await coalescer.flush()
+        expect(calls == [('ack', 3, True)], f"应以 multiple=True 确认前缀 1..3，实际 {calls}")
+
+        calls.clear()
+        await coalescer.ack(messages[5])
+        await coalescer.flush()
+        expect(calls == [], f"第 4 条未完成时不应确认第 5 条，实际 {calls}")
+        await coalescer.flush(force=True)
+        expect(calls == [('ack', 5, False)], f"强制刷新应逐条确认第 5 条，实际 {calls}")
+
+        calls.clear()
+        await coalescer.nack(messages[4], requeue=True)
+        expect(calls == [('nack', 4, True)], f"nack 应立即发送，实际 {calls}")
+        await coalescer.ack(messages[6])
+        await coalescer.flush()
+        expect(calls[-1] == ('ack', 6, True), f"4 被拒绝后 6 应成为新的前缀，实际 {calls}")
+
+        # 未跟踪的消息（例如通道重建后）直接确认
+        calls.clear()
+        await coalescer.ack(_FakeDelivery(100, calls))
+        expect(calls == [('ack', 100, False)], f"未跟踪的消息应立即确认，实际 {calls}")
+
+        coalescer.track(_FakeDelivery(7, calls))
+        coalescer.reset()
+        await coalescer.flush(force=True)
+        expect(calls == [('ack', 100, False)], "通道关闭后缓存的确认应被丢弃")
+
+    asyncio.run(run())
+
+def check_ack_coalescer_direct_settle():
+    """回调绕过合并确认直接 ack/reject 的消息不应留在跟踪中，也不应挡住后面的前缀。"""
+    async def run():
+        calls = []
+        coalescer = AckCoalescer(max_batch=100)
+        messages = {tag: _FakeDelivery(tag, calls) for tag in range(1, 7)}
+        for message in messages.values():
+            coalescer.track(message)
+
+        await messages[1].ack()
+        await messages[2].reject()
+        await coalescer.ack(messages[3])
+        await coalescer.ack(messages[4])
+        await coalescer.flush()
+        expect(calls[2:] == [('ack', 4, True)], f"直接确认的 1、2 之后，3..4 应以 multiple=True 确认，实际 {calls}")
+
+        # 全部直接确认时也不能积累在跟踪中
+        await messages[5].ack()
+        await messages[6].ack()
+        for tag in range(7, 1007):
+            message = _FakeDelivery(tag, calls)
+            coalescer.track(message)
+            await message.ack()
+        await coalescer.flush()
+        expect(len(coalescer._outstanding) == 0 and not coalescer._acked,
+               f"直接确认的消息应从跟踪中移除，剩余 {len(coalescer._outstanding)} 条")
+
+    asyncio.run(run())
+
+def check_range_set():
+    """乱序加入、重复检测、区间合并和缺失区间。"""
+    values = [v for v in range(100) if v != 10 and not 50 <= v <= 52]
+    random.Random(1).shuffle(values)
+    ranges = RangeSet()
+    for value in values:
+        expect(ranges.add(value), f"{value} 首次加入应返回 True")
+    expect(not ranges.add(values[0]), "重复加入应返回 False")
+    expect(len(ranges) == 96, f"应有 96 个值，实际 {len(ranges)}")
+    expect(ranges.intervals() == [(0, 10), (11, 50), (53, 100)], f"区间未合并: {ranges.intervals()}")
+    expect(ranges.gaps() == [(10, 11), (50, 53)], f"缺失区间错误: {ranges.gaps()}")
+    expect(ranges.gaps(upper=105) == [(10, 11), (50, 53), (100, 105)], "指定 upper 时末尾缺失也应列出")
+    expect(ranges.gaps(limit=1) == [(10, 11)], "limit 应限制返回的区间数")
+    expect(10 not in ranges and 11 in ranges and 99 in ranges, "成员判断错误")
+    for value in (10, 50, 52, 51):
+        ranges.add(value)
+    expect(ranges.intervals() == [(0, 100)], f"补齐后应合并为一个区间: {ranges.intervals()}")
+
+def check_delivery_verifier():
+    """按 run 统计丢失、重复和乱序。"""
+    verifier = DeliveryVerifier()
+    results = [verifier.observe({RUN_ID_HEADER: 'a', SEQUENCE_HEADER: seq}) for seq in (0, 1, 2, 2, 5, 3)]
+    expect(results == ['ok', 'ok', 'ok', 'duplicate', 'ok', 'reordered'], f"逐条结果错误: {results}")
+    verifier.observe({RUN_ID_HEADER: b'b', SEQUENCE_HEADER: 0})
+    expect(verifier.observe({'other': 1}) == 'unstamped', "没有序号的消息应计为 unstamped")
+
+    report = verifier.report(expected={'a': 7, 'b': 1, 'c': 2})
+    run = report['runs']['a']
+    expect((run['received'], run['unique'], run['duplicates'], run['reordered']) == (6, 5, 1, 1),
+           f"run a 统计错误: {run}")
+    expect(run['missing'] == 2 and run['gaps'] == [(4, 5), (6, 7)], f"run a 丢失统计错误: {run}")
+    expect(report['runs']['b']['missing'] == 0, "bytes 类型的 run_id 应按字符串统计")
+    expect(report['runs']['c']['missing'] == 2, "完全没有收到的 run 应全部计为丢失")
+    expect(report['unstamped'] == 1, f"unstamped 应为 1，实际 {report['unstamped']}")
+    expect(not verifier.ok(expected={'a': 7}), "有丢失和重复时 ok() 应为 False")
+
+    clean = DeliveryVerifier()
+    for seq in (1, 0, 2):
+        clean.observe({RUN_ID_HEADER: 'r', SEQUENCE_HEADER: seq})
+    expect(clean.ok(expected={'r': 3}), "只有乱序时 ok() 应为 True")
+
+def _stream_chunks(stream_id, data, chunk_size, metadata=None):
+    chunks = [data[offset:offset + chunk_size] for offset in range(0, len(data), chunk_size)] or [b'']
+    messages = []
+    for index, body in enumerate(chunks):
+        headers = {STREAM_ID_HEADER: stream_id, STREAM_INDEX_HEADER: index, STREAM_CHUNK_SIZE_HEADER: chunk_size}
+        if index == 0 and metadata is not None:
+            headers[STREAM_META_HEADER] = metadata
+        if index == len(chunks) - 1:
+            headers[STREAM_FINAL_HEADER] = True
+            headers[STREAM_SIZE_HEADER] = len(data)
+        messages.append(SimpleNamespace(headers=headers, body=body))
+    return messages
+
+def check_stream_assembler():
+    """乱序、重复投递的块按序号重组，超出内存上限后转存磁盘，超时的流被丢弃。"""
+    rng = random.Random(2)
+    data = rng.randbytes(10 * 1000 + 123)
+    chunks = _stream_chunks('s1', data, 1000, metadata={'name': 'file.bin'})
+    deliveries = chunks + rng.sample(chunks, 3)
+    rng.shuffle(deliveries)
+    # 最后一块最后到达，才能确认之前不会提前完成
+    final = chunks[-1]
+    deliveries = [message for message in deliveries if message is not final] + [final]
+
+    assembler = StreamAssembler(spool_max_memory=2000, stream_timeout=300)
+    stream = None
+    for message in deliveries:
+        expect(stream is None, "块未到齐前不应返回完整的流")
+        stream = assembler.add(message)
+    expect(stream is not None, "全部块到达后应返回完整的流")
+    expect(stream.read() == data and stream.size == len(data), "重组后的内容与原数据不一致")
+    expect(stream.metadata == {'name': 'file.bin'}, f"元数据错误: {stream.metadata}")
+    expect(stream.file._rolled, "超过 spool_max_memory 的流应转存到磁盘")
+    expect(len(assembler) == 0, "完成的流不应继续占用重组器")
+    stream.close()
+
+    empty = assembler.add(_stream_chunks('empty', b'', 1000)[0])
+    expect(empty is not None and empty.read() == b'', "空流应直接完成")
+    empty.close()
+
+    # 声明的总大小与收到的内容不一致
+    broken = _stream_chunks('s2', b'x' * 2500, 1000)
+    broken[-1].headers[STREAM_SIZE_HEADER] = 3000
+    try:
+        for message in broken:
+            assembler.add(message)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("总大小不一致时应抛出 ValueError")
+
+    expiring = StreamAssembler(stream_timeout=0.05)
+    expiring.add(_stream_chunks('s3', b'y' * 3000, 1000)[0])
+    time.sleep(0.1)
+    expect(expiring.expire() == ['s3'] and len(expiring) == 0, "超时未完成的流应被丢弃")
+    assembler.close()
+    expiring.close()
+
+async def _consume_for(consume, seconds):
+    # 消费 seconds 秒后取消，等待进行中的回调和合并确认收尾
+    task = asyncio.create_task(consume)
+    await asyncio.sleep(seconds)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _queue_name(prefix):
+    # 每次检查使用新队列，互不影响，也不受之前运行残留消息的影响
+    return f"{prefix}-{uuid.uuid4().hex[:8]}"
+
+def check_ack_then_raise():
+    """合并确认时回调先确认再抛异常：不应再投入重试队列，回调只执行一次；分块流回调失败同理。"""
+    # 只在需要 broker 的检查中导入客户端
+    from rabbitmq_client import AsyncRabbitMQClient
+
+    async def run():
+        client = AsyncRabbitMQClient(queue=_queue_name('ack-then-raise'), ack_batch_size=10,
+                                     retry_delays=(0.2,))
+        calls = []
+
+        async def callback(message):
+            calls.append(dict(message.headers or {}))
+            await client.ack_message(message)
+            raise RuntimeError("确认之后失败")
+
+        async def stream_callback(stream):
+            calls.append(stream.stream_id)
+            raise RuntimeError("流处理失败")
+
+        try:
+            await client.connect()
+            await client.declare_queue(durable=False)
+            await client.publish_message({'id': 1})
+            # 重试延迟 0.2s，等待足够久让错误的重试消息回到队列
+            await _consume_for(client.consume_messages(callback), 1.5)
+            expect(len(calls) == 1, f"回调应只执行一次，实际 {len(calls)} 次: {calls}")
+            expect(client.retried_total.value == 0, f"已确认的消息不应进入重试队列，实际 {client.retried_total.value} 条")
+
+            calls.clear()
+            await client.publish_stream(b'z' * 2500, chunk_size=1000)
+            await _consume_for(client.consume_streams(stream_callback), 1.5)
+            expect(len(calls) == 1, f"流回调应只执行一次，实际 {len(calls)} 次")
+            expect(client.retried_total.value == 0, f"已确认的最后一块不应进入重试队列，实际 {client.retried_total.value} 条")
+            state = await client.get_queue_state()
+            expect(state['messages'] == 0, f"队列中不应残留消息: {state}")
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+
+def check_codec():
+    """content_type / content_encoding 随消息发送，超过阈值才压缩，消费端只按内容头解码。"""
+    from rabbitmq_client import AsyncRabbitMQClient
+    from serializers import MessageCodec, decode_message
+
+    async def run():
+        queue = _queue_name('codec')
+        publisher = AsyncRabbitMQClient(queue=queue, codec=MessageCodec(compression='gzip', compress_threshold=100))
+        # 消费端使用默认编解码器，解码只依赖消息自身的内容头
+        consumer = AsyncRabbitMQClient(queue=queue)
+        received = []
+
+        async def callback(message):
+            received.append((message.content_type, message.content_encoding, decode_message(message)))
+            await consumer.ack_message(message)
+
+        large = {'id': 2, 'text': 'x' * 1000}
+        try:
+            for client in (publisher, consumer):
+                await client.connect()
+                await client.declare_queue(durable=False)
+            await publisher.publish_message({'id': 1})
+            await publisher.publish_message(large)
+            await publisher.publish_message(b'\x00raw bytes')
+            await _consume_for(consumer.consume_messages(callback), 1)
+        finally:
+            await publisher.close()
+            await consumer.close()
+        expect(received[:1] == [('application/json', None, {'id': 1})], f"小消息不应压缩: {received[:1]}")
+        expect(received[1:2] == [('application/json', 'gzip', large)], f"大消息应以 gzip 压缩并还原: {received[1:2]}")
+        expect(received[2:] == [(None, None, b'\x00raw bytes')], f"bytes 负载应原样发送: {received[2:]}")
+
+    asyncio.run(run())
+
+async def _wait_until(predicate, timeout=3):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    return predicate()
+
+def check_backpressure():
+    """队列积压超过高水位时 shed 策略拒绝发布，降到低水位后恢复；connection.blocked 期间同样拒绝或等待。"""
+    from fake_broker import FakeBrokerThread
+    from rabbitmq_client import AsyncRabbitMQClient, BackpressureError
+
+    async def publish_rejected(client, message):
+        try:
+            await client.publish_message(message)
+        except BackpressureError:
+            return True
+        return False
+
+    async def backlog():
+        client = AsyncRabbitMQClient(queue=_queue_name('backpressure'), high_watermark=3,
+                                     overflow_policy='shed', monitor_interval=0.1)
+        try:
+            await client.connect()
+            await client.declare_queue(durable=False)
+            for index in range(3):
+                await client.publish_message({'id': index})
+            monitor = asyncio.create_task(client.monitor_queue())
+            try:
+                expect(await _wait_until(lambda: client._backlogged), "积压达到高水位后应启用背压")
+                expect(await publish_rejected(client, {'id': 3}), "shed 策略下积压时发布应抛出 BackpressureError")
+                expect(client.publish_shed_total.value == 1, f"丢弃计数应为 1，实际 {client.publish_shed_total.value}")
+                await client.queue_obj.purge()
+                expect(await _wait_until(lambda: not client._backlogged), "积压降到低水位后应解除背压")
+                await client.publish_message({'id': 4})
+            finally:
+                monitor.cancel()
+                await asyncio.gather(monitor, return_exceptions=True)
+        finally:
+            await client.close()
+
+    async def blocked(url):
+        # connection.blocked 无法在真实 broker 上按需触发，使用单独的 FakeBroker
+        shed = AsyncRabbitMQClient(queue=_queue_name('blocked'), url=url, overflow_policy='shed')
+        waiting = AsyncRabbitMQClient(queue=shed.queue, url=url, backpressure_timeout=5)
+        try:
+            for client in (shed, waiting):
+                await client.connect()
+                await client.declare_queue(durable=False)
+            broker.run(broker.broker.set_blocked, 'low on memory')
+            expect(await _wait_until(lambda: shed.broker_blocked and waiting.broker_blocked),
+                   "收到 connection.blocked 后 broker_blocked 应为 True")
+            expect(await publish_rejected(shed, {'id': 1}), "连接被阻塞时 shed 策略应抛出 BackpressureError")
+            pending = asyncio.create_task(waiting.publish_message({'id': 2}))
+            await asyncio.sleep(0.3)
+            expect(not pending.done(), "连接被阻塞时 wait 策略应等待")
+            broker.run(broker.broker.set_blocked, None)
+            await asyncio.wait_for(pending, 3)
+            expect(not shed.broker_blocked, "收到 connection.unblocked 后 broker_blocked 应为 False")
+            await shed.publish_message({'id': 3})
+            state = await shed.get_queue_state()
+            expect(state['messages'] == 2, f"解除阻塞后两条消息应入队: {state}")
+        finally:
+            await shed.close()
+            await waiting.close()
+
+    asyncio.run(backlog())
+    broker = FakeBrokerThread(port=_free_port()).start()
+    try:
+        asyncio.run(blocked(broker.broker.url))
+    finally:
+        broker.shutdown()
+
+def check_dedup():
+    """重复投递（含处理中到达的副本）回调只执行一次；处理失败释放占用后副本照常处理；批内副本只处理一份。"""
+    from dedup import DedupCache, SqliteDedupStore
+    from rabbitmq_client import AsyncRabbitMQClient
+    from serializers import decode_message
+
+    async def run(path):
+        client = AsyncRabbitMQClient(queue=_queue_name('dedup'), dedup=DedupCache(store=SqliteDedupStore(path)),
+                                     dedup_field='id', concurrency=4, retry_delays=(0.2,))
+        calls = []
+
+        async def callback(message):
+            key = decode_message(message)['id']
+            calls.append(key)
+            # 处理期间同一条消息的副本已经到达
+            await asyncio.sleep(0.2)
+            if key == 'fail' and calls.count(key) == 1:
+                raise RuntimeError("第一次处理失败")
+            await client.ack_message(message)
+
+        try:
+            await client.connect()
+            await client.declare_queue(durable=False)
+            for key in ('a', 'a', 'a', 'b', 'fail', 'fail'):
+                await client.publish_message({'id': key})
+            await _consume_for(client.consume_messages(callback), 1.5)
+            # fail 第一次失败后释放占用，处理中等待的副本接着处理成功，之后回来的重试消息被跳过
+            expect(sorted(calls) == ['a', 'b', 'fail', 'fail'], f"回调执行情况错误: {calls}")
+            expect(client.duplicates_skipped_total.value == 3,
+                   f"应跳过 3 条重复消息，实际 {client.duplicates_skipped_total.value}")
+            state = await client.get_queue_state()
+            expect(state['messages'] == 0, f"重复消息也应被确认: {state}")
+        finally:
+            await client.close()
+            await client.dedup.close()
+
+        # 新的内存索引从 sqlite 中识别已处理过的消息
+        restarted = AsyncRabbitMQClient(queue=client.queue, dedup=DedupCache(store=SqliteDedupStore(path)),
+                                        dedup_field='id')
+        calls.clear()
+
+        async def record(message):
+            calls.append(decode_message(message)['id'])
+            await restarted.ack_message(message)
+
+        try:
+            await restarted.connect()
+            await restarted.declare_queue(durable=False)
+            for key in ('a', 'c'):
+                await restarted.publish_message({'id': key})
+            await _consume_for(restarted.consume_messages(record), 0.5)
+            expect(calls == ['c'], f"重启后应只处理新消息: {calls}")
+        finally:
+            await restarted.close()
+            await restarted.dedup.close()
+
+        batched = AsyncRabbitMQClient(queue=_queue_name('dedup-batch'), dedup=True, dedup_field='id')
+        batches = []
+
+        async def on_batch(items):
+            batches.append([item.payload['id'] for item in items])
+
+        try:
+            await batched.connect()
+            await batched.declare_queue(durable=False)
+            for key in ('x', 'x', 'y'):
+                await batched.publish_message({'id': key})
+            await _consume_for(batched.consume_batches(on_batch, max_batch=10, max_wait_ms=200), 0.6)
+            expect(batches == [['x', 'y']], f"批内副本应只处理一份: {batches}")
+            state = await batched.get_queue_state()
+            expect(state['messages'] == 0, f"批内副本也应被确认: {state}")
+        finally:
+            await batched.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(run(os.path.join(directory, 'dedup.db')))
+
+def check_batch_results():
+    """consume_batches 按回调返回的逐条结果确认：True/None 确认，False 或异常实例进入重试；回调抛出异常时整批重试。"""
+    from rabbitmq_client import AsyncRabbitMQClient
+
+    async def run():
+        client = AsyncRabbitMQClient(queue=_queue_name('batch-results'), prefetch_count=20, retry_delays=(0.2,))
+        batches = []
+        raised = []
+
+        async def on_batch(items):
+            ids = [item.payload['id'] for item in items]
+            batches.append(ids)
+            if ids == [1, 2, 3, 4]:
+                return [True, False, RuntimeError("第 3 条失败"), None]
+            if 5 in ids and not raised:
+                raised.append(ids)
+                raise RuntimeError("整批失败")
+            return None
+
+        try:
+            await client.connect()
+            await client.declare_queue(durable=False)
+            for index in range(1, 5):
+                await client.publish_message({'id': index})
+            await _consume_for(client.consume_batches(on_batch, max_batch=10, max_wait_ms=100), 1)
+            expect(batches[0] == [1, 2, 3, 4], f"第一批应包含全部 4 条: {batches}")
+            expect(sorted(sum(batches[1:], [])) == [2, 3], f"只有失败的 2、3 应重试: {batches}")
+            expect(client.retried_total.value == 2, f"应有 2 条进入重试，实际 {client.retried_total.value}")
+
+            batches.clear()
+            for index in (5, 6):
+                await client.publish_message({'id': index})
+            await _consume_for(client.consume_batches(on_batch, max_batch=10, max_wait_ms=100), 1)
+            expect(raised == [[5, 6]] and sorted(sum(batches[1:], [])) == [5, 6],
+                   f"整批失败时全部消息应重试一次: {batches}")
+            expect(client.retried_total.value == 4, f"应共有 4 条进入重试，实际 {client.retried_total.value}")
+            state = await client.get_queue_state()
+            expect(state['messages'] == 0, f"队列中不应残留消息: {state}")
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+
+def check_rpc():
+    """call/reply 经 direct reply-to 往返：并发调用按 correlation_id 分发，服务端错误抛出 RPCError，超时后迟到的回复被丢弃。"""
+    from rabbitmq_client import AsyncRabbitMQClient, RPCError
+    from serializers import decode_message
+
+    async def run():
+        server = AsyncRabbitMQClient(queue=_queue_name('rpc'), concurrency=4)
+        caller = AsyncRabbitMQClient(queue=server.queue)
+
+        async def handle(message):
+            request = decode_message(message)
+            if request['op'] == 'add':
+                await server.reply(message, {'sum': request['a'] + request['b']})
+            elif request['op'] == 'fail':
+                await server.reply(message, error=ValueError("参数错误"))
+            else:
+                await asyncio.sleep(0.5)
+                await server.reply(message, {'late': True})
+            await server.ack_message(message)
+
+        try:
+            for client in (server, caller):
+                await client.connect()
+            await server.declare_queue(durable=False)
+            serving = asyncio.create_task(server.consume_messages(handle))
+            try:
+                results = await asyncio.gather(*(
+                    caller.call({'op': 'add', 'a': index, 'b': 10}, timeout=5) for index in range(5)
+                ))
+                expect(results == [{'sum': index + 10} for index in range(5)], f"并发调用的回复错位: {results}")
+                try:
+                    await caller.call({'op': 'fail'}, timeout=5)
+                except RPCError as e:
+                    expect('参数错误' in str(e), f"RPCError 应带服务端错误信息: {e}")
+                else:
+                    raise AssertionError("服务端回复错误时应抛出 RPCError")
+                try:
+                    await caller.call({'op': 'slow'}, timeout=0.2)
+                except asyncio.TimeoutError:
+                    pass
+                else:
+                    raise AssertionError("超时未回复时应抛出 asyncio.TimeoutError")
+                expect(caller.rpc_timeouts_total.value == 1, f"超时计数应为 1，实际 {caller.rpc_timeouts_total.value}")
+                # 等迟到的回复到达并被丢弃，之后的调用不受影响
+                await asyncio.sleep(0.5)
+                expect(await caller.call({'op': 'add', 'a': 1, 'b': 2}, timeout=5) == {'sum': 3}, "超时之后的调用应正常返回")
+            finally:
+                serving.cancel()
+                await asyncio.gather(serving, return_exceptions=True)
+        finally:
+            await caller.close()
+            await server.close()
+
+    asyncio.run(run())
+
+def check_shards():
+    """shards=N 时同一键总是进入同一分片（crc32 % N），无键时轮询；consume_shards 只消费订阅的分片。"""
+    import zlib
+
+    from rabbitmq_client import AsyncRabbitMQClient
+    from serializers import decode_message
+
+    async def run():
+        queue = _queue_name('shards')
+        publisher = AsyncRabbitMQClient(queue=queue, shards=4, shard_key=lambda message: message.get('user'))
+        consumers = {
+            'low': AsyncRabbitMQClient(queue=queue, shards=4, consume_shards=[0, 1]),
+            'high': AsyncRabbitMQClient(queue=queue, shards=4, consume_shards=[2, 3]),
+        }
+        received = {name: [] for name in consumers}
+
+        def record(name):
+            async def callback(message):
+                received[name].append((message.routing_key, decode_message(message)))
+                await consumers[name].ack_message(message)
+            return callback
+
+        try:
+            for client in (publisher, *consumers.values()):
+                await client.connect()
+                await client.declare_queue(durable=False)
+            for seq in range(4):
+                for user in range(10):
+                    await publisher.publish_message({'user': f"u{user}", 'seq': seq})
+            # 没有键时轮询分片；显式 key 优先于 shard_key
+            for seq in range(4):
+                await publisher.publish_message({'seq': seq})
+            await publisher.publish_message({'user': 'u0', 'seq': 'explicit'}, key='other')
+
+            async def consume_all():
+                await asyncio.gather(*(client.consume_messages(record(name)) for name, client in consumers.items()))
+
+            await _consume_for(consume_all(), 1)
+        finally:
+            for client in (publisher, *consumers.values()):
+                await client.close()
+
+        expect({key for key, _ in received['low']} <= {f"{queue}.0", f"{queue}.1"}, "low 只应收到分片 0、1 的消息")
+        expect({key for key, _ in received['high']} <= {f"{queue}.2", f"{queue}.3"}, "high 只应收到分片 2、3 的消息")
+        deliveries = received['low'] + received['high']
+        expect(len(deliveries) == 45, f"应收到全部 45 条消息，实际 {len(deliveries)}")
+        for user in range(10):
+            name = f"u{user}"
+            shards = {key for key, payload in deliveries if payload.get('user') == name and payload['seq'] != 'explicit'}
+            expect(shards == {f"{queue}.{zlib.crc32(name.encode()) % 4}"}, f"{name} 应只进入 crc32 对应的分片: {shards}")
+            seqs = [payload['seq'] for _, payload in deliveries if payload.get('user') == name and payload['seq'] != 'explicit']
+            expect(seqs == [0, 1, 2, 3], f"同一分片内 {name} 的消息应保持顺序: {seqs}")
+        unkeyed = sorted(key for key, payload in deliveries if 'user' not in payload)
+        expect(unkeyed == [f"{queue}.{index}" for index in range(4)], f"无键消息应轮询到每个分片: {unkeyed}")
+        explicit = [key for key, payload in deliveries if payload['seq'] == 'explicit']
+        expect(explicit == [f"{queue}.{zlib.crc32(b'other') % 4}"], f"显式 key 应优先于 shard_key: {explicit}")
+
+    asyncio.run(run())
+
+def check_streams():
+    """publish_stream / consume_streams 往返：bytes、文件、异步迭代器和空流并发发布，元数据和内容完整还原。"""
+    from rabbitmq_client import AsyncRabbitMQClient
+
+    async def run(directory):
+        rng = random.Random(3)
+        blob = rng.randbytes(50 * 1000 + 7)
+        path = os.path.join(directory, 'source.bin')
+        file_data = rng.randbytes(20 * 1000)
+        with open(path, 'wb') as f:
+            f.write(file_data)
+
+        async def generate():
+            for index in range(5):
+                yield bytes([index]) * 3000
+
+        client = AsyncRabbitMQClient(queue=_queue_name('streams'))
+        received = {}
+        spooled = []
+
+        async def on_stream(stream):
+            chunks = [chunk async for chunk in stream.iter_chunks(7000)]
+            received[stream.stream_id] = (stream.metadata, b''.join(chunks), stream.size)
+            if stream.size > 10 * 1000:
+                spooled.append(stream.file._rolled)
+
+        try:
+            await client.connect()
+            await client.declare_queue(durable=False)
+            # 并发发布，各流的块在队列中交错
+            ids = await asyncio.gather(
+                client.publish_stream(blob, chunk_size=4096, metadata={'name': 'blob.bin', 'pages': 3}),
+                client.publish_stream(path, chunk_size=4096, metadata={'name': 'source.bin'}),
+                client.publish_stream(generate(), chunk_size=4096),
+                client.publish_stream(b''),
+            )
+            await client.publish_message({'not': 'a stream'})
+            # spool_max_memory 很小，大流转存到临时文件
+            await _consume_for(client.consume_streams(on_stream, spool_max_memory=10 * 1000), 1.5)
+            state = await client.get_queue_state()
+        finally:
+            await client.close()
+
+        expected = [
+            ({'name': 'blob.bin', 'pages': 3}, blob),
+            ({'name': 'source.bin'}, file_data),
+            (None, b''.join(bytes([index]) * 3000 for index in range(5))),
+            (None, b''),
+        ]
+        expect(set(received) == set(ids), f"应收到全部 {len(ids)} 个流，实际 {len(received)} 个")
+        for stream_id, (metadata, data) in zip(ids, expected):
+            got_metadata, got_data, size = received[stream_id]
+            expect(got_metadata == metadata, f"流 {stream_id} 的元数据错误: {got_metadata}")
+            expect(got_data == data and size == len(data), f"流 {stream_id} 的内容不一致（{size} / {len(data)} 字节）")
+        expect(spooled == [True, True, True], f"超过 spool_max_memory 的流应转存到磁盘: {spooled}")
+        expect(client.streams_received_total.value == 4, f"接收计数应为 4，实际 {client.streams_received_total.value}")
+        expect(state['messages'] == 0, f"非分块消息应按失败处理，队列中不应残留消息: {state}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(run(directory))
+
+CHECKS = {
+    'outbox': check_outbox,
+    'ack_coalescer': check_ack_coalescer,
+    'ack_coalescer_direct_settle': check_ack_coalescer_direct_settle,
+    'range_set': check_range_set,
+    'delivery_verifier': check_delivery_verifier,
+    'stream_assembler': check_stream_assembler,
+}
+
+# 需要 broker 的检查（连接 RABBITMQ_URL），只在指定 --broker 时运行
+BROKER_CHECKS = {
+    'ack_then_raise': check_ack_then_raise,
+    'codec': check_codec,
+    'backpressure': check_backpressure,
+    'dedup': check_dedup,
+    'batch_results': check_batch_results,
+    'rpc': check_rpc,
+    'shards': check_shards,
+    'streams': check_streams,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="组件自检")
+    parser.add_argument('checks', nargs='*',
+                        help=f"要运行的检查（默认全部）: {', '.join(CHECKS)}；--broker 时: {', '.join(BROKER_CHECKS)}")
+    parser.add_argument('--broker', action='store_true', help="运行需要 broker 的检查")
+    args = parser.parse_args()
+    checks = BROKER_CHECKS if args.broker else CHECKS
+    unknown = [name for name in args.checks if name not in checks]
+    if unknown:
+        parser.error(f"未知的检查: {', '.join(unknown)}")
+
+    failed = []
+    for name in args.checks or checks:
+        try:
+            checks[name]()
+            logger.info(f"{name}: 通过")
+        except Exception as e:
+            failed.append(name)
+            logger.error(f"{name}: 失败 - {type(e).__name__}: {e}")
+    if failed:
+        logger.error(f"{len(failed)} 项检查失败: {', '.join(failed)}")
+        sys.exit(1)
+    logger.info("全部组件检查通过")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import aio_pika
+import asyncio
+import logging
+import weakref
+from contextlib import asynccontextmanager
+
+# 日志由 rabbitmq_client 统一配置
+logger = logging.getLogger(__name__)
+
+class ConnectionManager:
+    """
+    进程内共享的 RabbitMQ 连接管理器。
+
+    同一事件循环内相同 url 和配置的客户端共用一条 robust 连接，发布时从通道池借用通道，
+    用完归还；通道在借出和归还时做健康检查，已关闭的通道直接丢弃并补建。
+    """
+
+    # 事件循环 -> {(url, max_channels, publisher_confirms): 管理器}；循环被回收后对应条目自动删除
+    _managers = weakref.WeakKeyDictionary()
+
+    def __init__(self, url, max_channels=10, publisher_confirms=True):
+        self.url = url
+        self.max_channels = max_channels
+        self.publisher_confirms = publisher_confirms
+        self.connection = None
+        self._connection_lock = asyncio.Lock()
+        self._idle_channels = asyncio.Queue()
+        self._slots = asyncio.Semaphore(max_channels)
+        self._closed = False
+
+    @classmethod
+    def shared(cls, url, max_channels=10, publisher_confirms=True):
+        """获取当前事件循环中 url 和配置都相同的共享管理器，不存在或已关闭时新建。"""
+        # 管理器持有的连接会引用所属的循环，弱引用不一定能释放；已关闭循环的条目在这里清理
+        for loop in [loop for loop in cls._managers if loop.is_closed()]:
+            del cls._managers[loop]
+        managers = cls._managers.setdefault(asyncio.get_running_loop(), {})
+        key = (url, max_channels, publisher_confirms)
+        manager = managers.get(key)
+        if manager is None or manager._closed:
+            manager = cls(url, max_channels=max_channels, publisher_confirms=publisher_confirms)
+            managers[key] = manager
+        return manager
+
+    @classmethod
+    async def close_all(cls):
+        """关闭当前事件循环中的全部共享管理器。"""
+        managers = list(cls._managers.pop(asyncio.get_running_loop(), {}).values())
+        for manager in managers:
+            await manager.close()
+
+    async def get_connection(self):
+        async with self._connection_lock:
+            if self._closed:
+                raise RuntimeError("连接管理器已关闭")
+            if self.connection is None or self.connection.is_closed:
+                logger.info("共享连接建立中...")
+                self.connection = await aio_pika.connect_robust(self.url)
+                logger.info("共享连接已建立")
+            return self.connection
+
+    async def acquire_channel(self):
+        await self._slots.acquire()
+        try:
+            while not self._idle_channels.empty():
+                channel = self._idle_channels.get_nowait()
+                if not channel.is_closed:
+                    return channel
+                logger.debug("丢弃已关闭的池化通道")
+            connection = await self.get_connection()
+            return await connection.channel(publisher_confirms=self.publisher_confirms)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release_channel(self, channel):
+        if not self._closed and not channel.is_closed:
+            self._idle_channels.put_nowait(channel)
+        self._slots.release()
+
+    @asynccontextmanager
+    async def channel(self):
+        channel = await self.acquire_channel()
+        try:
+            yield channel
+        finally:
+            self.release_channel(channel)
+
+    async def close(self):
+        self._closed = True
+        while not self._idle_channels.empty():
+            channel = self._idle_channels.get_nowait()
+            try:
+                await channel.close()
+            except Exception as e:
+                logger.debug(f"关闭池化通道失败: {e}")
+        if self.connection:
+            await self.connection.close()
+            self.connection = None
+        logger.info("共享连接已关闭")
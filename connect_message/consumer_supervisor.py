@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+from log_setup import log_file, rotation_enabled
+from metrics import MetricsRegistry, aggregate_dumps
+import receive
+
+logger = logging.getLogger(__name__)
+
+def _strip_gauges(state):
+    # 已退出进程的仪表值不再有意义，只保留计数器和直方图
+    return {name: entry for name, entry in state.items() if entry['kind'] != 'gauge'}
+
+async def _run_worker(metrics_queue, report_interval):
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop_event.set)
+    client = receive.create_client()
+
+    def report():
+        try:
+            metrics_queue.put_nowait((os.getpid(), client.metrics.dump()))
+        except queue.Full:
+            pass
+
+    async def report_loop():
+        while True:
+            await asyncio.sleep(report_interval)
+            report()
+
+    reporter = asyncio.create_task(report_loop())
+    try:
+        await receive.run(client, stop_event)
+        logger.info(f"消费进程 {os.getpid()} 已排空并退出")
+    finally:
+        reporter.cancel()
+        await client.close()
+        report()
+
+def worker_main(metrics_queue, report_interval):
+    """消费进程入口：SIGTERM 时排空后退出，SIGINT 交由主进程处理。"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(metrics_queue, report_interval))
+
+
+class ConsumerSupervisor:
+    """
+    启动 workers 个 receive.py 消费进程共享同一队列，使 CPU 密集的回调能用满多核。
+
+    工作进程异常退出时按指数退避重启；收到 SIGTERM/SIGINT 时通知所有工作进程排空，
+    超过 drain_timeout 仍未退出的进程被强制结束。各进程定期上报指标，
+    主进程汇总到 self.metrics，设置 metrics_port 时以 /metrics 暴露。
+    """
+
+    def __init__(self, workers=None, drain_timeout=30, report_interval=5, metrics_port=None,
+                 restart_backoff=1, max_restart_backoff=30):
+        self.workers = workers or os.cpu_count() or 1
+        self.drain_timeout = drain_timeout  # 排空等待秒数
+        self.report_interval = report_interval  # 工作进程上报指标的间隔
+        self.metrics_port = metrics_port
+        self.restart_backoff = restart_backoff  # 首次重启等待秒数
+        self.max_restart_backoff = max_restart_backoff
+        self.metrics = MetricsRegistry(labels={'queue': 'hello'})
+        self._context = multiprocessing.get_context('spawn')
+        self._metrics_queue = self._context.Queue(maxsize=self.workers * 10)
+        self._processes = [None] * self.workers
+        self._started_at = [0.0] * self.workers
+        self._backoff = [restart_backoff] * self.workers
+        self._restart_at = [0.0] * self.workers
+        self._live_metrics = {}  # pid -> 最近一次上报
+        self._retired_metrics = {}  # 已退出进程的累计值
+        self._stopping = asyncio.Event()
+        self.restarts = 0
+
+    def _spawn(self, slot):
+        process = self._context.Process(
+            target=worker_main, args=(self._metrics_queue, self.report_interval),
+            name=f"consumer-{slot}", daemon=False,
+        )
+        if rotation_enabled():
+            # 开启滚动时每个进程只写自己的日志文件；spawn 启动的子进程继承此刻的环境变量
+            shared = log_file()
+            root, ext = os.path.splitext(shared)
+            os.environ['LOG_FILE'] = f"{root}.{slot}{ext}"
+            try:
+                process.start()
+            finally:
+                os.environ['LOG_FILE'] = shared
+        else:
+            process.start()
+        self._processes[slot] = process
+        self._started_at[slot] = time.monotonic()
+        logger.info(f"消费进程 {slot} 已启动: pid={process.pid}")
+
+    def _collect_metrics(self):
+        while True:
+            try:
+                pid, state = self._metrics_queue.get_nowait()
+            except queue.Empty:
+                break
+            self._live_metrics[pid] = state
+
+    def _retire(self, pid):
+        state = self._live_metrics.pop(pid, None)
+        if state:
+            self._retired_metrics = aggregate_dumps([self._retired_metrics, _strip_gauges(state)])
+
+    def _refresh_metrics(self):
+        self._collect_metrics()
+        self.metrics.load(aggregate_dumps([self._retired_metrics, *self._live_metrics.values()]))
+        self.metrics.gauge('consumer_workers_alive', '存活的消费进程数').set(
+            sum(1 for process in self._processes if process and process.is_alive()))
+        self.metrics.counter('consumer_worker_restarts_total', '消费进程重启次数').inc(self.restarts)
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for slot, process in enumerate(self._processes):
+            if process is not None:
+                if process.is_alive():
+                    continue
+                logger.info(f"消费进程 {slot} 异常退出: pid={process.pid}, exitcode={process.exitcode}")
+                self._collect_metrics()
+                self._retire(process.pid)
+                process.close()
+                self._processes[slot] = None
+                # 稳定运行一段时间后才重置退避，避免启动即崩溃时频繁重启
+                if now - self._started_at[slot] > self.max_restart_backoff * 2:
+                    self._backoff[slot] = self.restart_backoff
+                self._restart_at[slot] = now + self._backoff[slot]
+                self._backoff[slot] = min(self._backoff[slot] * 2, self.max_restart_backoff)
+            elif now >= self._restart_at[slot]:
+                self.restarts += 1
+                self._spawn(slot)
+
+    def stop(self):
+        self._stopping.set()
+
+    async def _drain(self):
+        alive = [process for process in self._processes if process and process.is_alive()]
+        logger.info(f"通知 {len(alive)} 个消费进程排空")
+        for process in alive:
+            process.terminate()  # SIGTERM
+        deadline = time.monotonic() + self.drain_timeout
+        while any(process.is_alive() for process in alive) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for process in alive:
+            if process.is_alive():
+                logger.info(f"消费进程 pid={process.pid} 排空超时，强制结束")
+                process.kill()
+            process.join()
+        self._collect_metrics()
+        for process in alive:
+            self._retire(process.pid)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop)
+        if self.metrics_port:
+            await self.metrics.start_http_server(port=self.metrics_port)
+        for slot in range(self.workers):
+            self._spawn(slot)
+        try:
+            while not self._stopping.is_set():
+                self._check_workers()
+                self._refresh_metrics()
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), 0.5)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self._drain()
+            self._refresh_metrics()
+            await self.metrics.stop_http_server()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(sig)
+        logger.info(f"所有消费进程已退出，汇总指标: {self.metrics.snapshot()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程运行 receive.py 消费者")
+    parser.add_argument('--workers', type=int, default=None, help="消费进程数，默认等于 CPU 核数")
+    parser.add_argument('--drain-timeout', type=float, default=30, help="SIGTERM 后等待排空的秒数")
+    parser.add_argument('--report-interval', type=float, default=5, help="工作进程上报指标的间隔")
+    parser.add_argument('--metrics-port', type=int, default=int(os.environ.get('METRICS_PORT') or 0),
+                        help="汇总指标的 /metrics 端口，默认读取 METRICS_PORT")
+    cmd_args = parser.parse_args()
+    # 汇总指标由主进程暴露，工作进程不再各自监听同一端口
+    os.environ.pop('METRICS_PORT', None)
+    supervisor = ConsumerSupervisor(
+        workers=cmd_args.workers, drain_timeout=cmd_args.drain_timeout,
+        report_interval=cmd_args.report_interval, metrics_port=cmd_args.metrics_port,
+    )
+    asyncio.run(supervisor.run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# 日志由 rabbitmq_client 统一配置
+logger = logging.getLogger(__name__)
+
+class SqliteDedupStore:
+    """
+    去重记录的持久化存储（sqlite），进程重启后仍能识别重复消息。
+
+    写入每 commit_every 条提交一次，进程崩溃时最近未提交的记录会丢失（退化为可能重复处理）。
+    方法是阻塞调用，内部加锁，DedupCache 通过 asyncio.to_thread 在工作线程中调用。
+    """
+
+    def __init__(self, path, commit_every=100):
+        self.path = path
+        self.commit_every = commit_every
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY, seen_at REAL NOT NULL)')
+        self._db.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute('SELECT seen_at FROM seen WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def add(self, key, seen_at, expired_before):
+        """
+        记录 key，检查和写入是一条语句：不存在或已过期（早于 expired_before）时写入并返回 True，
+        仍有效时不修改并返回 False（例如共用同一个数据库的其他消费者已经处理过）。
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT INTO seen (key, seen_at) VALUES (?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET seen_at = excluded.seen_at WHERE seen_at < ?',
+                (key, seen_at, expired_before)
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self._commit()
+        return cursor.rowcount == 1
+
+    def expire(self, before):
+        with self._lock:
+            self._db.execute('DELETE FROM seen WHERE seen_at < ?', (before,))
+            self._commit()
+
+    def commit(self):
+        with self._lock:
+            self._commit()
+
+    def _commit(self):
+        self._db.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            self._db.close()
+
+
+class DedupCache:
+    """
+    已处理消息的去重索引：内存中按 LRU 保留最多 max_entries 个键，超过 ttl 秒的记录视为过期。
+
+    传入 store（如 SqliteDedupStore）时，内存未命中会再查询持久化存储，新记录同时写入；
+    store 的调用都放到工作线程中执行，不阻塞事件循环。
+
+    消费端先 claim(key) 占用键（检查和占用之间没有 await，同一事件循环中的并发投递只有一个能占用），
+    处理成功后 add(key) 记录并释放，失败时 release(key) 释放。占用只保存在内存中：
+    进程在处理中途退出时 broker 会重新投递，不会因为占用而把消息当作重复丢弃。
+    """
+
+    def __init__(self, max_entries=100_000, ttl=24 * 3600, store=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.store = store
+        # key -> 处理完成的时间戳（time.time()，与持久化存储共用），按最近使用排序
+        self._entries = OrderedDict()
+        # 正在处理的 key -> 处理结束（add 或 release）时置位的事件
+        self._claimed = {}
+        self._last_expire = time.time()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remember(self, key, seen_at):
+        self._entries[key] = seen_at
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def claim(self, key):
+        """
+        检查并占用 key：ttl 内处理过时返回 False；同一个 key 正在处理时等它结束再判断，
+        这样先到的消息处理失败（释放而不记录）时后到的副本仍会被处理。
+        """
+        while key in self._claimed:
+            await self._claimed[key].wait()
+        self._claimed[key] = asyncio.Event()
+        try:
+            seen = await self.seen(key)
+        except BaseException:
+            self.release(key)
+            raise
+        if seen:
+            self.release(key)
+            return False
+        return True
+
+    def release(self, key):
+        event = self._claimed.pop(key, None)
+        if event is not None:
+            event.set()
+
+    async def seen(self, key):
+        """key 在 ttl 内被 add 过时返回 True。"""
+        now = time.time()
+        seen_at = self._entries.get(key)
+        if seen_at is None and self.store is not None:
+            seen_at = await asyncio.to_thread(self.store.get, key)
+            if seen_at is not None:
+                self._remember(key, seen_at)
+        if seen_at is None:
+            return False
+        if now - seen_at > self.ttl:
+            self._entries.pop(key, None)
+            return False
+        self._entries.move_to_end(key)
+        return True
+
+    async def add(self, key):
+        """记录 key 已处理完成并释放占用；持久化存储中已有其他消费者的有效记录时返回 False。"""
+        now = time.time()
+        self._remember(key, now)
+        self.release(key)
+        if self.store is None:
+            return True
+        added = await asyncio.to_thread(self.store.add, key, now, now - self.ttl)
+        if not added:
+            logger.debug(f"去重记录已存在于持久化存储: {key}")
+        # 每个 ttl 周期清理一次持久化存储中的过期记录
+        if now - self._last_expire > self.ttl:
+            self._last_expire = now
+            await asyncio.to_thread(self.store.expire, now - self.ttl)
+        return added
+
+    async def flush(self):
+        if self.store is not None:
+            await asyncio.to_thread(self.store.commit)
+
+    async def close(self):
+        if self.store is not None:
+            await asyncio.to_thread(self.store.close)
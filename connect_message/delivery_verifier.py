@@ -0,0 +1,185 @@
+import bisect
+import json
+import logging
+import os
+import uuid
+
+# 日志由 rabbitmq_client 统一配置
+logger = logging.getLogger(__name__)
+
+# 生产端写入的运行 ID 与序号（每个 run_id 从 0 开始连续递增）
+RUN_ID_HEADER = 'x-run-id'
+SEQUENCE_HEADER = 'x-seq'
+
+class SequenceStamper:
+    """生产端：给每条消息打上 run_id 和递增序号，消费端据此检查丢失、重复和乱序。"""
+
+    def __init__(self, run_id=None):
+        self.run_id = run_id or uuid.uuid4().hex
+        self.sent = 0
+
+    def stamp(self, headers):
+        headers[RUN_ID_HEADER] = self.run_id
+        headers[SEQUENCE_HEADER] = self.sent
+        self.sent += 1
+        return headers
+
+
+class RangeSet:
+    """
+    非负整数集合，按不相交的半开区间 [start, end) 存储。
+
+    序号基本连续到达时只占用一两个区间，内存与消息总数无关，只与空洞（丢失或尚未到达）数量有关。
+    """
+
+    __slots__ = ('_starts', '_ends', 'count')
+
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, value):
+        index = bisect.bisect_right(self._starts, value) - 1
+        return index >= 0 and value < self._ends[index]
+
+    def add(self, value):
+        """加入 value，已存在时返回 False。"""
+        index = bisect.bisect_right(self._starts, value) - 1
+        if index >= 0 and value < self._ends[index]:
+            return False
+        merge_left = index >= 0 and self._ends[index] == value
+        merge_right = index + 1 < len(self._starts) and self._starts[index + 1] == value + 1
+        if merge_left and merge_right:
+            self._ends[index] = self._ends[index + 1]
+            del self._starts[index + 1]
+            del self._ends[index + 1]
+        elif merge_left:
+            self._ends[index] = value + 1
+        elif merge_right:
+            self._starts[index + 1] = value
+        else:
+            self._starts.insert(index + 1, value)
+            self._ends.insert(index + 1, value + 1)
+        self.count += 1
+        return True
+
+    @property
+    def upper(self):
+        """最大值 + 1，集合为空时为 0。"""
+        return self._ends[-1] if self._ends else 0
+
+    def intervals(self):
+        return list(zip(self._starts, self._ends))
+
+    def gaps(self, upper=None, limit=None):
+        """返回 [0, upper) 中缺失的区间（默认 upper 为最大值 + 1），最多 limit 个。"""
+        upper = self.upper if upper is None else upper
+        missing = []
+        position = 0
+        for start, end in zip(self._starts, self._ends):
+            if start >= upper or (limit is not None and len(missing) >= limit):
+                break
+            if start > position:
+                missing.append((position, start))
+            position = end
+        if position < upper and (limit is None or len(missing) < limit):
+            missing.append((position, upper))
+        return missing
+
+
+class _RunStats:
+    __slots__ = ('seen', 'received', 'duplicates', 'reordered')
+
+    def __init__(self):
+        self.seen = RangeSet()
+        self.received = 0
+        self.duplicates = 0
+        self.reordered = 0
+
+
+class DeliveryVerifier:
+    """
+    消费端：按 run_id 跟踪收到的序号，增量统计丢失、重复和乱序，内存只与空洞数量有关。
+
+    乱序指序号小于同一 run 中已收到的最大序号；丢失指最大序号以下仍缺的序号，
+    report(expected=...) 传入各 run 的发送总数时，末尾未到达的消息也计为丢失。
+    report_every 条消息输出一次汇总日志。
+    """
+
+    def __init__(self, report_every=None):
+        self.report_every = report_every
+        self.unstamped = 0
+        self._runs = {}
+        self._observed = 0
+
+    def observe(self, message):
+        """记录一条消息（IncomingMessage 或 headers 字典），返回 'ok' / 'duplicate' / 'reordered' / 'unstamped'。"""
+        headers = message if isinstance(message, dict) else (message.headers or {})
+        run_id = headers.get(RUN_ID_HEADER)
+        sequence = headers.get(SEQUENCE_HEADER)
+        if isinstance(run_id, bytes):
+            run_id = run_id.decode()
+        if run_id is None or not isinstance(sequence, int):
+            self.unstamped += 1
+            return 'unstamped'
+        stats = self._runs.get(run_id)
+        if stats is None:
+            stats = self._runs[run_id] = _RunStats()
+        stats.received += 1
+        upper = stats.seen.upper
+        if not stats.seen.add(sequence):
+            stats.duplicates += 1
+            result = 'duplicate'
+        elif sequence < upper:
+            stats.reordered += 1
+            result = 'reordered'
+        else:
+            result = 'ok'
+        self._observed += 1
+        if self.report_every and self._observed % self.report_every == 0:
+            summary = self.report()
+            logger.info(
+                f"投递校验: 收到 {summary['received']} 条，丢失 {summary['missing']}，"
+                f"重复 {summary['duplicates']}，乱序 {summary['reordered']}"
+            )
+        return result
+
+    def report(self, expected=None, max_gaps=10):
+        """
+        返回汇总与各 run 的统计；expected 为 {run_id: 发送条数}。
+
+        gaps 只列出前 max_gaps 个缺失区间（半开区间 [start, end)）。
+        """
+        expected = expected or {}
+        runs = {}
+        totals = {'received': 0, 'unique': 0, 'missing': 0, 'duplicates': 0, 'reordered': 0}
+        for run_id in set(self._runs) | set(expected):
+            stats = self._runs.get(run_id) or _RunStats()
+            upper = max(expected.get(run_id, 0), stats.seen.upper)
+            run = {
+                'received': stats.received,
+                'unique': len(stats.seen),
+                'missing': upper - len(stats.seen),
+                'duplicates': stats.duplicates,
+                'reordered': stats.reordered,
+                'gaps': stats.seen.gaps(upper, limit=max_gaps),
+            }
+            runs[run_id] = run
+            for key in totals:
+                totals[key] += run[key]
+        return {**totals, 'unstamped': self.unstamped, 'runs': runs}
+
+    def ok(self, expected=None):
+        """没有丢失和重复时返回 True（乱序不算错误）。"""
+        summary = self.report(expected, max_gaps=0)
+        return summary['missing'] == 0 and summary['duplicates'] == 0
+
+    def save(self, path, expected=None):
+        """把 report() 写入 JSON 文件（先写临时文件再替换，读取方不会看到半个文件）。"""
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.report(expected), f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
@@ -0,0 +1,897 @@
+import argparse
+import asyncio
+import copy
+import itertools
+import json
+import logging
+import os
+import pickle
+import struct
+import threading
+import time
+from collections import deque
+
+import pamqp.frame
+from pamqp import commands
+from pamqp.body import ContentBody
+from pamqp.header import ContentHeader, ProtocolHeader
+from pamqp.heartbeat import Heartbeat
+
+# 日志由调用方配置；独立运行时见 main()
+logger = logging.getLogger(__name__)
+
+FRAME_MAX = 131072
+CHANNEL_MAX = 2047
+# direct reply-to 伪队列：以 no_ack 消费后，reply_to 指向它的发布被改写为本通道专属地址
+DIRECT_REPLY_TO = 'amq.rabbitmq.reply-to'
+
+class ChannelError(Exception):
+    """通道级错误，broker 以 Channel.Close 关闭该通道。"""
+
+    def __init__(self, reply_code, reply_text, method=None):
+        super().__init__(reply_text)
+        self.reply_code = reply_code
+        self.reply_text = reply_text
+        self.method = method
+
+
+class StoredMessage:
+    __slots__ = ('body', 'properties', 'exchange', 'routing_key', 'redelivered', 'expires_at')
+
+    def __init__(self, body, properties, exchange, routing_key, redelivered=False):
+        self.body = body
+        self.properties = properties
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.redelivered = redelivered
+        # 按队列 x-message-ttl 或消息 expiration 计算的过期时间（time.time()），None 表示不过期
+        self.expires_at = None
+
+    @property
+    def persistent(self):
+        return self.properties is not None and self.properties.delivery_mode == 2
+
+
+class FakeQueue:
+    def __init__(self, name, durable=False, exclusive_owner=None, auto_delete=False, arguments=None):
+        self.name = name
+        self.durable = durable
+        self.exclusive_owner = exclusive_owner
+        self.auto_delete = auto_delete
+        self.arguments = arguments or {}
+        self.messages = deque()
+        # 每项为 (channel, consumer_tag, no_ack)
+        self.consumers = []
+        self.unacked = 0
+        self._next_consumer = 0
+
+
+class FakeExchange:
+    def __init__(self, name, exchange_type='direct', durable=False):
+        self.name = name
+        self.type = exchange_type
+        self.durable = durable
+        # (queue_name, routing_key)
+        self.bindings = set()
+
+
+def topic_matches(pattern, routing_key):
+    def _match(pattern_words, key_words):
+        if not pattern_words:
+            return not key_words
+        head, rest = pattern_words[0], pattern_words[1:]
+        if head == '#':
+            return any(_match(rest, key_words[i:]) for i in range(len(key_words) + 1))
+        if not key_words:
+            return False
+        return (head == '*' or head == key_words[0]) and _match(rest, key_words[1:])
+    return _match(pattern.split('.') if pattern else [], routing_key.split('.') if routing_key else [])
+
+
+class FakeChannel:
+    def __init__(self, connection, number):
+        self.connection = connection
+        self.number = number
+        self.confirm = False
+        self.publish_seq = 0
+        self.prefetch_count = 0
+        self.delivery_tags = itertools.count(1)
+        # delivery_tag -> (queue, message)
+        self.unacked = {}
+        # consumer_tag -> queue
+        self.consumers = {}
+        self.closing = False
+        # 正在接收的发布：(Basic.Publish, ContentHeader 或 None, 已收到的消息体片段)
+        self.pending_publish = None
+        # direct reply-to 消费者：(consumer_tag, 回复地址)
+        self.reply_consumer = None
+
+    def has_capacity(self):
+        return not self.prefetch_count or len(self.unacked) < self.prefetch_count
+
+
+class FakeConnection:
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.channels = {}
+        self.heartbeat = 0
+        self.frame_max = FRAME_MAX
+        self.closed = False
+        self._heartbeat_task = None
+        self.peer = writer.get_extra_info('peername')
+
+    def send(self, frame, channel=0):
+        if self.closed:
+            return
+        self.writer.write(pamqp.frame.marshal(frame, channel))
+
+    def send_content(self, channel, method, message):
+        self.send(method, channel)
+        self.send(ContentHeader(0, len(message.body), message.properties or commands.Basic.Properties()), channel)
+        chunk_size = self.frame_max - 8
+        for offset in range(0, len(message.body), chunk_size):
+            self.send(ContentBody(message.body[offset:offset + chunk_size]), channel)
+
+    async def read_frame(self):
+        header = await self.reader.readexactly(7)
+        _, _, size = struct.unpack('>BHI', header)
+        payload = await self.reader.readexactly(size + 1)
+        _, channel, frame = pamqp.frame.unmarshal(header + payload)
+        return channel, frame
+
+    async def _send_heartbeats(self):
+        while not self.closed:
+            await asyncio.sleep(self.heartbeat / 2)
+            self.send(Heartbeat())
+
+    async def handshake(self):
+        protocol_header = await self.reader.readexactly(8)
+        if not protocol_header.startswith(b'AMQP'):
+            self.writer.write(ProtocolHeader().marshal())
+            raise ConnectionError("不支持的协议头")
+        self.send(commands.Connection.Start(
+            server_properties={
+                'product': 'FakeBroker',
+                'version': '0.1',
+                'capabilities': {
+                    'publisher_confirms': True,
+                    'basic.nack': True,
+                    'consumer_cancel_notify': True,
+                    'connection.blocked': True,
+                    'authentication_failure_close': True,
+                },
+            },
+            mechanisms='PLAIN AMQPLAIN',
+            locales='en_US'
+        ))
+        _, start_ok = await self.read_frame()
+        self.send(commands.Connection.Tune(channel_max=CHANNEL_MAX, frame_max=FRAME_MAX, heartbeat=60))
+        _, tune_ok = await self.read_frame()
+        self.heartbeat = tune_ok.heartbeat
+        self.frame_max = tune_ok.frame_max or FRAME_MAX
+        _, open_frame = await self.read_frame()
+        self.send(commands.Connection.OpenOk())
+        if self.broker.blocked_reason is not None:
+            self.send(commands.Connection.Blocked(reason=self.broker.blocked_reason))
+        if self.heartbeat:
+            self._heartbeat_task = asyncio.create_task(self._send_heartbeats())
+
+    def abort(self):
+        # 模拟网络中断：不发 Connection.Close，直接断开
+        self.writer.transport.abort()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+        for channel in list(self.channels.values()):
+            self.broker.close_channel(channel)
+        self.channels.clear()
+        self.broker.drop_exclusive_queues(self)
+        self.writer.close()
+
+
+class FakeBroker:
+    """
+    进程内的最小 AMQP 0-9-1 broker，供测试和基准在没有 RabbitMQ 时使用。
+
+    支持 default/direct/fanout/topic 交换机、队列声明与绑定、发布确认、prefetch、
+    ack/nack/reject 与重新投递、basic.get、消息 TTL（x-message-ttl / expiration）与死信交换机
+    （x-dead-letter-exchange，过期或 requeue=False 拒绝时转发）、direct reply-to（amq.rabbitmq.reply-to），
+    以及 connection.blocked 通知。
+    stop() 后只保留持久化队列中的持久化消息（指定 data_file 时会写入磁盘），
+    drop_connections() 模拟网络中断，set_management_enabled(False) 模拟管理 API 不可用。
+    """
+
+    def __init__(self, host='127.0.0.1', port=5673, management_port=None, data_file=None):
+        self.host = host
+        self.port = port
+        self.management_port = management_port
+        self.data_file = data_file
+        self.queues = {}
+        self.exchanges = {}
+        self.connections = set()
+        self.blocked_reason = None
+        self._server = None
+        self._management_server = None
+        self._expiry_task = None
+        self._queue_names = itertools.count(1)
+        self._consumer_tags = itertools.count(1)
+        # 回复地址 -> 消费 amq.rabbitmq.reply-to 的通道
+        self._reply_channels = {}
+        self._reply_ids = itertools.count(1)
+        self._declare_default_exchanges()
+        self._load()
+
+    @property
+    def url(self):
+        return f"amqp://guest:guest@{self.host}:{self.port}/"
+
+    @property
+    def running(self):
+        return self._server is not None
+
+    def _declare_default_exchanges(self):
+        for name, exchange_type in (('', 'direct'), ('amq.direct', 'direct'),
+                                    ('amq.fanout', 'fanout'), ('amq.topic', 'topic')):
+            self.exchanges.setdefault(name, FakeExchange(name, exchange_type, durable=True))
+
+    # ---- 生命周期 ----
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        if self.port == 0:
+            self.port = self._server.sockets[0].getsockname()[1]
+        if self.management_port is not None:
+            await self.set_management_enabled(True)
+        self._expiry_task = asyncio.create_task(self._expiry_loop())
+        logger.info(f"FakeBroker 已启动: {self.url}")
+
+    async def stop(self):
+        """模拟 broker 停止：断开所有连接，只保留持久化数据。"""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._expiry_task:
+            self._expiry_task.cancel()
+            await asyncio.gather(self._expiry_task, return_exceptions=True)
+            self._expiry_task = None
+        await self.drop_connections()
+        await self.set_management_enabled(False)
+        for name in [name for name, queue in self.queues.items() if not queue.durable]:
+            del self.queues[name]
+        for queue in self.queues.values():
+            queue.messages = deque(message for message in queue.messages if message.persistent)
+        for name in [name for name, exchange in self.exchanges.items() if not exchange.durable]:
+            del self.exchanges[name]
+        self._save()
+        logger.info("FakeBroker 已停止")
+
+    async def restart(self):
+        await self.stop()
+        await self.start()
+
+    async def drop_connections(self):
+        for connection in list(self.connections):
+            connection.abort()
+            connection.close()
+        self.connections.clear()
+        # 让被中断连接的读写协程有机会退出
+        await asyncio.sleep(0)
+
+    def _save(self):
+        if not self.data_file:
+            return
+        state = {
+            'queues': {
+                name: (queue.durable, queue.arguments,
+                       [(m.body, m.properties, m.exchange, m.routing_key) for m in queue.messages])
+                for name, queue in self.queues.items()
+            },
+            'exchanges': {
+                name: (exchange.type, sorted(exchange.bindings))
+                for name, exchange in self.exchanges.items() if name and not name.startswith('amq.')
+            },
+        }
+        with open(self.data_file, 'wb') as f:
+            pickle.dump(state, f)
+
+    def _load(self):
+        if not self.data_file or not os.path.exists(self.data_file):
+            return
+        with open(self.data_file, 'rb') as f:
+            state = pickle.load(f)
+        for name, (durable, arguments, messages) in state['queues'].items():
+            queue = FakeQueue(name, durable=durable, arguments=arguments)
+            # 重启后的消息都视为已投递过
+            queue.messages.extend(StoredMessage(*message, redelivered=True) for message in messages)
+            for message in queue.messages:
+                self._stamp_expiry(queue, message)
+            self.queues[name] = queue
+        for name, (exchange_type, bindings) in state['exchanges'].items():
+            exchange = FakeExchange(name, exchange_type, durable=True)
+            exchange.bindings.update(bindings)
+            self.exchanges[name] = exchange
+
+    def set_blocked(self, reason='low on memory'):
+        """模拟内存告警：向所有连接发送 connection.blocked，reason=None 时解除。"""
+        self.blocked_reason = reason
+        for connection in self.connections:
+            if reason is None:
+                connection.send(commands.Connection.Unblocked())
+            else:
+                connection.send(commands.Connection.Blocked(reason=reason))
+
+    def queue_stats(self):
+        return [
+            {
+                'name': queue.name,
+                'durable': queue.durable,
+                'messages': len(queue.messages) + queue.unacked,
+                'messages_ready': len(queue.messages),
+                'messages_unacknowledged': queue.unacked,
+                'consumers': len(queue.consumers),
+            }
+            for queue in self.queues.values()
+        ]
+
+    def delete_queue(self, name):
+        queue = self.queues.pop(name, None)
+        if queue:
+            for exchange in self.exchanges.values():
+                exchange.bindings = {b for b in exchange.bindings if b[0] != name}
+        return queue
+
+    # ---- 管理 API ----
+
+    async def set_management_enabled(self, enabled):
+        if enabled and self._management_server is None and self.management_port is not None:
+            self._management_server = await asyncio.start_server(
+                self._handle_management, self.host, self.management_port
+            )
+        elif not enabled and self._management_server is not None:
+            self._management_server.close()
+            await self._management_server.wait_closed()
+            self._management_server = None
+
+    async def _handle_management(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode(errors='replace').split()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            path = request_line[1].split('?')[0] if len(request_line) > 1 else ''
+            status, payload = '404 Not Found', {'error': 'Object Not Found'}
+            if path == '/api/overview':
+                status, payload = '200 OK', {'product_name': 'FakeBroker', 'product_version': '0.1'}
+            elif path == '/api/queues' or path == '/api/queues/%2F':
+                status, payload = '200 OK', self.queue_stats()
+            elif path.startswith('/api/queues/%2F/'):
+                name = path[len('/api/queues/%2F/'):]
+                stats = [item for item in self.queue_stats() if item['name'] == name]
+                if stats:
+                    status, payload = '200 OK', stats[0]
+            body = json.dumps(payload).encode()
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"管理 API 请求处理失败: {e}")
+        finally:
+            writer.close()
+
+    # ---- 连接处理 ----
+
+    async def _handle_connection(self, reader, writer):
+        connection = FakeConnection(self, reader, writer)
+        try:
+            await connection.handshake()
+            self.connections.add(connection)
+            while not connection.closed:
+                channel_number, frame = await connection.read_frame()
+                if isinstance(frame, Heartbeat):
+                    continue
+                if channel_number == 0:
+                    if isinstance(frame, commands.Connection.Close):
+                        connection.send(commands.Connection.CloseOk())
+                        await writer.drain()
+                        break
+                    continue
+                self._handle_channel_frame(connection, channel_number, frame)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.info(f"FakeBroker 连接处理异常: {e}")
+        finally:
+            self.connections.discard(connection)
+            connection.close()
+
+    def _handle_channel_frame(self, connection, number, frame):
+        if isinstance(frame, commands.Channel.Open):
+            connection.channels[number] = FakeChannel(connection, number)
+            connection.send(commands.Channel.OpenOk(), number)
+            return
+        channel = connection.channels.get(number)
+        if channel is None:
+            return
+        if channel.closing:
+            # 已发出 Channel.Close，只等待 CloseOk
+            if isinstance(frame, (commands.Channel.CloseOk, commands.Channel.Close)):
+                connection.channels.pop(number, None)
+                if isinstance(frame, commands.Channel.Close):
+                    connection.send(commands.Channel.CloseOk(), number)
+            return
+        try:
+            if isinstance(frame, (ContentHeader, ContentBody)):
+                self._on_content(channel, frame)
+            else:
+                handler = getattr(self, '_on_' + frame.name.replace('.', '_'), None)
+                if handler is None:
+                    raise ChannelError(540, f"NOT_IMPLEMENTED - {frame.name}", frame)
+                handler(channel, frame)
+        except ChannelError as e:
+            self.close_channel(channel)
+            channel.closing = True
+            connection.channels[number] = channel
+            method = e.method or frame
+            class_id, method_id = (method.index >> 16, method.index & 0xFFFF) if hasattr(method, 'index') else (0, 0)
+            connection.send(commands.Channel.Close(
+                reply_code=e.reply_code, reply_text=e.reply_text, class_id=class_id, method_id=method_id
+            ), number)
+
+    def close_channel(self, channel):
+        # 通道关闭时取消其消费者，未确认消息重新入队并标记 redelivered
+        for consumer_tag, queue in list(channel.consumers.items()):
+            self._remove_consumer(queue, channel, consumer_tag)
+        self._requeue(channel, sorted(channel.unacked))
+        channel.consumers.clear()
+        if channel.reply_consumer:
+            self._reply_channels.pop(channel.reply_consumer[1], None)
+            channel.reply_consumer = None
+
+    # ---- Channel ----
+
+    def _on_Channel_Close(self, channel, frame):
+        self.close_channel(channel)
+        channel.connection.channels.pop(channel.number, None)
+        channel.connection.send(commands.Channel.CloseOk(), channel.number)
+
+    def _on_Channel_Flow(self, channel, frame):
+        channel.connection.send(commands.Channel.FlowOk(active=frame.active), channel.number)
+
+    def _on_Confirm_Select(self, channel, frame):
+        channel.confirm = True
+        if not frame.nowait:
+            channel.connection.send(commands.Confirm.SelectOk(), channel.number)
+
+    def _on_Basic_Qos(self, channel, frame):
+        channel.prefetch_count = frame.prefetch_count
+        channel.connection.send(commands.Basic.QosOk(), channel.number)
+        self._dispatch_all()
+
+    # ---- Exchange / Queue ----
+
+    def _on_Exchange_Declare(self, channel, frame):
+        exchange = self.exchanges.get(frame.exchange)
+        if frame.passive:
+            if exchange is None:
+                raise ChannelError(404, f"NOT_FOUND - no exchange '{frame.exchange}'")
+        elif exchange is None:
+            if frame.exchange_type not in ('direct', 'fanout', 'topic'):
+                raise ChannelError(540, f"NOT_IMPLEMENTED - exchange type '{frame.exchange_type}'")
+            self.exchanges[frame.exchange] = FakeExchange(frame.exchange, frame.exchange_type, frame.durable)
+        elif exchange.type != frame.exchange_type:
+            raise ChannelError(406, f"PRECONDITION_FAILED - inequivalent arg 'type' for exchange '{frame.exchange}'")
+        if not frame.nowait:
+            channel.connection.send(commands.Exchange.DeclareOk(), channel.number)
+
+    def _on_Exchange_Delete(self, channel, frame):
+        self.exchanges.pop(frame.exchange, None)
+        if not frame.nowait:
+            channel.connection.send(commands.Exchange.DeleteOk(), channel.number)
+
+    def _on_Queue_Declare(self, channel, frame):
+        name = frame.queue or f"amq.gen-{next(self._queue_names)}"
+        queue = self.queues.get(name)
+        if queue and queue.exclusive_owner not in (None, channel.connection):
+            raise ChannelError(405, f"RESOURCE_LOCKED - queue '{name}' is exclusive")
+        if frame.passive:
+            if queue is None:
+                raise ChannelError(404, f"NOT_FOUND - no queue '{name}'")
+        elif queue is None:
+            queue = FakeQueue(
+                name,
+                durable=frame.durable,
+                exclusive_owner=channel.connection if frame.exclusive else None,
+                auto_delete=frame.auto_delete,
+                arguments=frame.arguments
+            )
+            self.queues[name] = queue
+        elif queue.durable != frame.durable:
+            raise ChannelError(406, f"PRECONDITION_FAILED - inequivalent arg 'durable' for queue '{name}'")
+        if not frame.nowait:
+            channel.connection.send(commands.Queue.DeclareOk(
+                queue=name, message_count=len(queue.messages), consumer_count=len(queue.consumers)
+            ), channel.number)
+
+    def _on_Queue_Bind(self, channel, frame):
+        exchange = self.exchanges.get(frame.exchange)
+        if exchange is None:
+            raise ChannelError(404, f"NOT_FOUND - no exchange '{frame.exchange}'")
+        if frame.queue not in self.queues:
+            raise ChannelError(404, f"NOT_FOUND - no queue '{frame.queue}'")
+        exchange.bindings.add((frame.queue, frame.routing_key))
+        if not frame.nowait:
+            channel.connection.send(commands.Queue.BindOk(), channel.number)
+
+    def _on_Queue_Unbind(self, channel, frame):
+        exchange = self.exchanges.get(frame.exchange)
+        if exchange:
+            exchange.bindings.discard((frame.queue, frame.routing_key))
+        channel.connection.send(commands.Queue.UnbindOk(), channel.number)
+
+    def _on_Queue_Purge(self, channel, frame):
+        queue = self._get_queue(frame.queue)
+        count = len(queue.messages)
+        queue.messages.clear()
+        if not frame.nowait:
+            channel.connection.send(commands.Queue.PurgeOk(message_count=count), channel.number)
+
+    def _on_Queue_Delete(self, channel, frame):
+        queue = self.delete_queue(frame.queue)
+        if not frame.nowait:
+            channel.connection.send(
+                commands.Queue.DeleteOk(message_count=len(queue.messages) if queue else 0), channel.number
+            )
+
+    def _get_queue(self, name):
+        queue = self.queues.get(name)
+        if queue is None:
+            raise ChannelError(404, f"NOT_FOUND - no queue '{name}'")
+        return queue
+
+    def drop_exclusive_queues(self, connection):
+        for name in [name for name, queue in self.queues.items() if queue.exclusive_owner is connection]:
+            self.delete_queue(name)
+
+    # ---- 发布 ----
+
+    def _on_Basic_Publish(self, channel, frame):
+        channel.pending_publish = [frame, None, []]
+
+    def _on_content(self, channel, frame):
+        if channel.pending_publish is None:
+            raise ChannelError(505, "UNEXPECTED_FRAME - content without basic.publish")
+        pending = channel.pending_publish
+        if isinstance(frame, ContentHeader):
+            pending[1] = frame
+        else:
+            pending[2].append(frame.value)
+        header = pending[1]
+        if header is not None and sum(len(part) for part in pending[2]) >= header.body_size:
+            channel.pending_publish = None
+            publish = pending[0]
+            message = StoredMessage(b''.join(pending[2]), header.properties, publish.exchange, publish.routing_key)
+            self._publish(channel, publish, message)
+
+    def route(self, exchange_name, routing_key):
+        exchange = self.exchanges.get(exchange_name)
+        if exchange is None:
+            return None
+        if exchange_name == '':
+            return [routing_key] if routing_key in self.queues else []
+        if exchange.type == 'fanout':
+            names = {queue for queue, _ in exchange.bindings}
+        elif exchange.type == 'topic':
+            names = {queue for queue, key in exchange.bindings if topic_matches(key, routing_key)}
+        else:
+            names = {queue for queue, key in exchange.bindings if key == routing_key}
+        return [name for name in names if name in self.queues]
+
+    def _publish(self, channel, publish, message):
+        if message.properties is not None and message.properties.reply_to == DIRECT_REPLY_TO:
+            if channel.reply_consumer is None:
+                raise ChannelError(406, "PRECONDITION_FAILED - fast reply consumer does not exist", publish)
+            message.properties = copy.copy(message.properties)
+            message.properties.reply_to = channel.reply_consumer[1]
+        if publish.exchange == '' and publish.routing_key.startswith(DIRECT_REPLY_TO + '.'):
+            self._reply(channel, publish, message)
+            return
+        queue_names = self.route(publish.exchange, publish.routing_key)
+        if queue_names is None:
+            raise ChannelError(404, f"NOT_FOUND - no exchange '{publish.exchange}'", publish)
+        if not queue_names and publish.mandatory:
+            channel.connection.send_content(channel.number, commands.Basic.Return(
+                reply_code=312, reply_text='NO_ROUTE', exchange=publish.exchange, routing_key=publish.routing_key
+            ), message)
+        for name in queue_names:
+            self.enqueue(self.queues[name], StoredMessage(
+                message.body, message.properties, message.exchange, message.routing_key
+            ))
+        if channel.confirm:
+            channel.publish_seq += 1
+            channel.connection.send(commands.Basic.Ack(delivery_tag=channel.publish_seq), channel.number)
+
+    def _reply(self, channel, publish, message):
+        # 回复不经过队列，直接投递给发起请求的通道；请求方已断开时丢弃
+        target = self._reply_channels.get(publish.routing_key)
+        if target is not None and not target.closing and not target.connection.closed:
+            target.connection.send_content(target.number, commands.Basic.Deliver(
+                consumer_tag=target.reply_consumer[0], delivery_tag=next(target.delivery_tags),
+                redelivered=False, exchange='', routing_key=publish.routing_key
+            ), message)
+        elif publish.mandatory:
+            channel.connection.send_content(channel.number, commands.Basic.Return(
+                reply_code=312, reply_text='NO_ROUTE', exchange='', routing_key=publish.routing_key
+            ), message)
+        if channel.confirm:
+            channel.publish_seq += 1
+            channel.connection.send(commands.Basic.Ack(delivery_tag=channel.publish_seq), channel.number)
+
+    def enqueue(self, queue, message, front=False):
+        if message.expires_at is None:
+            self._stamp_expiry(queue, message)
+        if front:
+            queue.messages.appendleft(message)
+        else:
+            queue.messages.append(message)
+        self._dispatch(queue)
+
+    # ---- TTL 与死信 ----
+
+    def _stamp_expiry(self, queue, message):
+        ttls = []
+        if queue.arguments.get('x-message-ttl') is not None:
+            ttls.append(int(queue.arguments['x-message-ttl']))
+        if message.properties is not None and message.properties.expiration:
+            ttls.append(int(message.properties.expiration))
+        if ttls:
+            message.expires_at = time.time() + min(ttls) / 1000
+
+    def _expire(self, queue):
+        # 与 RabbitMQ 一致，只有到达队首的消息才会过期
+        now = time.time()
+        while queue.messages and queue.messages[0].expires_at is not None and queue.messages[0].expires_at <= now:
+            self._dead_letter(queue, queue.messages.popleft(), 'expired')
+
+    async def _expiry_loop(self):
+        while True:
+            await asyncio.sleep(0.05)
+            for queue in list(self.queues.values()):
+                if queue.messages and queue.messages[0].expires_at is not None:
+                    # _dispatch 会先处理过期消息
+                    self._dispatch(queue)
+
+    def _dead_letter(self, queue, message, reason):
+        exchange = queue.arguments.get('x-dead-letter-exchange')
+        if exchange is None:
+            return
+        routing_key = queue.arguments.get('x-dead-letter-routing-key') or message.routing_key
+        properties = copy.copy(message.properties) if message.properties else commands.Basic.Properties()
+        headers = dict(properties.headers or {})
+        deaths = [dict(death) for death in headers.get('x-death') or []]
+        for death in deaths:
+            if death.get('queue') == queue.name and death.get('reason') == reason:
+                death['count'] = death.get('count', 0) + 1
+                break
+        else:
+            deaths.insert(0, {
+                'count': 1, 'reason': reason, 'queue': queue.name,
+                'exchange': message.exchange, 'routing-keys': [message.routing_key],
+            })
+        headers['x-death'] = deaths
+        properties.headers = headers
+        # 死信转发时去掉消息级 TTL，避免在目标队列中立即再次过期
+        properties.expiration = None
+        for name in self.route(exchange, routing_key) or []:
+            self.enqueue(self.queues[name], StoredMessage(message.body, properties, exchange, routing_key))
+
+    # ---- 消费 ----
+
+    def _on_Basic_Consume(self, channel, frame):
+        if frame.queue == DIRECT_REPLY_TO:
+            self._consume_replies(channel, frame)
+            return
+        queue = self._get_queue(frame.queue)
+        if queue.exclusive_owner not in (None, channel.connection):
+            raise ChannelError(405, f"RESOURCE_LOCKED - queue '{queue.name}' is exclusive")
+        consumer_tag = frame.consumer_tag or f"amq.ctag-{next(self._consumer_tags)}"
+        channel.consumers[consumer_tag] = queue
+        queue.consumers.append((channel, consumer_tag, frame.no_ack))
+        if not frame.nowait:
+            channel.connection.send(commands.Basic.ConsumeOk(consumer_tag=consumer_tag), channel.number)
+        self._dispatch(queue)
+
+    def _consume_replies(self, channel, frame):
+        if not frame.no_ack:
+            raise ChannelError(406, "PRECONDITION_FAILED - reply consumer cannot acknowledge", frame)
+        if channel.reply_consumer is not None:
+            raise ChannelError(406, "PRECONDITION_FAILED - reply consumer already set", frame)
+        consumer_tag = frame.consumer_tag or f"amq.ctag-{next(self._consumer_tags)}"
+        address = f"{DIRECT_REPLY_TO}.{next(self._reply_ids)}"
+        channel.reply_consumer = (consumer_tag, address)
+        self._reply_channels[address] = channel
+        if not frame.nowait:
+            channel.connection.send(commands.Basic.ConsumeOk(consumer_tag=consumer_tag), channel.number)
+
+    def _on_Basic_Cancel(self, channel, frame):
+        if channel.reply_consumer and channel.reply_consumer[0] == frame.consumer_tag:
+            self._reply_channels.pop(channel.reply_consumer[1], None)
+            channel.reply_consumer = None
+        queue = channel.consumers.pop(frame.consumer_tag, None)
+        if queue:
+            self._remove_consumer(queue, channel, frame.consumer_tag)
+        if not frame.nowait:
+            channel.connection.send(commands.Basic.CancelOk(consumer_tag=frame.consumer_tag), channel.number)
+
+    def _remove_consumer(self, queue, channel, consumer_tag):
+        queue.consumers = [c for c in queue.consumers if not (c[0] is channel and c[1] == consumer_tag)]
+        if queue.auto_delete and not queue.consumers and self.queues.get(queue.name) is queue:
+            self.delete_queue(queue.name)
+
+    def _on_Basic_Get(self, channel, frame):
+        queue = self._get_queue(frame.queue)
+        if not queue.messages:
+            channel.connection.send(commands.Basic.GetEmpty(), channel.number)
+            return
+        message = queue.messages.popleft()
+        delivery_tag = next(channel.delivery_tags)
+        if not frame.no_ack:
+            channel.unacked[delivery_tag] = (queue, message)
+            queue.unacked += 1
+        channel.connection.send_content(channel.number, commands.Basic.GetOk(
+            delivery_tag=delivery_tag, redelivered=message.redelivered, exchange=message.exchange,
+            routing_key=message.routing_key, message_count=len(queue.messages)
+        ), message)
+
+    def _dispatch(self, queue):
+        self._expire(queue)
+        while queue.messages and queue.consumers:
+            for _ in range(len(queue.consumers)):
+                index = queue._next_consumer % len(queue.consumers)
+                queue._next_consumer += 1
+                channel, consumer_tag, no_ack = queue.consumers[index]
+                if no_ack or channel.has_capacity():
+                    break
+            else:
+                return
+            message = queue.messages.popleft()
+            delivery_tag = next(channel.delivery_tags)
+            if not no_ack:
+                channel.unacked[delivery_tag] = (queue, message)
+                queue.unacked += 1
+            channel.connection.send_content(channel.number, commands.Basic.Deliver(
+                consumer_tag=consumer_tag, delivery_tag=delivery_tag, redelivered=message.redelivered,
+                exchange=message.exchange, routing_key=message.routing_key
+            ), message)
+
+    def _dispatch_all(self):
+        for queue in list(self.queues.values()):
+            self._dispatch(queue)
+
+    def _settled_tags(self, channel, delivery_tag, multiple):
+        if delivery_tag == 0 and multiple:
+            return sorted(channel.unacked)
+        if multiple:
+            return sorted(tag for tag in channel.unacked if tag <= delivery_tag)
+        if delivery_tag not in channel.unacked:
+            raise ChannelError(406, f"PRECONDITION_FAILED - unknown delivery tag {delivery_tag}")
+        return [delivery_tag]
+
+    def _settle(self, channel, tags):
+        for tag in tags:
+            queue, _ = channel.unacked.pop(tag)
+            queue.unacked -= 1
+
+    def _requeue(self, channel, tags):
+        # 按投递顺序逆序放回队首，保持原有顺序
+        for tag in reversed(tags):
+            queue, message = channel.unacked.pop(tag)
+            queue.unacked -= 1
+            message.redelivered = True
+            if self.queues.get(queue.name) is queue:
+                queue.messages.appendleft(message)
+        self._dispatch_all()
+
+    def _on_Basic_Ack(self, channel, frame):
+        self._settle(channel, self._settled_tags(channel, frame.delivery_tag, frame.multiple))
+        self._dispatch_all()
+
+    def _reject(self, channel, tags):
+        # requeue=False 的拒绝：有死信交换机时转发，否则丢弃
+        for tag in tags:
+            queue, message = channel.unacked.pop(tag)
+            queue.unacked -= 1
+            self._dead_letter(queue, message, 'rejected')
+        self._dispatch_all()
+
+    def _on_Basic_Nack(self, channel, frame):
+        tags = self._settled_tags(channel, frame.delivery_tag, frame.multiple)
+        if frame.requeue:
+            self._requeue(channel, tags)
+        else:
+            self._reject(channel, tags)
+
+    def _on_Basic_Reject(self, channel, frame):
+        tags = self._settled_tags(channel, frame.delivery_tag, False)
+        if frame.requeue:
+            self._requeue(channel, tags)
+        else:
+            self._reject(channel, tags)
+
+    def _on_Basic_Recover(self, channel, frame):
+        self._requeue(channel, sorted(channel.unacked))
+        channel.connection.send(commands.Basic.RecoverOk(), channel.number)
+
+
+class FakeBrokerThread:
+    """
+    在后台线程的事件循环中运行 FakeBroker，供同步代码（如 test.py）控制。
+
+    call() 在 broker 线程中执行协程并等待结果；broker 的状态只应在该线程中访问。
+    """
+
+    def __init__(self, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='fake-broker', daemon=True)
+        self._kwargs = kwargs
+        self.broker = None
+
+    def start(self):
+        if not self._thread.is_alive():
+            self._thread.start()
+        if self.broker is None:
+            self.broker = self.call(self._create())
+        self.call(self.broker.start())
+        return self
+
+    async def _create(self):
+        return FakeBroker(**self._kwargs)
+
+    def call(self, coro, timeout=30):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def run(self, func, *args):
+        async def _run():
+            return func(*args)
+        return self.call(_run())
+
+    def shutdown(self):
+        if self.broker is not None and self.broker.running:
+            self.call(self.broker.stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="运行进程内 FakeBroker（最小 AMQP 0-9-1 实现）")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5673)
+    parser.add_argument('--management-port', type=int, default=None)
+    parser.add_argument('--data-file', default=None, help="持久化队列与消息的存储文件")
+    cmd_args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    async def _run():
+        broker = FakeBroker(cmd_args.host, cmd_args.port, cmd_args.management_port, cmd_args.data_file)
+        await broker.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await broker.stop()
+
+    try:
+        asyncio.run(_run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
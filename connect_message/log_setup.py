@@ -0,0 +1,142 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# 自定义日志处理器，过滤 aiormq ERROR
+class RabbitMQLogFilter(logging.Filter):
+    def filter(self, record):
+        if record.name.startswith('aiormq') and record.levelno == logging.ERROR:
+            return False
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    # 队列满时丢弃记录并计数，不阻塞事件循环
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+_queue_handler = None
+_lock = threading.Lock()
+
+def log_file():
+    """日志文件路径：LOG_FILE，默认 rabbitmq.log。"""
+    return os.environ.get('LOG_FILE') or 'rabbitmq.log'
+
+def rotation_enabled():
+    """是否通过 LOG_MAX_BYTES 开启了按大小滚动。"""
+    return int(os.environ.get('LOG_MAX_BYTES') or 0) > 0
+
+def setup_logging(path=None, level=None, max_bytes=None, backup_count=None, queue_size=10000, console=True):
+    """
+    配置异步日志：根 logger 只把记录放入内存队列，由后台线程格式化并写入控制台和 path。
+
+    参数未指定时读取环境变量 LOG_FILE（默认 rabbitmq.log）、LOG_LEVEL（默认 INFO）、
+    LOG_MAX_BYTES（默认 0）、LOG_BACKUP_COUNT（默认 5）。重复调用不会重复配置。
+    默认以追加方式写入，多个进程可以共用同一个文件；max_bytes 大于 0 时按大小滚动，
+    只能用于单个进程写的文件，否则各进程会把文件从彼此手里滚走。
+    队列超过 queue_size 条时丢弃新记录，退出时刷新剩余记录。
+    """
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is not None:
+            return _listener
+        path = path or log_file()
+        level = level or os.environ.get('LOG_LEVEL') or 'INFO'
+        max_bytes = max_bytes if max_bytes is not None else int(os.environ.get('LOG_MAX_BYTES') or 0)
+        backup_count = backup_count if backup_count is not None else int(os.environ.get('LOG_BACKUP_COUNT') or 5)
+
+        formatter = logging.Formatter(LOG_FORMAT)
+        if max_bytes > 0:
+            file_handler = RotatingFileHandler(path, mode='a', maxBytes=max_bytes, backupCount=backup_count)
+        else:
+            file_handler = logging.FileHandler(path, mode='a')
+        handlers = [file_handler]
+        if console:
+            handlers.append(logging.StreamHandler())
+        for handler in handlers:
+            handler.setFormatter(formatter)
+            handler.addFilter(RabbitMQLogFilter())
+
+        log_queue = queue.Queue(maxsize=queue_size)
+        _queue_handler = _NonBlockingQueueHandler(log_queue)
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(_queue_handler)
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+        logging.getLogger('aio_pika').setLevel(logging.WARNING)
+        logging.getLogger('aiormq').setLevel(logging.WARNING)
+        return _listener
+
+def shutdown_logging():
+    """停止后台写入线程，写完队列中剩余的记录。"""
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is None:
+            return
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        if _queue_handler.dropped:
+            logging.getLogger(__name__).warning(f"日志队列已满，丢弃了 {_queue_handler.dropped} 条记录")
+        _listener = None
+        _queue_handler = None
+
+
+class LogSampler:
+    """
+    逐条消息日志的采样与限流：每 every 条记录一条，且每秒最多 max_per_second 条（令牌桶）。
+
+    被跳过的条数会在下一条放行的日志中带出（suppressed），便于判断实际流量。
+    """
+
+    def __init__(self, every=1, max_per_second=None):
+        self.every = max(int(every), 1)
+        self.max_per_second = max_per_second
+        self.suppressed = 0
+        self._count = 0
+        self._tokens = max_per_second or 0
+        self._last_refill = time.monotonic()
+
+    @classmethod
+    def from_env(cls):
+        """按环境变量 LOG_SAMPLE_EVERY（默认 1）、LOG_MAX_PER_SECOND（默认 100）创建。"""
+        max_per_second = os.environ.get('LOG_MAX_PER_SECOND')
+        return cls(every=int(os.environ.get('LOG_SAMPLE_EVERY') or 1),
+                   max_per_second=float(max_per_second) if max_per_second else 100)
+
+    def allow(self):
+        self._count += 1
+        allowed = self._count % self.every == 0
+        if allowed and self.max_per_second:
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._last_refill) * self.max_per_second, self.max_per_second)
+            self._last_refill = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+            else:
+                allowed = False
+        if not allowed:
+            self.suppressed += 1
+        return allowed
+
+    def take_suppressed(self):
+        suppressed, self.suppressed = self.suppressed, 0
+        return suppressed
@@ -0,0 +1,232 @@
+import asyncio
+import bisect
+import logging
+import threading
+
+# 日志由 rabbitmq_client 统一配置
+logger = logging.getLogger(__name__)
+
+# 默认延迟分桶（秒），覆盖亚毫秒到 10 秒
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text=''):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help_text=''):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text='', buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        # 最后一个桶对应 +Inf
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """按分桶线性插值估算分位数，没有样本时返回 None。"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+def aggregate_dumps(states):
+    """
+    合并多个 dump() 结果：计数器和直方图累加，仪表取最大值（各进程观察的是同一个队列）。
+    """
+    merged = {}
+    for state in states:
+        for name, entry in state.items():
+            current = merged.get(name)
+            if current is None:
+                merged[name] = dict(entry, bucket_counts=list(entry['bucket_counts'])) \
+                    if entry['kind'] == 'histogram' else dict(entry)
+            elif current['kind'] != entry['kind']:
+                raise ValueError(f"指标 {name} 类型不一致: {current['kind']} / {entry['kind']}")
+            elif entry['kind'] == 'counter':
+                current['value'] += entry['value']
+            elif entry['kind'] == 'gauge':
+                current['value'] = max(current['value'], entry['value'])
+            else:
+                if tuple(current['buckets']) != tuple(entry['buckets']):
+                    raise ValueError(f"指标 {name} 分桶不一致")
+                current['bucket_counts'] = [a + b for a, b in zip(current['bucket_counts'], entry['bucket_counts'])]
+                current['count'] += entry['count']
+                current['sum'] += entry['sum']
+    return merged
+
+
+class MetricsRegistry:
+    """
+    进程内指标注册表：计数器、仪表和延迟直方图。
+
+    通过 snapshot() 读取当前值，或 start_http_server() 以 Prometheus 文本格式暴露 /metrics。
+    labels 为附加到所有指标上的固定标签（如队列名）。
+    """
+
+    def __init__(self, labels=None):
+        self.labels = labels or {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _get_or_create(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, help_text, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为 {metric.kind}")
+            return metric
+
+    def counter(self, name, help_text=''):
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name, help_text=''):
+        return self._get_or_create(Gauge, name, help_text)
+
+    def histogram(self, name, help_text='', buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, buckets=buckets)
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def dump(self):
+        """导出原始指标数据（可 pickle），用于跨进程汇总。"""
+        state = {}
+        for name, metric in self._metrics.items():
+            entry = {'kind': metric.kind, 'help': metric.help_text}
+            if isinstance(metric, Histogram):
+                entry.update(buckets=metric.buckets, bucket_counts=list(metric.bucket_counts),
+                             count=metric.count, sum=metric.sum)
+            else:
+                entry['value'] = metric.value
+            state[name] = entry
+        return state
+
+    def load(self, state):
+        """用 dump() 格式的数据替换当前全部指标（已启动的 HTTP 接口随之更新）。"""
+        metrics = {}
+        for name, entry in state.items():
+            if entry['kind'] == 'histogram':
+                metric = Histogram(name, entry['help'], buckets=entry['buckets'])
+                metric.bucket_counts = list(entry['bucket_counts'])
+                metric.count = entry['count']
+                metric.sum = entry['sum']
+            else:
+                metric = (Counter if entry['kind'] == 'counter' else Gauge)(name, entry['help'])
+                metric.value = entry['value']
+            metrics[name] = metric
+        with self._lock:
+            self._metrics = metrics
+
+    def _format_labels(self, extra=None):
+        labels = dict(self.labels, **(extra or {}))
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+    def render_prometheus(self):
+        lines = []
+        for name, metric in self._metrics.items():
+            if metric.help_text:
+                lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            if isinstance(metric, Histogram):
+                cumulative = 0
+                bounds = [str(bound) for bound in metric.buckets] + ['+Inf']
+                for bound, bucket_count in zip(bounds, metric.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{self._format_labels({'le': bound})} {cumulative}")
+                lines.append(f"{name}_sum{self._format_labels()} {metric.sum}")
+                lines.append(f"{name}_count{self._format_labels()} {metric.count}")
+            else:
+                lines.append(f"{name}{self._format_labels()} {metric.value}")
+        return '\n'.join(lines) + '\n'
+
+    async def _handle_http(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # 丢弃请求头
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode(errors='replace').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.render_prometheus().encode()
+            else:
+                status, body = '404 Not Found', b'not found\n'
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"指标请求处理失败: {e}")
+        finally:
+            writer.close()
+
+    async def start_http_server(self, host='0.0.0.0', port=9100):
+        self._server = await asyncio.start_server(self._handle_http, host, port)
+        logger.info(f"指标接口已启动: http://{host}:{port}/metrics")
+        return self._server
+
+    async def stop_http_server(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
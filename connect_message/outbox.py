@@ -0,0 +1,234 @@
+import base64
+import datetime
+import decimal
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+import aio_pika
+
+# 日志由 rabbitmq_client 统一配置
+logger = logging.getLogger(__name__)
+
+# 记录头：crc32(meta + body)、meta 长度、body 长度
+RECORD_HEADER = struct.Struct('>III')
+SEGMENT_SUFFIX = '.seg'
+CURSOR_FILE = 'cursor'
+# 随消息保存的 AMQP 属性
+MESSAGE_PROPERTIES = (
+    'content_type', 'content_encoding', 'headers', 'delivery_mode', 'priority',
+    'correlation_id', 'reply_to', 'expiration', 'message_id', 'type', 'app_id',
+)
+
+OutboxRecord = namedtuple('OutboxRecord', ['routing_key', 'message', 'segment', 'end'])
+
+
+# 记录元数据用 JSON 保存：读取被篡改或写坏的段不会像 pickle 那样执行任意代码。
+# AMQP 头中 JSON 无法表示的值写成单键对象 {"$bytes": base64}、{"$datetime": iso}、{"$decimal": str}
+def _encode_value(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'$bytes': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, datetime.datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, decimal.Decimal):
+        return {'$decimal': str(value)}
+    raise TypeError(f"outbox 无法保存类型为 {type(value).__name__} 的消息属性")
+
+
+_DECODERS = {
+    '$bytes': base64.b64decode,
+    '$datetime': datetime.datetime.fromisoformat,
+    '$decimal': decimal.Decimal,
+}
+
+
+def _decode_object(obj):
+    if len(obj) == 1:
+        key, value = next(iter(obj.items()))
+        if key in _DECODERS:
+            return _DECODERS[key](value)
+    return obj
+
+
+def _dump_meta(meta):
+    return json.dumps(meta, default=_encode_value, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def _load_meta(data):
+    return json.loads(bytes(data), object_hook=_decode_object)
+
+
+class Outbox:
+    """
+    本地 outbox：broker 不可用或背压生效时，待发布的消息追加写入磁盘日志，稍后按顺序补发。
+
+    日志按段存放在 directory 中（{段号}.seg，单段超过 segment_bytes 后滚动），每条记录带 crc32，
+    打开时截掉崩溃留下的半条记录。已确认的位置记在 cursor 文件中，整段都已确认的段文件直接删除。
+    fsync: 'always' 每条记录落盘，'interval' 最多每 fsync_interval 秒落盘一次，'never' 交给操作系统。
+    补发是至少一次语义：确认位置落盘前进程退出，重启后会重复发送少量消息。
+    各方法内部加锁，可以在工作线程中调用（客户端通过 asyncio.to_thread 调用，写盘和 fsync 不阻塞事件循环）。
+    """
+
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, fsync='interval', fsync_interval=1.0):
+        if fsync not in ('always', 'interval', 'never'):
+            raise ValueError(f"未知的 fsync 策略: {fsync}")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.pending = 0
+        self._file = None
+        self._dirty = False
+        self._last_sync = time.monotonic()
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"{segment:020d}{SEGMENT_SUFFIX}")
+
+    def _segments(self):
+        return sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _recover(self):
+        segments = self._segments()
+        self._cursor = self._load_cursor() or (segments[0] if segments else 1, 0)
+        if not segments:
+            segments = [self._cursor[0]]
+            open(self._segment_path(segments[0]), 'ab').close()
+        self._active = segments[-1]
+        # 只有最后一段可能有写了一半的记录
+        valid_end = self._scan(self._active, 0, None)[1]
+        if valid_end < os.path.getsize(self._segment_path(self._active)):
+            logger.info(f"outbox 段 {self._active} 末尾有不完整记录，截断到 {valid_end} 字节")
+            os.truncate(self._segment_path(self._active), valid_end)
+        for segment in segments:
+            if segment < self._cursor[0]:
+                os.remove(self._segment_path(segment))
+            else:
+                start = self._cursor[1] if segment == self._cursor[0] else 0
+                self.pending += len(self._scan(segment, start, None)[0])
+        if self.pending:
+            logger.info(f"outbox 中有 {self.pending} 条消息待补发")
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as f:
+                segment, offset = f.read().split()
+                return int(segment), int(offset)
+        except FileNotFoundError:
+            return None
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(path + '.tmp', 'w') as f:
+            f.write(f"{self._cursor[0]} {self._cursor[1]}")
+            if self.fsync != 'never':
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def _scan(self, segment, offset, limit):
+        """从 offset 起解析段内记录，返回 (记录列表, 最后一条完整记录的结束位置)。"""
+        records = []
+        path = self._segment_path(segment)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size <= offset:
+            return records, offset
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            while offset + RECORD_HEADER.size <= size and (limit is None or len(records) < limit):
+                crc, meta_len, body_len = RECORD_HEADER.unpack_from(view, offset)
+                start = offset + RECORD_HEADER.size
+                end = start + meta_len + body_len
+                if end > size or zlib.crc32(view[start:end]) != crc:
+                    break
+                meta = _load_meta(view[start:start + meta_len])
+                message = aio_pika.Message(body=view[start + meta_len:end], **meta['properties'])
+                records.append(OutboxRecord(meta['routing_key'], message, segment, end))
+                offset = end
+        return records, offset
+
+    def append(self, routing_key, message):
+        meta = _dump_meta({
+            'routing_key': routing_key,
+            'properties': {name: getattr(message, name) for name in MESSAGE_PROPERTIES},
+        })
+        payload = meta + message.body
+        with self._lock:
+            if self._file is None:
+                # 无缓冲写入：每条记录一次 write，读取端通过 mmap 立即可见
+                self._file = open(self._segment_path(self._active), 'ab', buffering=0)
+            elif self._file.tell() >= self.segment_bytes:
+                self._roll()
+            self._file.write(RECORD_HEADER.pack(zlib.crc32(payload), len(meta), len(message.body)) + payload)
+            self.pending += 1
+            self._dirty = True
+            if self.fsync == 'always':
+                self.sync()
+            else:
+                self.maybe_sync()
+
+    def _roll(self):
+        self.sync()
+        self._file.close()
+        self._active += 1
+        self._file = open(self._segment_path(self._active), 'ab', buffering=0)
+        logger.debug(f"outbox 滚动到新段 {self._active}")
+
+    def read_batch(self, max_records):
+        """从已确认位置起按顺序读取最多 max_records 条记录；commit 之前重复调用返回相同记录。"""
+        records = []
+        with self._lock:
+            segment, offset = self._cursor
+            while len(records) < max_records and segment <= self._active:
+                batch, _ = self._scan(segment, offset, max_records - len(records))
+                records.extend(batch)
+                segment, offset = segment + 1, 0
+        return records
+
+    def commit(self, records):
+        """标记 records（read_batch 返回的前缀）已被 broker 确认，并删除已全部确认的段。"""
+        if not records:
+            return
+        last = records[-1]
+        with self._lock:
+            self._cursor = (last.segment, last.end)
+            self.pending -= len(records)
+            if not self.pending:
+                # 全部补发完毕：开始新段，旧段随后删除，磁盘占用回到零
+                if self._file is None:
+                    self._file = open(self._segment_path(self._active), 'ab', buffering=0)
+                self._roll()
+                self._cursor = (self._active, 0)
+            self._save_cursor()
+            for segment in self._segments():
+                if segment < self._cursor[0]:
+                    os.remove(self._segment_path(segment))
+
+    def sync(self):
+        with self._lock:
+            if self._file is not None and self._dirty and self.fsync != 'never':
+                os.fsync(self._file.fileno())
+            self._dirty = False
+            self._last_sync = time.monotonic()
+
+    def maybe_sync(self):
+        with self._lock:
+            if self._dirty and self.fsync == 'interval' and time.monotonic() - self._last_sync >= self.fsync_interval:
+                self.sync()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self.sync()
+                self._file.close()
+                self._file = None
@@ -1,46 +1,86 @@
 import asyncio
 import json
 import logging
-from rabbitmq_client import AsyncRabbitMQClient
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('rabbitmq.log', mode='a')
-    ]
-)
+import os
+from log_setup import setup_logging
+from delivery_verifier import DeliveryVerifier
+from rabbitmq_client import AsyncRabbitMQClient, backoff_delays
+from serializers import decode_message
+
+# 配置日志（异步写入 rabbitmq.log，见 log_setup.py）
+setup_logging()
 logger = logging.getLogger(__name__)
 
-async def callback(message):
+def make_callback(client):
+    async def callback(message):
+        try:
+            # 消息体由客户端记录（LOG_PAYLOADS=1 时按采样/限流），这里不再逐条记录
+            # 按 content_type / content_encoding 自动解码（兼容未设置内容头的旧消息）
+            data = decode_message(message)
+            if isinstance(data, bytes):
+                data = json.loads(data)
+            logger.debug(f"处理消息 ID: {data.get('id')}")
+            await client.ack_message(message)  # 手动确认（合并发送）
+        except Exception as e:
+            logger.info(f"处理消息失败: {e}")
+            # 延迟 1s/5s/25s 重试，仍失败则转入 hello.dlq，不丢弃也不立即重投
+            await client.retry_message(message, e)
+    return callback
+
+def create_client():
+    # 设置 DELIVERY_REPORT 时按消息头中的 run_id / 序号校验投递，统计定期写入该 JSON 文件
+    verifier = DeliveryVerifier() if os.environ.get('DELIVERY_REPORT') else None
+    return AsyncRabbitMQClient(queue='hello', prefetch_count=100, concurrency=10, ack_batch_size=50,
+                               retry_delays=backoff_delays(1, 5, 3), delivery_verifier=verifier)
+
+async def write_delivery_report(verifier, path, interval=1):
+    while True:
+        await asyncio.sleep(interval)
+        verifier.save(path)
+
+async def run(client, stop_event=None, metrics_port=None):
+    """
+    连接并消费，直到出错或 stop_event 被设置。
+
+    停止时先取消拉取，等待进行中的回调完成并刷新合并确认；
+    prefetch 窗口中未处理的消息在连接关闭后由 broker 重新投递。
+    """
+    await client.connect()
+    await client.declare_queue(durable=True)
+    if metrics_port:
+        await client.metrics.start_http_server(port=metrics_port)
+
+    # 启动消费者
+    consumer_task = asyncio.create_task(client.consume_messages(make_callback(client)))
+    # 启动监控
+    monitor_task = asyncio.create_task(client.monitor_queue())
+    tasks = {consumer_task, monitor_task}
+    if stop_event is not None:
+        tasks.add(asyncio.create_task(stop_event.wait()))
+    report_path = os.environ.get('DELIVERY_REPORT')
+    if client.delivery_verifier is not None and report_path:
+        tasks.add(asyncio.create_task(write_delivery_report(client.delivery_verifier, report_path)))
     try:
-        body = message.body.decode()
-        logger.info(f"Received: {body}")
-        data = json.loads(body)
-        logger.debug(f"处理消息 ID: {data.get('id')}")
-        await message.ack()  # 手动确认
-    except Exception as e:
-        logger.info(f"处理消息失败: {e}")
-        await message.nack(requeue=False)  # 失败不重入队列
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if client.delivery_verifier is not None and report_path:
+            client.delivery_verifier.save(report_path)
+    for task in done:
+        if task in (consumer_task, monitor_task) and not task.cancelled() and task.exception():
+            raise task.exception()
 
 async def main():
-    client = AsyncRabbitMQClient(queue='hello')
+    client = create_client()
     try:
-        await client.connect()
-        await client.declare_queue(durable=True)
-        
-        # 启动消费者
-        consumer_task = asyncio.create_task(client.consume_messages(callback))
-        # 启动监控
-        monitor_task = asyncio.create_task(client.monitor_queue())
-        
-        await asyncio.gather(consumer_task, monitor_task)
+        # 设置 METRICS_PORT 时以 Prometheus 文本格式暴露 /metrics
+        await run(client, metrics_port=int(os.environ.get('METRICS_PORT') or 0))
     except Exception as e:
         logger.info(f"运行失败: {e}")
     finally:
         await client.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -1,24 +1,28 @@
 import asyncio
 import logging
+import os
+from log_setup import setup_logging
 from rabbitmq_client import AsyncRabbitMQClient
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('rabbitmq.log', mode='a')
-    ]
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 async def main():
-    client = AsyncRabbitMQClient(queue='hello')
+    # 设置 OUTBOX_DIR 时启用本地 outbox：broker 不可用时消息先写入磁盘，下次连接成功后补发
+    client = AsyncRabbitMQClient(queue='hello', outbox=os.environ.get('OUTBOX_DIR'))
     try:
-        await client.connect()
-        await client.declare_queue(durable=True)
+        try:
+            await client.connect()
+            await client.declare_queue(durable=True)
+        except Exception:
+            if client.outbox is None:
+                raise
+            logger.info("RabbitMQ 不可用，消息写入本地 outbox")
         message = {"id": 1, "content": "Hello, RabbitMQ!"}
         await client.publish_message(message)
+        if client.outbox is not None and client.channel:
+            # 退出前补发 outbox 中积压的消息（含之前几次运行留下的）
+            await asyncio.wait_for(client.drain_outbox(), client.confirm_timeout)
     except Exception as e:
         logger.info(f"操作失败: {e}")
     finally:
@@ -0,0 +1,108 @@
+import gzip
+import json
+
+# 可选依赖：未安装时对应的序列化/压缩方式不可用
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+JSON_CONTENT_TYPE = 'application/json'
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+
+# 名称 -> (content_type, 编码函数)
+SERIALIZERS = {'json': (JSON_CONTENT_TYPE, lambda obj: json.dumps(obj).encode())}
+# content_type -> 解码函数；orjson 可用时优先用它解码 JSON
+DESERIALIZERS = {JSON_CONTENT_TYPE: json.loads}
+if orjson:
+    SERIALIZERS['orjson'] = (JSON_CONTENT_TYPE, orjson.dumps)
+    DESERIALIZERS[JSON_CONTENT_TYPE] = orjson.loads
+if msgpack:
+    SERIALIZERS['msgpack'] = (MSGPACK_CONTENT_TYPE, lambda obj: msgpack.packb(obj, use_bin_type=True))
+    DESERIALIZERS[MSGPACK_CONTENT_TYPE] = lambda body: msgpack.unpackb(body, raw=False)
+
+# content_encoding -> (压缩函数, 解压函数)
+COMPRESSORS = {'gzip': (lambda body: gzip.compress(body, compresslevel=1), gzip.decompress)}
+if zstandard:
+    COMPRESSORS['zstd'] = (
+        lambda body: zstandard.ZstdCompressor().compress(body),
+        lambda body: zstandard.ZstdDecompressor().decompress(body)
+    )
+if lz4:
+    COMPRESSORS['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+
+
+class MessageCodec:
+    def __init__(self, serializer='json', compression=None, compress_threshold=1024):
+        """
+        消息编解码器。
+
+        Args:
+            serializer (str): 序列化方式，'json'、'orjson' 或 'msgpack'。
+            compression (str, optional): 压缩方式，'gzip'、'zstd' 或 'lz4'，None 表示不压缩。
+            compress_threshold (int): 消息体超过该字节数才压缩，小消息压缩得不偿失。
+
+        Raises:
+            ValueError: 如果序列化或压缩方式未知，或对应的依赖未安装。
+        """
+        if serializer not in SERIALIZERS:
+            raise ValueError(f"不支持的序列化方式（未知或未安装依赖）: {serializer}")
+        if compression is not None and compression not in COMPRESSORS:
+            raise ValueError(f"不支持的压缩方式（未知或未安装依赖）: {compression}")
+        self.serializer = serializer
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+
+    def encode(self, payload):
+        """
+        编码消息。
+
+        Returns:
+            tuple: (body, content_type, content_encoding)。bytes 负载原样发送，content_type 为 None。
+        """
+        if isinstance(payload, (bytes, bytearray, memoryview)):
+            body, content_type = bytes(payload), None
+        else:
+            content_type, dumps = SERIALIZERS[self.serializer]
+            body = dumps(payload)
+        content_encoding = None
+        if self.compression and len(body) > self.compress_threshold:
+            body = COMPRESSORS[self.compression][0](body)
+            content_encoding = self.compression
+        return body, content_type, content_encoding
+
+
+def decode_body(body, content_type=None, content_encoding=None):
+    """
+    按 AMQP content_type / content_encoding 头解码消息体。
+
+    Raises:
+        ValueError: 如果压缩方式未安装对应依赖，或 content_type 无法识别。
+    """
+    if content_encoding:
+        if content_encoding not in COMPRESSORS:
+            raise ValueError(f"无法解压消息，缺少 {content_encoding} 支持")
+        body = COMPRESSORS[content_encoding][1](body)
+    if content_type is None or content_type == BINARY_CONTENT_TYPE:
+        return body
+    if content_type not in DESERIALIZERS:
+        raise ValueError(f"无法解码消息，未知 content_type: {content_type}")
+    return DESERIALIZERS[content_type](body)
+
+
+def decode_message(message):
+    """根据消息自身的内容头解码 aio_pika 消息体。"""
+    return decode_body(message.body, message.content_type, message.content_encoding)
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from delivery_verifier import RangeSet
+
+# 日志由 rabbitmq_client 统一配置
+logger = logging.getLogger(__name__)
+
+# 分块传输的消息头：流 ID、块序号（从 0 开始）、块大小（最后一块可以更短）、
+# 是否最后一块、整个流的字节数（只在最后一块上）、发布端附带的元数据（只在第一块上）
+STREAM_ID_HEADER = 'x-stream-id'
+STREAM_INDEX_HEADER = 'x-stream-index'
+STREAM_CHUNK_SIZE_HEADER = 'x-stream-chunk-size'
+STREAM_FINAL_HEADER = 'x-stream-final'
+STREAM_SIZE_HEADER = 'x-stream-size'
+STREAM_META_HEADER = 'x-stream-meta'
+STREAM_CONTENT_TYPE = 'application/octet-stream'
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+async def iter_source_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    把 bytes、文件路径、二进制文件对象或（异步）字节迭代器切成最多 chunk_size 字节的块。
+
+    文件在线程中读取，不阻塞事件循环；迭代器产出的片段会重新拼成整块。
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for offset in range(0, len(view), chunk_size):
+            yield bytes(view[offset:offset + chunk_size])
+        return
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            async for chunk in iter_source_chunks(f, chunk_size):
+                yield chunk
+        return
+    if hasattr(source, 'read'):
+        while True:
+            chunk = await asyncio.to_thread(source.read, chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    pending = bytearray()
+    if hasattr(source, '__aiter__'):
+        async for part in source:
+            pending += part
+            while len(pending) >= chunk_size:
+                yield bytes(pending[:chunk_size])
+                del pending[:chunk_size]
+    else:
+        for part in source:
+            pending += part
+            while len(pending) >= chunk_size:
+                yield bytes(pending[:chunk_size])
+                del pending[:chunk_size]
+    if pending:
+        yield bytes(pending)
+
+def is_stream_chunk(message):
+    return STREAM_ID_HEADER in (message.headers or {})
+
+def _header_text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class ReceivedStream:
+    """重组完成的流：内容在 SpooledTemporaryFile 中，超过内存上限的部分已落盘。"""
+
+    def __init__(self, stream_id, metadata, file, size):
+        self.stream_id = stream_id
+        self.metadata = metadata
+        self.file = file
+        self.size = size
+
+    def read(self):
+        """一次性读出全部内容，只适合小流。"""
+        self.file.seek(0)
+        return self.file.read()
+
+    async def iter_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """按块读取内容，内存占用不超过 chunk_size。"""
+        self.file.seek(0)
+        while True:
+            chunk = await asyncio.to_thread(self.file.read, chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+
+class _PartialStream:
+    __slots__ = ('file', 'received', 'final_index', 'size', 'metadata', 'updated_at')
+
+    def __init__(self, spool_max_memory):
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_max_memory)
+        self.received = RangeSet()
+        self.final_index = None
+        self.size = None
+        self.metadata = None
+        self.updated_at = time.monotonic()
+
+
+class StreamAssembler:
+    """
+    按流 ID 重组分块消息：每块按 序号 * 块大小 写入该流的临时文件，因此乱序或重复投递的块都能正确处理。
+
+    每个未完成的流在内存中最多占用 spool_max_memory 字节，超出后自动转存到磁盘临时文件。
+    超过 stream_timeout 秒没有收到新块的流视为发布端已放弃，丢弃已收到的部分。
+    """
+
+    def __init__(self, spool_max_memory=8 * 1024 * 1024, stream_timeout=300):
+        self.spool_max_memory = spool_max_memory
+        self.stream_timeout = stream_timeout
+        self._streams = {}
+
+    def __len__(self):
+        return len(self._streams)
+
+    def add(self, message):
+        """写入一块，流完整时返回 ReceivedStream（调用方负责 close），否则返回 None。"""
+        headers = message.headers or {}
+        stream_id = _header_text(headers[STREAM_ID_HEADER])
+        index = int(headers[STREAM_INDEX_HEADER])
+        partial = self._streams.get(stream_id)
+        if partial is None:
+            partial = self._streams[stream_id] = _PartialStream(self.spool_max_memory)
+        partial.updated_at = time.monotonic()
+        if not partial.received.add(index):
+            logger.debug(f"流 {stream_id} 的第 {index} 块重复，已忽略")
+            return None
+        partial.file.seek(index * int(headers[STREAM_CHUNK_SIZE_HEADER]))
+        partial.file.write(message.body)
+        if STREAM_META_HEADER in headers:
+            partial.metadata = headers[STREAM_META_HEADER]
+        if headers.get(STREAM_FINAL_HEADER):
+            partial.final_index = index
+            partial.size = int(headers[STREAM_SIZE_HEADER])
+        if partial.final_index is None or len(partial.received) < partial.final_index + 1:
+            return None
+        del self._streams[stream_id]
+        partial.file.seek(0, os.SEEK_END)
+        size = partial.file.tell()
+        if size != partial.size:
+            partial.file.close()
+            raise ValueError(f"流 {stream_id} 重组后为 {size} 字节，应为 {partial.size} 字节")
+        return ReceivedStream(stream_id, partial.metadata, partial.file, partial.size)
+
+    def expire(self):
+        """丢弃超时未完成的流，返回它们的 ID。"""
+        deadline = time.monotonic() - self.stream_timeout
+        expired = [stream_id for stream_id, partial in self._streams.items() if partial.updated_at < deadline]
+        for stream_id in expired:
+            partial = self._streams.pop(stream_id)
+            logger.info(f"流 {stream_id} 超过 {self.stream_timeout}s 未完成（已收到 {len(partial.received)} 块），已丢弃")
+            partial.file.close()
+        return expired
+
+    def close(self):
+        for partial in self._streams.values():
+            partial.file.close()
+        self._streams.clear()
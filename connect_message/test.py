@@ -8,6 +8,7 @@ import logging
 from logging.handlers import RotatingFileHandler
 import requests
 import json
+from fake_broker import FakeBrokerThread
 
 # 配置日志，仅写入 test.log
 logging.basicConfig(
@@ -24,6 +25,32 @@ rabbitmq_logger = logging.getLogger('rabbitmq_client')
 processes = []
 test_results = []
 
+# 高并发测试：发送端写入的 run_id，消费端按序号校验后写出的报告文件
+HIGH_CONCURRENCY_RUN = 'high-concurrency'
+DELIVERY_REPORT = 'delivery_report.json'
+
+# --fake-broker 模式下使用进程内 FakeBroker 代替真实 RabbitMQ，等待时间按 SLEEP_SCALE 缩短
+fake_broker = None
+SLEEP_SCALE = 1.0
+MANAGEMENT_URL = 'http://localhost:15672/api/queues'
+FAKE_BROKER_PORT = 5673
+FAKE_MANAGEMENT_PORT = 15673
+
+def pause(seconds):
+    time.sleep(seconds * SLEEP_SCALE)
+
+def list_queues():
+    if fake_broker:
+        stats = fake_broker.run(fake_broker.broker.queue_stats)
+        return True, '\n'.join(f"{item['name']}\t{item['messages']}" for item in stats)
+    return run_command(['rabbitmqctl', 'list_queues', 'name', 'messages'])
+
+def set_management_plugin(enabled):
+    if fake_broker:
+        fake_broker.call(fake_broker.broker.set_management_enabled(enabled))
+        return True, ""
+    return run_command(['rabbitmq-plugins', 'enable' if enabled else 'disable', 'rabbitmq_management'])
+
 def check_log(expect_received=True, expect_retry=False, expect_api_failure=False):
     try:
         with open('rabbitmq.log', 'r') as f:
@@ -61,6 +88,9 @@ def run_command(cmd, timeout=30):
         return False, f"命令 {cmd} 错误: {e}"
 
 def check_rabbitmq_status():
+    if fake_broker:
+        running = fake_broker.broker.running
+        return running, "FakeBroker 运行中" if running else "FakeBroker 未运行"
     cmd = ['rabbitmqctl', 'status']
     success, msg = run_command(cmd, timeout=10)
     return success, msg
@@ -104,13 +134,17 @@ def cleanup_rabbitmq_processes():
         success, msg = run_command(cmd)
         if success:
             logger.info(f"清理进程: {cmd}")
-    time.sleep(2)
+    pause(2)
     return True, ""
 
 def ensure_rabbitmq_running():
     success, msg = check_rabbitmq_status()
     if success:
         return True, ""
+
+    if fake_broker:
+        fake_broker.call(fake_broker.broker.start())
+        return True, ""
     
     logger.info("启动 RabbitMQ，可能需要输入 sudo 密码...")
     cleanup_rabbitmq_processes()
@@ -127,7 +161,7 @@ def ensure_rabbitmq_running():
         success, msg = run_command(cmd, timeout=60)
         if success:
             for _ in range(3):
-                time.sleep(20)
+                pause(20)
                 success, status_msg = check_rabbitmq_status()
                 if success:
                     logger.info("RabbitMQ 启动成功")
@@ -146,6 +180,12 @@ def ensure_rabbitmq_running():
     return False, f"无法启动 RabbitMQ: {msg}"
 
 def stop_rabbitmq():
+    if fake_broker:
+        if fake_broker.broker.running:
+            fake_broker.call(fake_broker.broker.stop())
+        logger.info("RabbitMQ 已停止")
+        return True, ""
+
     commands = [
         ['rabbitmq-plugins', 'disable', 'rabbitmq_management'],
         ['sudo', 'rabbitmqctl', 'stop'],
@@ -157,7 +197,7 @@ def stop_rabbitmq():
         logger.info(f"尝试停止: {cmd}")
         success, msg = run_command(cmd)
         if success:
-            time.sleep(10)
+            pause(10)
             if not check_rabbitmq_status()[0]:
                 logger.info("RabbitMQ 已停止")
                 return True, ""
@@ -183,12 +223,16 @@ def reset_environment():
     cleanup_processes()
     if os.path.exists('rabbitmq.log'):
         os.remove('rabbitmq.log')
+    if os.path.exists(DELIVERY_REPORT):
+        os.remove(DELIVERY_REPORT)
     if os.path.exists('send_high.py'):
         os.remove('send_high.py')
     
     stop_rabbitmq()
     success, msg = ensure_rabbitmq_running()
-    if success:
+    if success and fake_broker:
+        fake_broker.run(fake_broker.broker.delete_queue, 'hello')
+    elif success:
         run_command(['rabbitmqctl', 'delete_queue', 'hello'])
     else:
         logger.error(f"环境重置失败: {msg}")
@@ -222,34 +266,34 @@ def run_test(name, func, **check_args):
 def test_multiple_messages():
     receiver = subprocess.Popen(['python', 'receive.py'])
     processes.append(receiver)
-    time.sleep(5)
+    pause(5)
     for i in range(10):
         logger.info(f"发送消息 {i+1}/10")
         success, msg = run_command(['python', 'send.py'])
         if not success:
             return False, f"发送失败: {msg}"
-        time.sleep(0.2)
-    time.sleep(2)
+        pause(0.2)
+    pause(2)
     return check_log(expect_received=True)
 
 def test_persistence():
     logger.info("检查初始队列状态...")
-    success, queue_info = run_command(['rabbitmqctl', 'list_queues', 'name', 'messages'])
+    success, queue_info = list_queues()
     if success and 'hello' in queue_info:
         logger.info(f"队列状态: {queue_info}")
     
     receiver = subprocess.Popen(['python', 'receive.py'])
     processes.append(receiver)
-    time.sleep(5)
+    pause(5)
     
     for i in range(5):
         logger.info(f"发送消息 {i+1}/5")
         success, msg = run_command(['python', 'send.py'])
         if not success:
             return False, f"发送失败: {msg}"
-        time.sleep(0.2)
+        pause(0.2)
     
-    success, queue_info = run_command(['rabbitmqctl', 'list_queues', 'name', 'messages'])
+    success, queue_info = list_queues()
     if success:
         logger.info(f"发送后队列状态: {queue_info}")
     
@@ -263,19 +307,19 @@ def test_persistence():
     if not success:
         return False, msg
     
-    success, queue_info = run_command(['rabbitmqctl', 'list_queues', 'name', 'messages'])
+    success, queue_info = list_queues()
     if success:
         logger.info(f"重启后队列状态: {queue_info}")
     
     cleanup_processes()
     receiver = subprocess.Popen(['python', 'receive.py'])
     processes.append(receiver)
-    time.sleep(15)
+    pause(15)
     
     cleanup_processes()
     receiver = subprocess.Popen(['python', 'receive.py'])
     processes.append(receiver)
-    time.sleep(15)
+    pause(15)
     
     return check_log(expect_received=True)
 
@@ -283,14 +327,14 @@ def test_multiple_consumers():
     receiver1 = subprocess.Popen(['python', 'receive.py'])
     receiver2 = subprocess.Popen(['python', 'receive.py'])
     processes.extend([receiver1, receiver2])
-    time.sleep(5)
+    pause(5)
     for i in range(10):
         logger.info(f"发送消息 {i+1}/10")
         success, msg = run_command(['python', 'send.py'])
         if not success:
             return False, f"发送失败: {msg}"
-        time.sleep(0.2)
-    time.sleep(2)
+        pause(0.2)
+    pause(2)
     return check_log(expect_received=True)
 
 def test_connection_failure():
@@ -298,10 +342,10 @@ def test_connection_failure():
     success, msg = stop_rabbitmq()
     if not success:
         return False, msg
-    time.sleep(10)
+    pause(10)
     receiver = subprocess.Popen(['python', 'receive.py'])
     processes.append(receiver)
-    time.sleep(5)
+    pause(5)
     logger.info("尝试在 RabbitMQ 停止时发送消息...")
     success, msg = run_command(['python', 'send.py'], timeout=10)
     if success:
@@ -311,25 +355,26 @@ def test_connection_failure():
     success, msg = ensure_rabbitmq_running()
     if not success:
         return False, msg
-    time.sleep(5)
+    pause(5)
     return check_log(expect_received=False, expect_retry=True)
 
 def test_high_concurrency():
     # 检查初始队列状态
-    success, queue_info = run_command(['rabbitmqctl', 'list_queues', 'name', 'messages'])
+    success, queue_info = list_queues()
     if success:
         logger.info(f"初始队列状态: {queue_info}")
     
-    # 启动消费者
-    receiver = subprocess.Popen(['python', 'receive.py'])
+    # 启动消费者，按消息序号校验投递
+    receiver = subprocess.Popen(['python', 'receive.py'], env={**os.environ, 'DELIVERY_REPORT': DELIVERY_REPORT})
     processes.append(receiver)
-    time.sleep(5)
+    pause(5)
     
     # 运行高并发发送
     logger.info("开始高并发测试，发送 500 条消息...")
     with open('send_high.py', 'w') as f:
         f.write('''
 import asyncio
+from delivery_verifier import SequenceStamper
 from rabbitmq_client import AsyncRabbitMQClient
 import logging
 import json
@@ -345,18 +390,15 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 async def main():
-    client = AsyncRabbitMQClient(queue='hello')
+    client = AsyncRabbitMQClient(queue='hello', sequence_stamper=SequenceStamper(RUN_ID))
     try:
         await client.connect()
         await client.declare_queue(durable=True)
-        for batch in range(0, 500, 100):
-            tasks = []
-            for i in range(batch, min(batch + 100, 500)):
-                message = {"id": i, "content": f"Hello, RabbitMQ! {i}"}
-                tasks.append(client.publish_message(message))
-            await asyncio.gather(*tasks)
-            logger.info(f"已发送 {min(batch + 100, 500)}/500 条消息")
-            await asyncio.sleep(0.1)
+        messages = [{"id": i, "content": f"Hello, RabbitMQ! {i}"} for i in range(500)]
+        results = await client.publish_batch(messages, max_in_flight=100)
+        nacked = [i for i, (ok, _) in enumerate(results) if not ok]
+        if nacked:
+            raise RuntimeError(f"{len(nacked)} 条消息未被确认: {nacked[:10]}")
         logger.info("全部 500 条消息发送完成")
     except Exception as e:
         logger.info(f"高并发发送失败: {e}")
@@ -365,53 +407,47 @@ async def main():
 
 if __name__ == "__main__":
     asyncio.run(main())
-''')
+'''.replace('RUN_ID', repr(HIGH_CONCURRENCY_RUN)))
     success, msg = run_command(['python', 'send_high.py'])
     if not success:
         return False, f"高并发发送失败: {msg}"
     
     # 等待消费者处理
-    time.sleep(10)
+    pause(10)
     
     # 检查队列状态
-    success, queue_info = run_command(['rabbitmqctl', 'list_queues', 'name', 'messages'])
+    success, queue_info = list_queues()
     if success:
         logger.info(f"消费后队列状态: {queue_info}")
     
     cleanup_processes()
     success, msg = check_log(expect_received=True)
     if success:
-        with open('rabbitmq.log', 'r') as f:
-            log = f.read()
-            received_count = len([line for line in log.splitlines() if 'Received: {' in line])
-            logger.info(f"高并发测试收到 {received_count}/500 条消息")
-            if received_count < 500:
-                return False, f"预期 500 条 Received，实际 {received_count} 条"
-            received_msgs = [line for line in log.splitlines() if 'Received: {' in line]
-            actual_ids = set()
-            for msg in received_msgs:
-                try:
-                    data = json.loads(msg.split('Received: ')[1])
-                    id_val = data.get('id')
-                    if id_val is not None:
-                        actual_ids.add(f'"id": {id_val}')
-                except (json.JSONDecodeError, KeyError, IndexError):
-                    continue
-            expected_ids = set(f'"id": {i}' for i in range(500))
-            missing_ids = expected_ids - actual_ids
-            if missing_ids:
-                return False, f"缺少消息 ID: {missing_ids}"
+        # 消费端按 run_id / 序号增量统计，不再逐行解析日志
+        try:
+            with open(DELIVERY_REPORT, 'r') as f:
+                report = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            return False, f"读取投递校验报告失败: {e}"
+        run = report['runs'].get(HIGH_CONCURRENCY_RUN)
+        if run is None:
+            return False, "未收到带序号的消息"
+        # 发送端序号为 0..499，末尾未到达的消息不在 gaps 中，按去重后的数量计算
+        missing = 500 - run['unique']
+        logger.info(f"高并发测试收到 {run['unique']}/500 条消息，重复 {run['duplicates']}，乱序 {run['reordered']}")
+        if missing:
+            return False, f"丢失 {missing} 条消息，缺失序号区间: {run['gaps']}"
     return success, msg
 
 def test_management_api_failure():
     logger.info("禁用管理插件...")
-    success, msg = run_command(['rabbitmq-plugins', 'disable', 'rabbitmq_management'])
+    success, msg = set_management_plugin(False)
     if not success:
         return False, f"禁用插件失败: {msg}"
-    time.sleep(5)
+    pause(5)
     
     try:
-        response = requests.get('http://localhost:15672/api/queues', auth=('guest', 'guest'), timeout=5)
+        response = requests.get(MANAGEMENT_URL, auth=('guest', 'guest'), timeout=5)
         rabbitmq_logger.info(f"管理 API 意外成功: {response.status_code}")
         return False, "管理 API 未被禁用"
     except requests.RequestException as e:
@@ -419,7 +455,7 @@ def test_management_api_failure():
     
     receiver = subprocess.Popen(['python', 'receive.py'])
     processes.append(receiver)
-    time.sleep(5)
+    pause(5)
     
     logger.info("在管理 API 禁用时发送消息...")
     success, msg = run_command(['python', 'send.py'])
@@ -428,13 +464,13 @@ def test_management_api_failure():
     
     cleanup_processes()
     logger.info("重新启用管理插件...")
-    success, msg = run_command(['rabbitmq-plugins', 'enable', 'rabbitmq_management'])
+    success, msg = set_management_plugin(True)
     if not success:
         logger.warning(f"重新启用插件失败: {msg}")
     
-    time.sleep(5)
+    pause(5)
     try:
-        response = requests.get('http://localhost:15672/api/queues', auth=('guest', 'guest'), timeout=5)
+        response = requests.get(MANAGEMENT_URL, auth=('guest', 'guest'), timeout=5)
         rabbitmq_logger.info(f"管理 API 恢复: {response.status_code}")
     except requests.RequestException as e:
         rabbitmq_logger.warning(f"管理 API 恢复失败: {e}")
@@ -446,7 +482,7 @@ def test_log_integrity():
         logger.info(f"运行 {i+1}/3")
         receiver = subprocess.Popen(['python', 'receive.py'])
         processes.append(receiver)
-        time.sleep(5)
+        pause(5)
         success, msg = run_command(['python', 'send.py'])
         if not success:
             return False, f"发送失败: {msg}"
@@ -463,7 +499,7 @@ def test_queue_backlog():
     logger.info("启动消费者...")
     receiver = subprocess.Popen(['python', 'receive.py'])
     processes.append(receiver)
-    time.sleep(5)
+    pause(5)
     cleanup_processes()
     success, msg = check_log(expect_received=True)
     if success:
@@ -474,14 +510,75 @@ def test_queue_backlog():
                 return False, f"预期 50 条 Received，实际 {received_count} 条"
     return success, msg
 
+def test_components():
+    # outbox、合并确认、投递校验、分块重组等组件的纯 Python 检查，不经过 broker
+    success, msg = run_command(['python', 'component_checks.py'], timeout=60)
+    if not success:
+        return False, f"组件自检失败: {msg[-500:]}"
+    return True, "组件自检通过"
+
+def run_broker_check(check, description):
+    # component_checks.py 中需要 broker 的检查，连接 RABBITMQ_URL（--fake-broker 时为 FakeBroker）
+    success, msg = run_command(['python', 'component_checks.py', '--broker', check], timeout=60)
+    if not success:
+        return False, f"{check} 检查未通过: {msg[-500:]}"
+    return True, description
+
+def test_ack_then_raise():
+    # 合并确认时回调先确认再抛异常，消息不应再进入重试队列被处理第二次
+    return run_broker_check('ack_then_raise', "确认后失败的消息未被重复处理")
+
+def test_codec():
+    # 大消息按阈值压缩，content_type / content_encoding 随消息发送，消费端按内容头解码
+    return run_broker_check('codec', "编解码与压缩头正确")
+
+def test_backpressure():
+    # 高水位 shed 策略与 connection.blocked 期间的拒绝/等待
+    return run_broker_check('backpressure', "背压丢弃与连接阻塞处理正确")
+
+def test_dedup():
+    # 重复投递（含处理中到达的副本、批内副本）回调只执行一次，sqlite 去重记录重启后仍有效
+    return run_broker_check('dedup', "重复消息只处理一次")
+
+def test_batch_results():
+    # 微批消费按逐条结果确认或重试，回调抛出异常时整批重试
+    return run_broker_check('batch_results', "批次逐条结果处理正确")
+
+def test_rpc():
+    # call/reply 往返、服务端错误和超时
+    return run_broker_check('rpc', "RPC 调用与回复正确")
+
+def test_shards():
+    # 按键分片、无键轮询，消费端只订阅部分分片
+    return run_broker_check('shards', "分片路由与订阅正确")
+
+def test_streams():
+    # 分块发布与重组：多种来源并发发布，元数据和内容完整还原
+    return run_broker_check('streams', "分块流往返正确")
+
 def main():
     parser = argparse.ArgumentParser(description="运行 RabbitMQ 测试")
     parser.add_argument('--skip-slow', action='store_true',
                         help="跳过慢速测试（高并发、队列积压）")
     parser.add_argument('--test', type=str,
                         help="运行指定测试（例如 '多条消息'）")
+    parser.add_argument('--fake-broker', action='store_true',
+                        help="使用进程内 FakeBroker，无需安装 RabbitMQ")
     cmd_args = parser.parse_args()
 
+    if cmd_args.fake_broker:
+        global fake_broker, SLEEP_SCALE, MANAGEMENT_URL
+        fake_broker = FakeBrokerThread(port=FAKE_BROKER_PORT, management_port=FAKE_MANAGEMENT_PORT)
+        fake_broker.start()
+        SLEEP_SCALE = 0.2
+        MANAGEMENT_URL = f'http://localhost:{FAKE_MANAGEMENT_PORT}/api/queues'
+        # 子进程（receive.py / send.py）通过 RABBITMQ_URL 连接 FakeBroker
+        os.environ['RABBITMQ_URL'] = fake_broker.broker.url + '?heartbeat=30'
+
+    # 日志检查按 "Received: {...}" 行计数：子进程需记录消息体且不限流
+    os.environ['LOG_PAYLOADS'] = '1'
+    os.environ['LOG_MAX_PER_SECOND'] = '0'
+
     tests = {
         "多条消息": (test_multiple_messages, {}),
         "持久化": (test_persistence, {}),
@@ -490,7 +587,16 @@ def main():
         "管理 API 失败": (test_management_api_failure, {'expect_api_failure': True}),
         "日志完整性": (test_log_integrity, {}),
         "高并发": (test_high_concurrency, {}),
-        "队列积压": (test_queue_backlog, {})
+        "队列积压": (test_queue_backlog, {}),
+        "组件自检": (test_components, {}),
+        "确认后失败": (test_ack_then_raise, {}),
+        "编解码": (test_codec, {}),
+        "背压丢弃": (test_backpressure, {}),
+        "去重": (test_dedup, {}),
+        "批次结果": (test_batch_results, {}),
+        "RPC": (test_rpc, {}),
+        "分片路由": (test_shards, {}),
+        "分块流": (test_streams, {})
     }
 
     selected_tests = []